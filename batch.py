@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# Без приветствия pygame в каждом воркере
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import game
+
+# Пакетный прогон безголовых симуляций на всех ядрах.
+# Каждый забег детерминирован своим зерном, результаты сводятся в общую статистику:
+# достигнутые уровни, заработанные монеты, смерти по уровням, покупки
+# в магазине и распределение времени кадра.
+#
+# Пример: python batch.py --runs 10000 --json results.json
+
+# Политики автоматического игрока
+POLICIES = {
+    "bot": game.BotController,
+}
+
+# Ширина корзины гистограммы времени кадра (мкс)
+FRAME_BUCKET_US = 10
+
+
+# Инициализация процесса-воркера: pygame без окна
+def init_worker():
+    game.init_display(headless_mode=True)
+
+
+# Один забег в воркере; время кадров сразу сворачивается в гистограмму,
+# чтобы не гонять миллионы чисел между процессами
+def run_one(args):
+    seed, policy, max_frames = args
+    frame_times = []
+    stats = game.simulate(POLICIES[policy](), seed, max_frames, frame_times)
+    histogram = Counter(int(t * 1e6) // FRAME_BUCKET_US for t in frame_times)
+    stats["frame_histogram"] = dict(histogram)
+    return stats
+
+
+# Перцентиль по гистограмме {корзина: количество} (в мкс, по верхней границе корзины)
+def histogram_percentile(histogram, fraction):
+    total = sum(histogram.values())
+    if total == 0:
+        return 0
+    threshold = fraction * total
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= threshold:
+            return (bucket + 1) * FRAME_BUCKET_US
+    return (max(histogram) + 1) * FRAME_BUCKET_US
+
+
+# Сводная статистика по всем забегам
+def aggregate(results):
+    levels = Counter()
+    deaths = Counter()
+    purchases = Counter()
+    frames = Counter()
+    coins = 0
+    total_frames = 0
+    for stats in results:
+        levels[stats["level"]] += 1
+        if stats["died"]:
+            deaths[stats["level"]] += 1
+        purchases.update(stats["purchases"])
+        frames.update(stats["frame_histogram"])
+        coins += stats["coins_earned"]
+        total_frames += stats["frames"]
+
+    runs = len(results)
+    return {
+        "runs": runs,
+        "levels_reached": dict(sorted(levels.items())),
+        "mean_level": sum(level * n for level, n in levels.items()) / max(runs, 1),
+        "coins_earned": coins,
+        "mean_coins": coins / max(runs, 1),
+        "deaths_per_level": dict(sorted(deaths.items())),
+        "purchases": dict(purchases),
+        "frames": total_frames,
+        "frame_time_us": {
+            "p50": histogram_percentile(frames, 0.50),
+            "p90": histogram_percentile(frames, 0.90),
+            "p99": histogram_percentile(frames, 0.99),
+            "max": histogram_percentile(frames, 1.0),
+        },
+    }
+
+
+def run_batch(runs, policy="bot", first_seed=0, max_frames=100000, workers=None):
+    tasks = [(seed, policy, max_frames) for seed in range(first_seed, first_seed + runs)]
+    workers = workers or os.cpu_count() or 1
+    # Крупные пачки задач, чтобы накладные расходы пула не съедали короткие забеги
+    chunksize = max(1, runs // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        return list(pool.map(run_one, tasks, chunksize=chunksize))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пакетный прогон безголовых симуляций")
+    parser.add_argument("--runs", type=int, default=1000, help="количество забегов")
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="bot", help="политика игрока")
+    parser.add_argument("--seed", type=int, default=0, help="зерно первого забега")
+    parser.add_argument("--frames", type=int, default=100000, help="лимит кадров одного забега")
+    parser.add_argument("--workers", type=int, help="число процессов (по умолчанию все ядра)")
+    parser.add_argument("--json", help="сохранить сводку в JSON-файл")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    results = run_batch(args.runs, args.policy, args.seed, args.frames, args.workers)
+    summary = aggregate(results)
+    summary["wall_time_s"] = round(time.perf_counter() - started, 2)
+
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
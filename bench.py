@@ -0,0 +1,387 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+
+# Настоящий программный рендер без окна
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+import game
+
+# Бенчмарки игрового цикла на настоящих классах Player, Enemy, Bullet и Coin.
+# Каждый сценарий меряет время фаз кадра (ввод, обновление, столкновения,
+# отрисовка, постройка уровня) и выдает p50/p99; результат можно сохранить
+# в JSON и сравнить с прогоном на другом коммите.
+#
+# Пример: python bench.py --json before.json
+#         python bench.py --compare before.json
+
+
+# Неподвижный игрок, стреляющий по кругу во все четыре стороны
+class BenchController:
+    def __init__(self):
+        self.tick = 0
+
+    def start_level(self, tile_map, door_tile):
+        pass
+
+    def get_input(self):
+        self.tick += 1
+        shot = game.SHOT_DIRECTIONS[self.tick % 4][1]
+        return game.encode_input(0, 0, shot)
+
+    def shop(self):
+        return []
+
+
+# Сборщик времени по фазам. frame_phases - фазы, из которых складывается
+# один кадр сценария; у сценариев, где фазы - альтернативы (разные рендеры,
+# снимок и восстановление), их нет, и строки "frame" в отчете тоже нет.
+class PhaseTimer:
+    def __init__(self, frame_phases=()):
+        self.samples = {}
+        self.frame_phases = frame_phases
+
+    def add(self, phase, seconds):
+        self.samples.setdefault(phase, []).append(seconds * 1000)
+
+    def time(self, phase, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        self.add(phase, time.perf_counter() - started)
+        return result
+
+    def summary(self):
+        result = {}
+        for phase, samples in self.samples.items():
+            result[phase] = summarize(samples)
+        # Полное время кадра - сумма фаз кадра
+        frame_phases = [self.samples.get(phase, []) for phase in self.frame_phases]
+        if frame_phases and all(s and len(s) == len(frame_phases[0]) for s in frame_phases):
+            result["frame"] = summarize([sum(values) for values in zip(*frame_phases)])
+        return result
+
+
+def percentile(sorted_samples, fraction):
+    index = min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))
+    return sorted_samples[index]
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered), 4),
+        "p50_ms": round(percentile(ordered, 0.50), 4),
+        "p99_ms": round(percentile(ordered, 0.99), 4),
+        "max_ms": round(ordered[-1], 4),
+    }
+
+
+# Клетки пола текущего уровня
+def floor_tiles():
+    return game.wall_grid.tile_map.floor_tiles()
+
+
+# Новый уровень с заданным числом врагов и улучшениями игрока
+def setup_level(timer, seed, enemy_count, multishot=0, homing=False, horde=False):
+    game.horde_mode = horde
+    game.start_run(seed)
+    game.player_upgrades.multishot_level = multishot
+    game.player_upgrades.has_homing = homing
+    game.clear_sprites()
+    controller = BenchController()
+    door, background, minimap = timer.time("level_build", game.build_level, controller)
+    top_up_enemies(enemy_count)
+    return controller, background, minimap
+
+
+# Досоздаем врагов до нужного количества (вне замера)
+def top_up_enemies(count):
+    tiles = floor_tiles()
+    while len(game.enemies) < count:
+        game.new_enemy(game.tile_center(game.rng.choice(tiles)))
+
+
+# Фазы кадра в run_frames
+RUN_FRAME_PHASES = ("input", "update", "collision", "draw")
+
+
+# Покадровый прогон: ввод, обновление, столкновения, отрисовка
+def run_frames(timer, controller, background, minimap, frames, enemy_count):
+    for _ in range(frames):
+        timer.time("input", game.apply_input, controller)
+        timer.time("update", game.update_world)
+        timer.time("collision", game.resolve_collisions)
+        timer.time("draw", game.draw_frame, background, minimap)
+        game.game_clock.advance()
+        # Вне замера: игрок не должен умереть, число врагов постоянно
+        game.player.health = game.player.max_health
+        top_up_enemies(enemy_count)
+
+
+def scenario_horde(scale):
+    timer = PhaseTimer(RUN_FRAME_PHASES)
+    controller, background, minimap = setup_level(timer, 1, 500)
+    run_frames(timer, controller, background, minimap, int(600 * scale), 500)
+    return timer
+
+
+def scenario_horde_2000(horde):
+    # Большая стая: обычные спрайты против пакетного EnemyHorde
+    def scenario(scale):
+        timer = PhaseTimer(RUN_FRAME_PHASES)
+        controller, background, minimap = setup_level(timer, 1, 2000, horde=horde)
+        run_frames(timer, controller, background, minimap, int(300 * scale), 2000)
+        return timer
+    return scenario
+
+
+def scenario_multishot(scale):
+    timer = PhaseTimer(RUN_FRAME_PHASES)
+    controller, background, minimap = setup_level(timer, 2, 50, multishot=20, homing=True)
+    run_frames(timer, controller, background, minimap, int(600 * scale), 50)
+    return timer
+
+
+def scenario_dungeons(scale):
+    # Генерация карт и структур коллизий/поиска пути без спрайтов
+    timer = PhaseTimer()
+    game.rng.seed(3)
+    for _ in range(int(10000 * scale)):
+        started = time.perf_counter()
+        tile_map, rooms = game.generate_dungeon()
+        game.WallGrid(tile_map)
+        game.FlowField(tile_map).update(rooms[0].center)
+        timer.add("level_build", time.perf_counter() - started)
+    return timer
+
+
+def scenario_render(scale):
+    # Полная отрисовка уровня: фон, миникарта и кадры со спрайтами
+    timer = PhaseTimer()
+    game.rng.seed(4)
+    for _ in range(int(200 * scale)):
+        tile_map, rooms = game.generate_dungeon()
+        started = time.perf_counter()
+        game.render_background(tile_map)
+        game.create_minimap(tile_map)
+        timer.add("level_build", time.perf_counter() - started)
+    controller, background, minimap = setup_level(PhaseTimer(), 4, 30)
+    for _ in range(int(600 * scale)):
+        timer.time("draw", game.draw_frame, background, minimap)
+    return timer
+
+
+def scenario_dirty_render(scale):
+    # Полный кадр (draw + flip) против отрисовки грязными прямоугольниками
+    # на одних и тех же кадрах уровня с 30 врагами
+    timer = PhaseTimer()
+    controller, background, minimap = setup_level(PhaseTimer(), 5, 30)
+    renderer = game.DirtyRenderer()
+    for _ in range(int(600 * scale)):
+        game.step_frame(controller)
+        game.player.health = game.player.max_health
+        timer.time("full_redraw", game.present_frame, background, minimap)
+        timer.time("dirty_redraw", renderer.draw, background, minimap)
+    return timer
+
+
+def scenario_large_map(scale):
+    # Карта 200x150 с прокруткой: бот идет к двери, камера следует за ним.
+    # Цена отрисовки должна зависеть от размера окна, а не карты.
+    timer = PhaseTimer(("step", "draw"))
+    map_size = (game.MAP_WIDTH, game.MAP_HEIGHT)
+    game.configure_map(200, 150)
+    try:
+        game.horde_mode = False
+        game.start_run(6)
+        game.clear_sprites()
+        controller = game.BotController()
+        door, background, minimap = timer.time("level_build", game.build_level, controller)
+        for _ in range(int(600 * scale)):
+            timer.time("step", game.step_frame, controller)
+            game.player.health = game.player.max_health
+            timer.time("draw", game.draw_frame, background, minimap)
+    finally:
+        game.configure_map(*map_size)
+    return timer
+
+
+def scenario_fog(scale):
+    # Туман войны на карте 200x150: поле зрения пересчитывается при смене
+    # клетки бота, затемнение и миникарта дописываются поклеточно
+    timer = PhaseTimer(("step", "fog", "draw"))
+    map_size = (game.MAP_WIDTH, game.MAP_HEIGHT)
+    game.configure_map(200, 150)
+    game.fog_mode = True
+    try:
+        game.horde_mode = False
+        game.start_run(6)
+        game.clear_sprites()
+        controller = game.BotController()
+        door, background, minimap = timer.time("level_build", game.build_level, controller)
+        for _ in range(int(600 * scale)):
+            timer.time("step", game.step_frame, controller)
+            game.player.health = game.player.max_health
+            timer.time("fog", game.fog.update, game.tile_at(game.player.rect.center))
+            timer.time("draw", game.draw_frame, background, minimap)
+    finally:
+        game.fog_mode = False
+        game.configure_map(*map_size)
+    return timer
+
+
+def scenario_ai_lod(scale):
+    # 2000 врагов на карте 200x150: рядом с игроком обновляются каждый тик,
+    # остальные - реже и в пределах бюджета планировщика ИИ
+    timer = PhaseTimer(RUN_FRAME_PHASES)
+    map_size = (game.MAP_WIDTH, game.MAP_HEIGHT)
+    game.configure_map(200, 150)
+    try:
+        controller, background, minimap = setup_level(timer, 7, 2000)
+        run_frames(timer, controller, background, minimap, int(300 * scale), 2000)
+    finally:
+        game.configure_map(*map_size)
+    return timer
+
+
+def scenario_snapshots(scale):
+    # Снимок мира для перемотки и его восстановление на уровне с 200 врагами
+    # и пулями в полете; снимок для сохранения на диск - вместе с картой
+    timer = PhaseTimer()
+    game.horde_mode = False
+    game.start_run(8)
+    game.player_upgrades.multishot_level = 5
+    game.clear_sprites()
+    controller = BenchController()
+    door, background, minimap = game.build_level(controller)
+    for _ in range(int(300 * scale)):
+        top_up_enemies(200)
+        game.step_frame(controller)
+        game.player.health = game.player.max_health
+        data = timer.time("capture", game.WorldSnapshot.capture, door)
+        door, _ = timer.time("restore", game.WorldSnapshot.restore, data)
+        timer.time("capture_map", game.WorldSnapshot.capture, door, 0, True)
+    return timer
+
+
+def scenario_backends(scale):
+    # Один и тот же кадр через все бэкенды вывода: блиттер pygame, текстуры SDL2
+    # и пустой бэкенд (чистая стоимость подготовки кадра без рисования)
+    timer = PhaseTimer()
+    try:
+        for name in game.BACKENDS:
+            game.init_display(backend=name)
+            controller, background, minimap = setup_level(PhaseTimer(), 5, 30)
+            for _ in range(int(600 * scale)):
+                game.step_frame(controller)
+                game.player.health = game.player.max_health
+                timer.time(f"draw_{name}", game.present_frame, background, minimap)
+    finally:
+        game.init_display()
+    return timer
+
+
+def scenario_particles(scale):
+    # Залпы мультивыстрела 40 по 300 врагам: искры, вспышки и пыль от сотен
+    # попаданий за тик; число частиц и цена кадра ограничены пулом частиц
+    timer = PhaseTimer()
+    controller, background, minimap = setup_level(timer, 9, 300, multishot=40)
+    for _ in range(int(600 * scale)):
+        game.apply_input(controller)
+        game.update_world()
+        timer.time("collision", game.resolve_collisions)
+        timer.time("particles_update", game.particles.update)
+        timer.time("particles_draw", game.particles.draw, game.screen, game.camera.view)
+        timer.time("particles_dirty_rects", game.particles.screen_rects, game.camera.view)
+        game.game_clock.advance()
+        game.player.health = game.player.max_health
+        top_up_enemies(300)
+    return timer
+
+
+SCENARIOS = {
+    "horde_500": scenario_horde,
+    "horde_2000_sprites": scenario_horde_2000(False),
+    "horde_2000_numpy": scenario_horde_2000(True),
+    "multishot_20_homing": scenario_multishot,
+    "dungeons_10k": scenario_dungeons,
+    "level_render": scenario_render,
+    "dirty_render": scenario_dirty_render,
+    "large_map_200x150": scenario_large_map,
+    "ai_lod_200x150_2000": scenario_ai_lod,
+    "fog_200x150": scenario_fog,
+    "render_backends": scenario_backends,
+    "snapshots_200": scenario_snapshots,
+    "particles_multishot_40": scenario_particles,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def run_benchmarks(names, scale=1.0):
+    game.init_display()
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "scale": scale,
+        "scenarios": {},
+    }
+    for name in names:
+        started = time.perf_counter()
+        timer = SCENARIOS[name](scale)
+        results["scenarios"][name] = {
+            "wall_time_s": round(time.perf_counter() - started, 3),
+            "phases": timer.summary(),
+        }
+        game.clear_sprites()
+    return results
+
+
+def print_results(results, baseline=None):
+    print(f"commit {results['commit'] or '?'}, Python {results['python']}, pygame {results['pygame']}")
+    for name, scenario in results["scenarios"].items():
+        print(f"\n{name} ({scenario['wall_time_s']} s)")
+        old_phases = {}
+        if baseline and name in baseline["scenarios"]:
+            old_phases = baseline["scenarios"][name]["phases"]
+        for phase, stats in scenario["phases"].items():
+            line = (f"  {phase:<12} mean {stats['mean_ms']:9.4f} ms  p50 {stats['p50_ms']:9.4f} ms"
+                    f"  p99 {stats['p99_ms']:9.4f} ms")
+            if phase in old_phases and old_phases[phase]["p50_ms"] > 0:
+                ratio = stats["p50_ms"] / old_phases[phase]["p50_ms"]
+                line += f"  ({ratio:.2f}x p50 vs {baseline['commit'] or 'baseline'})"
+            print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарки игрового цикла")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="сценарий (можно несколько, по умолчанию все)")
+    parser.add_argument("--scale", type=float, default=1.0, help="множитель числа кадров/карт (0.1 - быстрый прогон)")
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="JSON с прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.scenario or list(SCENARIOS), args.scale)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
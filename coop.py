@@ -0,0 +1,604 @@
+import argparse
+import json
+import os
+import socket
+import struct
+import time
+import zlib
+from collections import deque
+
+# Без приветствия pygame в каждом процессе
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+
+import game
+
+# Кооператив по сети: второй игрок подключается к игре по TCP.
+# Хост ведет настоящую симуляцию (Player, Enemy, пули, столкновения) и каждый
+# тик шлет изменения мира. Положения квантуются до 1/8 клетки, а сущность
+# попадает в тик, только если ее положение разошлось с тем, что клиент сам
+# вычислит по прошлой скорости (dead reckoning): пуля без самонаведения
+# пересылается один раз за жизнь. Весь поток от хоста сжимается одним потоком
+# zlib, так что повторяющиеся заголовки почти ничего не стоят. Клиент сразу
+# применяет свой ввод (предсказание) и сверяет его с хостом, а чужие сущности
+# сглаживает. Раз в секунду обе стороны печатают трафик и частоту тиков.
+#
+# Пример: python coop.py host --port 5555
+#         python coop.py join 127.0.0.1 --port 5555
+# Без окна (боты с обеих сторон): добавить --headless, сотни пуль: --multishot 20
+
+# Кадр сообщения: тип, длина
+FRAME = struct.Struct("<BI")
+LEVEL, DELTA, INPUT, BYE = range(1, 5)
+
+# Уровень: номер, ширина и высота карты, дверь (x, y), затем клетки карты
+LEVEL_HEADER = struct.Struct("<HHHii")
+# Тик: номер, последний примененный тик ввода клиента, монеты, здоровье игроков,
+# мультивыстрел, самонаведение, положения игроков (x, y), число обновлений и удалений
+TICK = struct.Struct("<IIIhhBBhhhhHH")
+# Ввод клиента: его тик и маска ввода
+INPUT_RECORD = struct.Struct("<IB")
+# Обновление сущности: ключ (вид в старших битах и номер), положение в долях
+# клетки и скорость в пикселях за тик, по которой клиент ведет ее дальше
+UPDATE = np.dtype([("key", "<u4"), ("x", "<u2"), ("y", "<u2"), ("vx", "i1"), ("vy", "i1")])
+
+QUANTUM = game.TILE_SIZE // 8  # шаг квантования положений, px
+KINDS = ("enemy", "boss", "coin", "bullet")  # вид сущности - имя картинки в game.IMAGES
+KIND_SHIFT = 29
+ID_MASK = (1 << KIND_SHIFT) - 1
+MAX_INPUT_LAG = 4  # тиков ввода в очереди хоста, лишние отбрасываются
+
+
+def make_keys(kinds, ids):
+    return (np.asarray(kinds, np.uint32) << KIND_SHIFT) | (np.asarray(ids, np.int64) & ID_MASK).astype(np.uint32)
+
+
+# Соединение: сообщения FRAME поверх неблокирующего сокета. Исходящий и
+# входящий потоки независимо сжимаются zlib целиком (compress_out/compress_in,
+# Z_SYNC_FLUSH после каждого сообщения). Считает байты на проводе и до сжатия.
+class Link:
+    def __init__(self, sock, compress_out, compress_in):
+        self.sock = sock
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.compressor = zlib.compressobj(6) if compress_out else None
+        self.decompressor = zlib.decompressobj() if compress_in else None
+        self.inbox = bytearray()
+        self.outbox = bytearray()
+        self.closed = False
+        self.stats = {"sent": 0, "sent_raw": 0, "received": 0, "received_raw": 0}
+
+    def send(self, kind, payload):
+        self.stats["sent_raw"] += FRAME.size + len(payload)
+        if self.compressor:
+            payload = self.compressor.compress(payload) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.outbox += FRAME.pack(kind, len(payload)) + payload
+        self.flush()
+
+    def flush(self):
+        while self.outbox and not self.closed:
+            try:
+                sent = self.sock.send(self.outbox)
+            except BlockingIOError:
+                return
+            except OSError:
+                self.closed = True
+                return
+            self.stats["sent"] += sent
+            del self.outbox[:sent]
+
+    def receive(self):
+        # Все пришедшие целиком сообщения: [(тип, данные)]
+        while not self.closed:
+            try:
+                chunk = self.sock.recv(65536)
+            except BlockingIOError:
+                break
+            except OSError:
+                chunk = b""
+            if not chunk:
+                self.closed = True
+                break
+            self.stats["received"] += len(chunk)
+            self.inbox += chunk
+        messages = []
+        while len(self.inbox) >= FRAME.size:
+            kind, size = FRAME.unpack_from(self.inbox)
+            if len(self.inbox) < FRAME.size + size:
+                break
+            payload = bytes(self.inbox[FRAME.size:FRAME.size + size])
+            del self.inbox[:FRAME.size + size]
+            if self.decompressor:
+                payload = self.decompressor.decompress(payload)
+            self.stats["received_raw"] += FRAME.size + len(payload)
+            messages.append((kind, payload))
+        return messages
+
+    def close(self):
+        self.flush()
+        self.sock.close()
+        self.closed = True
+
+
+# Счетчики для отчета раз в секунду: тики, кадры, трафик
+class Metrics:
+    def __init__(self, role, link):
+        self.role = role
+        self.link = link
+        self.started = self.window = time.perf_counter()
+        self.counts = {}
+        self.last = {}
+        self.peaks = {}  # максимумы за окно отчета
+        self.max_peaks = {}  # и за всю сессию
+        self.tick_ms = []
+
+    def count(self, name, value=1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def peak(self, name, value):
+        self.peaks[name] = max(self.peaks.get(name, value), value)
+        self.max_peaks[name] = max(self.max_peaks.get(name, value), value)
+
+    def report(self, force=False):
+        now = time.perf_counter()
+        elapsed = now - self.window
+        if elapsed < 1.0 and not force:
+            return
+        self.window = now
+        values = dict(self.counts)
+        values.update(self.link.stats)
+        line = {"role": self.role}
+        for name, value in values.items():
+            line[name + "_per_s"] = round((value - self.last.get(name, 0)) / max(elapsed, 1e-9), 1)
+        self.last = values
+        for name, value in self.peaks.items():
+            line[name + "_max"] = value
+        self.peaks = {}
+        if self.tick_ms:
+            line["tick_ms_p50"] = round(sorted(self.tick_ms)[len(self.tick_ms) // 2], 3)
+            line["tick_ms_max"] = round(max(self.tick_ms), 3)
+            self.tick_ms = []
+        print(json.dumps(line))
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        values = dict(self.counts)
+        values.update(self.link.stats)
+        result = {"role": self.role, "seconds": round(elapsed, 2)}
+        for name, value in values.items():
+            result[name] = value
+            result[name + "_per_s"] = round(value / elapsed, 1)
+        for name, value in self.max_peaks.items():
+            result[name + "_max"] = value
+        return result
+
+
+# Отслеживание того, что клиент знает о сущностях: для каждой - база (квантованное
+# положение), скорость и тик отправки. Клиент ведет сущность как база + скорость *
+# (тик - тик отправки); хост делает то же и шлет обновление, только когда
+# расхождение с настоящим положением дошло до шага квантования. Все на массивах.
+class DeltaTracker:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.keys = np.zeros(0, np.uint32)
+        self.base_x = self.base_y = np.zeros(0, np.int64)
+        self.vx = self.vy = np.zeros(0, np.int64)
+        self.sent_tick = np.zeros(0, np.int64)
+        self.last_x = self.last_y = np.zeros(0, np.int64)
+
+    def update(self, tick, keys, x, y, vx=None, vy=None):
+        # Текущие сущности (ключи, положения, скорости на следующий тик; без
+        # скоростей - по сдвигу за прошлый тик). Возвращает (записи UPDATE, удаленные ключи).
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        x = np.asarray(x, np.int64)[order]
+        y = np.asarray(y, np.int64)[order]
+        where = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        known = (self.keys[where] == keys) if len(self.keys) else np.zeros(len(keys), bool)
+        if vx is None:
+            vx = np.where(known, x - self.last_x[where] if len(self.keys) else 0, 0)
+            vy = np.where(known, y - self.last_y[where] if len(self.keys) else 0, 0)
+        else:
+            vx = np.asarray(vx, np.int64)[order]
+            vy = np.asarray(vy, np.int64)[order]
+        vx = np.clip(vx, -127, 127)
+        vy = np.clip(vy, -127, 127)
+
+        send = ~known
+        base_x = np.zeros(len(keys), np.int64)
+        base_y = np.zeros(len(keys), np.int64)
+        old_vx = np.zeros(len(keys), np.int64)
+        old_vy = np.zeros(len(keys), np.int64)
+        sent_tick = np.full(len(keys), tick, np.int64)
+        if len(self.keys):
+            base_x[known] = self.base_x[where[known]]
+            base_y[known] = self.base_y[where[known]]
+            old_vx[known] = self.vx[where[known]]
+            old_vy[known] = self.vy[where[known]]
+            sent_tick[known] = self.sent_tick[where[known]]
+            age = tick - sent_tick
+            send |= (np.abs(base_x + old_vx * age - x) >= QUANTUM) | (np.abs(base_y + old_vy * age - y) >= QUANTUM)
+
+        qx = np.clip((x[send] + QUANTUM // 2) // QUANTUM, 0, 0xFFFF)
+        qy = np.clip((y[send] + QUANTUM // 2) // QUANTUM, 0, 0xFFFF)
+        records = np.zeros(int(send.sum()), UPDATE)
+        records["key"] = keys[send]
+        records["x"] = qx
+        records["y"] = qy
+        records["vx"] = vx[send]
+        records["vy"] = vy[send]
+        base_x[send] = qx * QUANTUM
+        base_y[send] = qy * QUANTUM
+        old_vx[send] = vx[send]
+        old_vy[send] = vy[send]
+        sent_tick[send] = tick
+
+        removed = np.setdiff1d(self.keys, keys, assume_unique=True)
+        self.keys, self.base_x, self.base_y = keys, base_x, base_y
+        self.vx, self.vy, self.sent_tick = old_vx, old_vy, sent_tick
+        self.last_x, self.last_y = x, y
+        return records, removed
+
+
+# Ввод второго игрока на хосте: очередь тиков клиента, по одному за тик
+# симуляции. Пока новых нет, повторяется последнее движение без выстрела.
+class NetworkController:
+    def __init__(self):
+        self.queue = deque()
+        self.last = 0
+        self.applied = 0  # последний примененный тик клиента
+
+    def start_level(self, tile_map, door_tile):
+        self.queue.clear()
+
+    def push(self, tick, bits):
+        self.queue.append((tick, bits))
+        while len(self.queue) > MAX_INPUT_LAG:
+            self.applied = self.queue.popleft()[0]
+
+    def get_input(self):
+        if not self.queue:
+            return self.last & ~(game.SHOOT_UP | game.SHOOT_DOWN | game.SHOOT_LEFT | game.SHOOT_RIGHT)
+        self.applied, self.last = self.queue.popleft()
+        return self.last
+
+
+# Хост: симуляция с фиксированным шагом в реальном времени, игрок 1 - клавиатура
+# (или бот без окна), игрок 2 - клиент. Магазина в кооперативе нет.
+class Host:
+    def __init__(self, link, headless, seed):
+        self.link = link
+        self.headless = headless
+        self.metrics = Metrics("host", link)
+        self.controller = game.BotController() if headless else game.KeyboardController()
+        self.ally_input = game.ally_controller = NetworkController()
+        self.sprites = DeltaTracker()
+        self.bullets = DeltaTracker()
+        self.ids = {}  # спрайт -> номер сущности (на уровень)
+        self.tick = 0
+        game.start_run(seed)
+        self.preloader = game.LevelPreloader(threaded=False)
+        self.preloader.request(game.level)
+
+    def start_level(self):
+        plan = self.preloader.take()
+        self.preloader.request(game.level + 1)
+        self.door, self.background, self.minimap = game.build_level(self.controller, plan)
+        self.sprites.reset()
+        self.bullets.reset()
+        self.ids.clear()
+        tile_map = plan.tile_map
+        self.link.send(LEVEL, LEVEL_HEADER.pack(game.level, tile_map.width, tile_map.height, *self.door.rect.topleft)
+                       + bytes(tile_map.tiles))
+
+    def entity_id(self, sprite):
+        number = self.ids.get(sprite)
+        if number is None:
+            number = self.ids[sprite] = len(self.ids)
+        return number
+
+    def delta(self):
+        # Спрайты врагов и монет: скорость - по сдвигу; пули - точная скорость
+        # (целая часть, как в BulletPool.update), самонаведение видно по расхождению
+        kinds, ids, xs, ys = [], [], [], []
+        for sprite in game.enemies:
+            kinds.append(1 if sprite.is_boss else 0)
+            ids.append(self.entity_id(sprite))
+            xs.append(sprite.rect.x)
+            ys.append(sprite.rect.y)
+        for sprite in game.coins:
+            kinds.append(2)
+            ids.append(self.entity_id(sprite))
+            xs.append(sprite.rect.x)
+            ys.append(sprite.rect.y)
+        sprite_records, sprite_removed = self.sprites.update(
+            self.tick, make_keys(np.array(kinds, np.uint32), ids), np.array(xs, np.int64), np.array(ys, np.int64))
+
+        pool = game.bullet_pool
+        live = np.flatnonzero(pool.active)
+        bullet_records, bullet_removed = self.bullets.update(
+            self.tick, make_keys(np.full(len(live), 3, np.uint32), pool.seq[live]), pool.x[live], pool.y[live],
+            np.trunc(pool.vx[live]), np.trunc(pool.vy[live]))
+
+        records = np.concatenate([sprite_records, bullet_records])
+        removed = np.concatenate([sprite_removed, bullet_removed]).astype("<u4")
+        player, ally = game.player, game.ally
+        header = TICK.pack(self.tick, self.ally_input.applied, player.coins, player.health,
+                           ally.health if ally.alive() else 0, player.multishot_level, player.has_homing,
+                           player.rect.x, player.rect.y, ally.rect.x, ally.rect.y, len(records), len(removed))
+        self.metrics.count("updates", len(records))
+        return header + records.tobytes() + removed.tobytes()
+
+    def run(self, max_ticks):
+        self.start_level()
+        next_tick = time.perf_counter()
+        while not self.link.closed and self.tick < max_ticks:
+            for kind, payload in self.link.receive():
+                if kind == INPUT:
+                    for offset in range(0, len(payload), INPUT_RECORD.size):
+                        self.ally_input.push(*INPUT_RECORD.unpack_from(payload, offset))
+                elif kind == BYE:
+                    self.link.closed = True
+            if not self.headless:
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        self.link.closed = True
+                    self.controller.handle_event(event)
+
+            started = time.perf_counter()
+            game.step_frame(self.controller)
+            self.tick += 1
+            self.link.send(DELTA, self.delta())
+            self.metrics.tick_ms.append((time.perf_counter() - started) * 1000)
+            self.metrics.count("ticks")
+            self.metrics.peak("bullets", len(game.bullet_pool))
+
+            if game.player.health <= 0:
+                break
+            if pygame.sprite.collide_rect(game.player, self.door):
+                game.level += 1
+                game.clear_sprites()
+                self.start_level()
+            if not self.headless:
+                game.present_frame(self.background, self.minimap)
+            self.metrics.report()
+
+            # Реальное время: тик раз в STEP_MS, при сильном отставании не догоняем
+            next_tick += game.STEP_MS / 1000
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -game.MAX_STEPS_PER_FRAME * game.STEP_MS / 1000:
+                next_tick = time.perf_counter()
+
+        if not self.link.closed:
+            self.link.send(BYE, b"")
+        return self.metrics.summary()
+
+
+# Сущность на клиенте: спрайт и модель движения от хоста. offset - остаток
+# прошлой поправки, который гасится за несколько кадров вместо рывка.
+class NetEntity:
+    SMOOTHING = 0.5
+
+    def __init__(self, kind):
+        self.sprite = pygame.sprite.Sprite(game.all_sprites)
+        self.sprite.image = game.assets.sprite(KINDS[kind])
+        self.sprite.rect = self.sprite.image.get_rect()
+        self.base = (0, 0)
+        self.velocity = (0, 0)
+        self.tick = 0
+        self.offset = [0.0, 0.0]
+
+    def model(self, tick):
+        age = tick - self.tick
+        return self.base[0] + self.velocity[0] * age, self.base[1] + self.velocity[1] * age
+
+    def correct(self, tick, x, y, vx, vy, smooth):
+        shown = self.sprite.rect.topleft
+        self.base = (x, y)
+        self.velocity = (vx, vy)
+        self.tick = tick
+        if smooth and abs(shown[0] - x) + abs(shown[1] - y) < 2 * game.TILE_SIZE:
+            self.offset = [shown[0] - x, shown[1] - y]
+        else:
+            self.offset = [0.0, 0.0]
+
+    def animate(self, tick):
+        x, y = self.model(tick)
+        self.offset[0] *= self.SMOOTHING
+        self.offset[1] *= self.SMOOTHING
+        self.sprite.rect.topleft = (round(x + self.offset[0]), round(y + self.offset[1]))
+
+
+# Клиент: карта и сущности от хоста, свой игрок - настоящий Player на
+# клиентской сетке стен. Свой ввод применяется сразу, а когда хост сообщает,
+# какой тик ввода он применил и где после него игрок, положение сверяется:
+# берется положение хоста и заново проигрываются еще не подтвержденные тики.
+class Client:
+    def __init__(self, link, headless):
+        self.link = link
+        self.headless = headless
+        self.metrics = Metrics("client", link)
+        self.controller = FollowController(self) if headless else game.KeyboardController()
+        self.entities = {}
+        self.pending = deque()  # (тик, ввод) без подтверждения хоста
+        self.tick = 0  # свой тик ввода
+        self.host_tick = 0
+        self.frames_since_delta = 0
+        self.plan = None
+        self.partner = None
+        self.done = False
+
+    def start_level(self, payload):
+        number, width, height, door_x, door_y = LEVEL_HEADER.unpack_from(payload)
+        tile_map = game.TileMap(width, height)
+        tile_map.tiles[:] = payload[LEVEL_HEADER.size:]
+        game.clear_sprites()
+        game.level = number
+        self.plan = game.LevelPlan.from_tile_map(number, tile_map, (door_x, door_y), not self.headless)
+        game.wall_grid = self.plan.wall_grid
+        door = game.new_door((door_x, door_y))
+        self.partner = pygame.sprite.Sprite(game.all_sprites)
+        self.partner.image = game.assets.sprite("player")
+        self.partner.rect = self.partner.image.get_rect()
+        game.player = game.Player((0, 0), game.player_upgrades)
+        self.entities.clear()
+        self.pending.clear()
+        self.controller.start_level(tile_map, game.tile_at(door.rect.topleft))
+
+    def apply_delta(self, payload):
+        (tick, applied, coins, health, my_health, multishot, homing, partner_x, partner_y, my_x, my_y,
+         update_count, remove_count) = TICK.unpack_from(payload)
+        records = np.frombuffer(payload, UPDATE, update_count, TICK.size)
+        removed = np.frombuffer(payload, "<u4", remove_count, TICK.size + records.nbytes)
+        self.host_tick = tick
+        self.frames_since_delta = 0
+        self.metrics.count("host_ticks")
+        self.metrics.count("updates", update_count)
+
+        for key in removed.tolist():
+            entity = self.entities.pop(key, None)
+            if entity:
+                entity.sprite.kill()
+        for key, x, y, vx, vy in records.tolist():
+            entity = self.entities.get(key)
+            smooth = entity is not None
+            if entity is None:
+                entity = self.entities[key] = NetEntity(key >> KIND_SHIFT)
+            entity.correct(tick, x * QUANTUM, y * QUANTUM, vx, vy, smooth)
+
+        self.partner.rect.topleft = (partner_x, partner_y)
+        me = game.player
+        me.health = my_health
+        me.coins = coins
+        me.multishot_level = multishot
+        me.has_homing = bool(homing)
+        if my_health <= 0:
+            me.kill()
+            return
+        # Сверка предсказания: положение хоста после тика applied плюс свой ввод после него
+        while self.pending and self.pending[0][0] <= applied:
+            self.pending.popleft()
+        before = me.rect.topleft
+        me.rect.topleft = (my_x, my_y)
+        for _, bits in self.pending:
+            me.input = bits
+            me.update()
+        if me.rect.topleft != before:
+            self.metrics.count("mispredictions")
+
+    def step(self):
+        # Кадр клиента: сообщения хоста, свой ввод (сразу применяется), сущности
+        for kind, payload in self.link.receive():
+            if kind == LEVEL:
+                self.start_level(payload)
+            elif kind == DELTA and self.plan is not None:
+                self.apply_delta(payload)
+            elif kind == BYE:
+                self.done = True
+        if self.plan is None:
+            return
+        if not self.headless:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.done = True
+                self.controller.handle_event(event)
+
+        self.tick += 1
+        bits = self.controller.get_input()
+        self.link.send(INPUT, INPUT_RECORD.pack(self.tick, bits))
+        me = game.player
+        if me.alive():
+            self.pending.append((self.tick, bits))
+            me.input = bits
+            me.update()
+
+        # Пока нового тика нет, ведем сущности дальше сами (не больше пары тиков)
+        self.frames_since_delta += 1
+        tick = self.host_tick + min(self.frames_since_delta - 1, 2)
+        for entity in self.entities.values():
+            entity.animate(tick)
+        self.metrics.count("frames")
+
+    def run(self, max_ticks):
+        clock = pygame.time.Clock()
+        while not self.done and not self.link.closed and self.tick < max_ticks:
+            self.step()
+            if self.plan is not None and not self.headless:
+                game.present_frame(self.plan.background, self.plan.minimap)
+            self.metrics.report()
+            clock.tick(game.FPS)
+        if not self.link.closed:
+            self.link.send(BYE, b"")
+        return self.metrics.summary()
+
+
+# Бот второго игрока без окна: идет к первому игроку и стреляет по кругу
+class FollowController:
+    def __init__(self, client):
+        self.client = client
+        self.tick = 0
+
+    def start_level(self, tile_map, door_tile):
+        pass
+
+    def get_input(self):
+        self.tick += 1
+        me, partner = game.player.rect, self.client.partner.rect
+        dx = partner.centerx - me.centerx
+        dy = partner.centery - me.centery
+        move_x = (dx > game.TILE_SIZE) - (dx < -game.TILE_SIZE)
+        move_y = (dy > game.TILE_SIZE) - (dy < -game.TILE_SIZE)
+        return game.encode_input(move_x, move_y, game.SHOT_DIRECTIONS[self.tick % 4][1])
+
+
+def host_session(args):
+    game.init_display(headless_mode=args.headless)
+    server = socket.create_server((args.address, args.port))
+    print(f"Waiting for player 2 on {args.address}:{args.port}")
+    sock, peer = server.accept()
+    server.close()
+    print(f"Player 2 joined from {peer[0]}:{peer[1]}")
+    host = Host(Link(sock, compress_out=True, compress_in=False), args.headless, args.seed)
+    # Улучшения задаются до первого уровня (start_run их сбрасывает)
+    game.player_upgrades.multishot_level = args.multishot
+    try:
+        return host.run(args.ticks)
+    finally:
+        host.link.close()
+
+
+def join_session(args):
+    game.init_display(headless_mode=args.headless)
+    sock = socket.create_connection((args.address, args.port))
+    client = Client(Link(sock, compress_out=False, compress_in=True), args.headless)
+    try:
+        return client.run(args.ticks)
+    finally:
+        client.link.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Кооператив по сети: хост и второй игрок")
+    parser.add_argument("role", choices=["host", "join"], help="host - вести игру, join - подключиться")
+    parser.add_argument("address", nargs="?", default="127.0.0.1", help="адрес хоста (для host - адрес прослушивания)")
+    parser.add_argument("--port", type=int, default=5555, help="TCP-порт")
+    parser.add_argument("--headless", action="store_true", help="без окна: игроками управляют боты")
+    parser.add_argument("--seed", type=int, help="зерно забега (хост)")
+    parser.add_argument("--ticks", type=int, default=10 ** 9, help="остановиться после стольких тиков")
+    parser.add_argument("--multishot", type=int, default=0, help="уровень мультивыстрела с начала (хост)")
+    parser.add_argument("--json", help="сохранить итоговые метрики в JSON")
+    args = parser.parse_args()
+    if args.seed is None:
+        args.seed = int.from_bytes(os.urandom(4), "little")
+
+    summary = host_session(args) if args.role == "host" else join_session(args)
+    print(json.dumps(summary, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
@@ -3,14 +3,32 @@ import random
 import sys
 import os
 import math
+import time
+import argparse
+import struct
+import zlib
+import json
+import heapq
+import weakref
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 # Константы
 TILE_SIZE = 32
 MAP_WIDTH = 25
 MAP_HEIGHT = 18
-SCREEN_WIDTH = MAP_WIDTH * TILE_SIZE
-SCREEN_HEIGHT = MAP_HEIGHT * TILE_SIZE + 40  # дополнительное пространство для HUD
+WORLD_WIDTH = MAP_WIDTH * TILE_SIZE
+WORLD_HEIGHT = MAP_HEIGHT * TILE_SIZE + 40  # дополнительное пространство для HUD
+# Наибольший размер окна: карта крупнее прокручивается камерой
+VIEW_WIDTH = 25 * TILE_SIZE
+VIEW_HEIGHT = 18 * TILE_SIZE + 40
+SCREEN_WIDTH = min(WORLD_WIDTH, VIEW_WIDTH)
+SCREEN_HEIGHT = min(WORLD_HEIGHT, VIEW_HEIGHT)
 FPS = 60
+STEP_MS = 1000 / FPS  # фиксированный шаг симуляции
+MAX_STEPS_PER_FRAME = 5  # при сильных лагах лишние шаги отбрасываются
 
 # Цвета
 WHITE = (255, 255, 255)
@@ -25,41 +43,470 @@ YELLOW = (255, 255, 0)
 LIGHT_BLUE = (100, 100, 255)
 DARK_GRAY = (50, 50, 50)
 
-pygame.init()
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Roguelike Game")
-clock = pygame.time.Clock()
+# Окно, часы и картинки создаются в init_display, а не при импорте,
+# чтобы модуль можно было использовать без дисплея.
+# screen - бэкенд вывода (SurfaceBackend и др.), а не сама поверхность окна
+screen = None
+clock = None
+headless = False
+
+
+# Картинки игры: имя -> (файл, размер после масштабирования или None, цвет заглушки).
+# Заглушка - прямоугольник размера картинки (без размера - в клетку).
+IMAGES = {
+    "heart": ("heart.png", None, RED),
+    "half_heart": ("half_heart.png", None, DARKRED),
+    "floor": ("floor.png", None, GRAY),
+    "door": ("door.png", None, DARKRED),
+    "coin": ("coin.png", (TILE_SIZE // 2, TILE_SIZE // 2), YELLOW),
+    "bullet": ("bullet.png", (8, 8), RED),
+    "player": ("player.png", (TILE_SIZE // 2, TILE_SIZE // 2), BLUE),
+    "enemy": ("enemy.png", (TILE_SIZE // 2, TILE_SIZE // 2), GREEN),
+    "boss": ("boss.png", (TILE_SIZE, TILE_SIZE), PURPLE),
+}
+
+
+# Менеджер картинок. Файл загружается при первом обращении, а масштабированные
+# варианты кэшируются по (путь, размер), так что каждая текстура в памяти одна,
+# сколько бы спрайтов ее ни показывали. Заглушки для отсутствующих картинок
+# тоже общие - одна на (размер, цвет). С атласом (use_atlas) все картинки уже
+# уменьшены и лежат в одном файле, который читается за один раз.
+# В безголовом режиме картинки не загружаются и спрайты получают заглушки.
+class AssetManager:
+    def __init__(self):
+        self.enabled = False  # включается в init_display, когда есть окно
+        self.images = {}  # (путь, размер) -> Surface или None, если файла нет
+        self.solids = {}  # (размер, цвет) -> заглушка
+        self.atlas_path = None
+        self.atlas = None  # ключ атласа -> подповерхность атласа
+
+    def use_atlas(self, path):
+        # Атлас читается при первом обращении к картинке
+        self.atlas_path = path
+        self.atlas = None
+        self.images.clear()
+
+    def load_atlas(self):
+        self.atlas = {}
+        try:
+            with open(os.path.splitext(self.atlas_path)[0] + ".json", encoding="utf-8") as f:
+                index = json.load(f)
+            sheet = pygame.image.load(self.atlas_path)
+            if pygame.display.get_surface():
+                sheet = sheet.convert_alpha()
+        except (OSError, ValueError, pygame.error):
+            print(f"Warning: could not load atlas {self.atlas_path}")
+            return
+        for key, rect in index.items():
+            self.atlas[key] = sheet.subsurface(rect)
+
+    def image(self, path, size=None):
+        # Картинка (размера size) или None, если ее нет
+        if not self.enabled:
+            return None
+        key = (path, size)
+        if key not in self.images:
+            if self.atlas_path and self.atlas is None:
+                self.load_atlas()
+            if self.atlas and atlas_key(path, size) in self.atlas:
+                self.images[key] = self.atlas[atlas_key(path, size)]
+            elif size:
+                original = self.image(path)
+                self.images[key] = original and pygame.transform.scale(original, size)
+            else:
+                try:
+                    image = pygame.image.load(path)
+                    # Без поверхности окна (бэкенды sdl2 и null) переводить не во что
+                    self.images[key] = image.convert_alpha() if pygame.display.get_surface() else image
+                except (OSError, pygame.error):
+                    print(f"Warning: could not load image {path}")
+                    self.images[key] = None
+        return self.images[key]
+
+    def solid(self, size, color):
+        key = (size, color)
+        if key not in self.solids:
+            self.solids[key] = pygame.Surface(size)
+            self.solids[key].fill(color)
+        return self.solids[key]
+
+    def get(self, name):
+        path, size, _ = IMAGES[name]
+        return self.image(path, size)
+
+    def sprite(self, name):
+        # Картинка из IMAGES или общая заглушка того же размера
+        path, size, color = IMAGES[name]
+        return self.image(path, size) or self.solid(size or (TILE_SIZE, TILE_SIZE), color)
+
+
+assets = AssetManager()
+
+
+def atlas_key(path, size):
+    return path if size is None else f"{path}@{size[0]}x{size[1]}"
+
+
+# Сборка атласа из всех картинок IMAGES (уже масштабированных): картинки
+# раскладываются полками по высоте в один PNG, рядом пишется JSON с их местами
+def build_atlas(path, padding=1):
+    images = []
+    for file, size, _ in IMAGES.values():
+        try:
+            image = pygame.image.load(file)
+        except (OSError, pygame.error):
+            print(f"Warning: could not load image {file}")
+            continue
+        images.append((atlas_key(file, size), pygame.transform.scale(image, size) if size else image))
+    images.sort(key=lambda item: -item[1].get_height())
+
+    width = max(256, max((image.get_width() for _, image in images), default=0))
+    index = {}
+    x = y = shelf = 0
+    for key, image in images:
+        w, h = image.get_size()
+        if x + w > width:
+            x, y = 0, y + shelf + padding
+            shelf = 0
+        index[key] = [x, y, w, h]
+        x += w + padding
+        shelf = max(shelf, h)
+
+    sheet = pygame.Surface((width, max(y + shelf, 1)), pygame.SRCALPHA)
+    for key, image in images:
+        sheet.blit(image, index[key][:2])
+    pygame.image.save(sheet, path)
+    with open(os.path.splitext(path)[0] + ".json", "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    return index
+
+
+# Размер карты в клетках (вызывается до init_display). Окно остается не
+# больше VIEW_WIDTH x VIEW_HEIGHT, остальное показывает камера.
+def configure_map(width, height):
+    global MAP_WIDTH, MAP_HEIGHT, WORLD_WIDTH, WORLD_HEIGHT, SCREEN_WIDTH, SCREEN_HEIGHT
+    MAP_WIDTH, MAP_HEIGHT = width, height
+    WORLD_WIDTH = width * TILE_SIZE
+    WORLD_HEIGHT = height * TILE_SIZE + 40
+    SCREEN_WIDTH = min(WORLD_WIDTH, VIEW_WIDTH)
+    SCREEN_HEIGHT = min(WORLD_HEIGHT, VIEW_HEIGHT)
+
+
+# Бэкенды вывода. Все рисование (кадр, HUD, миникарта, меню, профилировщик)
+# идет через screen с подмножеством интерфейса Surface - blit, blits и fill -
+# плюс present (вывести кадр или его области) и invalidate (картинка
+# изменилась на месте). Код рисования не знает, какой бэкенд под ним.
+
+# Программный блиттер pygame: рисует в поверхность окна pygame.display
+class SurfaceBackend:
+    partial_updates = True  # можно выводить только измененные области (--dirty)
+
+    def __init__(self, size, title):
+        self.surface = pygame.display.set_mode(size)
+        pygame.display.set_caption(title)
+
+    def blit(self, image, pos, area=None):
+        return self.surface.blit(image, pos, area)
+
+    def blits(self, blit_sequence, doreturn=True):
+        return self.surface.blits(blit_sequence, doreturn)
+
+    def fill(self, color, rect=None):
+        return self.surface.fill(color, rect)
+
+    def present(self, rects=None):
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
 
+    def invalidate(self, image):
+        pass
+
+
+# Рендерер SDL2 (pygame._sdl2): каждая картинка один раз загружается в текстуру
+# (кэш по самой картинке, пропадает вместе с ней), а кадр собирается копиями
+# текстур - на видеокарте, если она есть, иначе программным рендерером SDL.
+# Задний буфер после present не сохраняется, поэтому кадр всегда рисуется целиком.
+class TextureBackend:
+    partial_updates = False
+
+    def __init__(self, size, title):
+        from pygame._sdl2 import video
+        self.video = video
+        self.window = video.Window(title, size)
+        self.renderer = video.Renderer(self.window, accelerated=-1)
+        self.rect = pygame.Rect((0, 0), size)
+        self.textures = weakref.WeakKeyDictionary()
+
+    def texture(self, image):
+        texture = self.textures.get(image)
+        if texture is None:
+            texture = self.textures[image] = self.video.Texture.from_surface(self.renderer, image)
+        return texture
+
+    def blit(self, image, pos, area=None):
+        source = image.get_rect() if area is None else pygame.Rect(area).clip(image.get_rect())
+        target = pygame.Rect(pos[0], pos[1], source.w, source.h)
+        if source.w and source.h:
+            self.renderer.blit(self.texture(image), target, source)
+        return target.clip(self.rect)
+
+    def blits(self, blit_sequence, doreturn=True):
+        drawn = [self.blit(*item) for item in blit_sequence]
+        return drawn if doreturn else None
+
+    def fill(self, color, rect=None):
+        rect = self.rect if rect is None else pygame.Rect(rect).clip(self.rect)
+        self.renderer.draw_color = pygame.Color(color)
+        self.renderer.fill_rect(rect)
+        return rect
+
+    def present(self, rects=None):
+        self.renderer.present()
+
+    def invalidate(self, image):
+        self.textures.pop(image, None)
+
+
+# Пустой бэкенд: окна нет, ничего не рисуется - для тестов и замера чистой
+# стоимости симуляции в настоящем игровом цикле
+class NullBackend:
+    partial_updates = False
+
+    def __init__(self, size, title):
+        self.rect = pygame.Rect((0, 0), size)
+
+    def blit(self, image, pos, area=None):
+        size = image.get_size() if area is None else pygame.Rect(area).size
+        return pygame.Rect(pos[0], pos[1], *size).clip(self.rect)
+
+    def blits(self, blit_sequence, doreturn=True):
+        drawn = [self.blit(*item) for item in blit_sequence] if doreturn else None
+        return drawn
+
+    def fill(self, color, rect=None):
+        return self.rect if rect is None else pygame.Rect(rect).clip(self.rect)
+
+    def present(self, rects=None):
+        pass
+
+    def invalidate(self, image):
+        pass
+
+
+BACKENDS = {"surface": SurfaceBackend, "sdl2": TextureBackend, "null": NullBackend}
+
+
+# Инициализация pygame. В безголовом режиме окно не создается, картинки не
+# загружаются (спрайты рисуют цветные заглушки) и время идет по кадрам.
+# Картинки грузятся не здесь, а при первом обращении (AssetManager).
+# backend - имя бэкенда вывода из BACKENDS.
+def init_display(headless_mode=False, backend="surface"):
+    global screen, clock, headless
+
+    headless = headless_mode
+    assets.enabled = not headless_mode
+    assets.images.clear()  # картинки без окна не загружались
+    particles.enabled = not headless_mode
+    if headless_mode:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.init()
+    clock = pygame.time.Clock()
+    if headless_mode:
+        return
+
+    screen = BACKENDS[backend]((SCREEN_WIDTH, SCREEN_HEIGHT), "Roguelike Game")
 
-# Функция безопасной загрузки изображения
-def load_image(path, size=None):
-    try:
-        image = pygame.image.load(path).convert_alpha()
-        if size:
-            image = pygame.transform.scale(image, size)
-        return image
-    except Exception:
-        print(f"Warning: could not load image {path}")
-        return None
 
+# Шрифты: каждый размер загружается один раз
+fonts = {}
 
-# Загрузка изображений
-heart_img = load_image("heart.png")
-half_heart_img = load_image("half_heart.png")
-floor_img = load_image("floor.png")
-door_img = load_image("door.png")
-coin_img = load_image("coin.png", (TILE_SIZE // 2, TILE_SIZE // 2))
-bullet_img = load_image("bullet.png", (8, 8))
 
-# Загрузка изображений персонажей (если есть)
-player_img = load_image("player.png", (TILE_SIZE // 2, TILE_SIZE // 2))
-enemy_img = load_image("enemy.png", (TILE_SIZE // 2, TILE_SIZE // 2))
-boss_img = load_image("boss.png", (TILE_SIZE, TILE_SIZE))
+def get_font(size):
+    font = fonts.get(size)
+    if font is None:
+        font = fonts[size] = pygame.font.SysFont(None, size)
+    return font
+
+
+# Кэш отрисованного текста. Строка рендерится заново только если изменился
+# текст (например, число монет), давно не использованные строки вытесняются (LRU).
+class TextCache:
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.surfaces = OrderedDict()
+
+    def render(self, text, size, color=WHITE):
+        key = (text, size, color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            return surface
+        surface = get_font(size).render(text, True, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.capacity:
+            self.surfaces.popitem(last=False)
+        return surface
+
+
+text_cache = TextCache()
+
+
+# Игровое время в мс. Растет на один фиксированный шаг (1000 / FPS мс) за тик
+# симуляции, поэтому задержки выстрелов и активации врагов не зависят ни от
+# частоты кадров, ни от скорости выполнения.
+class GameClock:
+    def __init__(self):
+        self.frame = 0
+
+    def get_ticks(self):
+        return self.frame * 1000 // FPS
+
+    def advance(self):
+        self.frame += 1
+
+
+game_clock = GameClock()
+
+# Профилировщик кадра: время подсистем (ввод, ИИ, обновление игрока и врагов,
+# столкновения, отрисовка, HUD, flip) со скользящими средними, счетчики
+# подсистем, оверлей с графиком времени кадра (F3) и запись замеров в CSV или JSONL.
+# Пока оверлей выключен и лог не открыт, замеры не собираются.
+class FrameProfiler:
+    HISTORY = 120  # кадров в скользящем окне и на графике
+    BUDGET_MS = 1000 / FPS
+
+    def __init__(self):
+        self.enabled = False
+        self.pending = None  # новое значение enabled с начала следующего кадра
+        self.overlay = False
+        self.frame = 0
+        self.frame_started = 0
+        self.started = {}
+        self.current = {}
+        self.counters = {}
+        self.history = {}
+        self.frame_times = deque(maxlen=self.HISTORY)
+        self.log_file = None
+        self.log_csv = False
+
+    def open_log(self, path):
+        # Формат по расширению: .csv - строка на секцию, иначе JSONL - строка на кадр
+        self.log_file = open(path, "w", encoding="utf-8")
+        self.log_csv = path.endswith(".csv")
+        if self.log_csv:
+            self.log_file.write("frame,section,ms\n")
+        self.enabled = True
+
+    def close(self):
+        if self.log_file:
+            self.log_file.close()
+            self.log_file = None
+        self.enabled = self.overlay
+
+    def toggle_overlay(self):
+        # F3 приходит посреди кадра: замеры включаются или выключаются только
+        # со следующего begin_frame, чтобы кадр не остался замеренным наполовину
+        self.overlay = not self.overlay
+        self.pending = self.overlay or self.log_file is not None
+
+    def begin_frame(self):
+        if self.pending is not None:
+            self.enabled = self.pending
+            self.pending = None
+        if not self.enabled:
+            return
+        self.current = {}
+        self.counters = {}
+        self.frame_started = time.perf_counter()
+
+    def start(self, name):
+        if self.enabled:
+            self.started[name] = time.perf_counter()
+
+    def stop(self, name):
+        if self.enabled:
+            self.add(name, time.perf_counter() - self.started[name])
+
+    def add(self, name, seconds):
+        self.current[name] = self.current.get(name, 0.0) + seconds * 1000
+
+    def count(self, name, value):
+        # Счетчик кадра (не время): показывается в оверлее и пишется в JSONL
+        if self.enabled:
+            self.counters[name] = value
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        frame_ms = (time.perf_counter() - self.frame_started) * 1000
+        self.frame += 1
+        self.frame_times.append(frame_ms)
+        for name, ms in self.current.items():
+            self.history.setdefault(name, deque(maxlen=self.HISTORY)).append(ms)
+        if self.log_file:
+            if self.log_csv:
+                for name, ms in self.current.items():
+                    self.log_file.write(f"{self.frame},{name},{ms:.4f}\n")
+                self.log_file.write(f"{self.frame},frame,{frame_ms:.4f}\n")
+            else:
+                sections = {name: round(ms, 4) for name, ms in self.current.items()}
+                record = {"frame": self.frame, "frame_ms": round(frame_ms, 4), "sections": sections}
+                if self.counters:
+                    record["counters"] = self.counters
+                self.log_file.write(json.dumps(record) + "\n")
+
+    def averages(self):
+        return {name: sum(values) / len(values) for name, values in self.history.items() if values}
+
+    def draw(self, surface):
+        if not self.overlay:
+            return
+        # Числа меняются каждый кадр, поэтому рендерим их мимо кэша текста
+        font = get_font(18)
+        averages = self.averages()
+        # Высота панели по числу строк (кадр, секции, счетчики) плюс график под ними
+        rows = bool(self.frame_times) + len(averages) + len(self.counters)
+        graph_bottom = 4 + rows * 14 + 66
+        panel = pygame.Surface((230, graph_bottom + 4), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 180))
+
+        # Скользящие средние по секциям
+        y = 4
+        if self.frame_times:
+            average = sum(self.frame_times) / len(self.frame_times)
+            panel.blit(text_cache.render("frame", 18, YELLOW), (4, y))
+            panel.blit(font.render(f"{average:6.2f} ms", True, YELLOW), (150, y))
+            y += 14
+        for name, ms in sorted(averages.items()):
+            panel.blit(text_cache.render(name, 18), (4, y))
+            panel.blit(font.render(f"{ms:6.2f} ms", True, WHITE), (150, y))
+            y += 14
+        for name, value in self.counters.items():
+            panel.blit(text_cache.render(name, 18, GREEN), (4, y))
+            panel.blit(font.render(f"{value:6}", True, GREEN), (150, y))
+            y += 14
+
+        # График времени кадра; линия - бюджет кадра
+        scale = 60 / (2 * self.BUDGET_MS)  # 60 px = два бюджета
+        for i, ms in enumerate(self.frame_times):
+            height = min(60, int(ms * scale))
+            color = RED if ms > self.BUDGET_MS else GREEN
+            pygame.draw.line(panel, color, (4 + i, graph_bottom), (4 + i, graph_bottom - height))
+        budget_y = graph_bottom - int(self.BUDGET_MS * scale)
+        pygame.draw.line(panel, YELLOW, (4, budget_y), (4 + self.HISTORY, budget_y))
+        surface.blit(panel, (5, 45))
+
+
+profiler = FrameProfiler()
+
+# Генератор случайных чисел игры. Засевается в начале забега, чтобы по зерну
+# и записи ввода игру можно было воспроизвести бит в бит.
+rng = random.Random()
 
 # Группы спрайтов
 all_sprites = pygame.sprite.Group()
-walls = pygame.sprite.Group()
-bullets = pygame.sprite.Group()
 enemies = pygame.sprite.Group()
 coins = pygame.sprite.Group()
 
@@ -75,15 +522,433 @@ class PlayerUpgrades:
 player_upgrades = PlayerUpgrades()
 
 
+# Карта уровня: клетки лежат по строкам в одном bytearray (байт на клетку,
+# 0 - пол, 1 - стена). grid - те же байты как массив NumPy [y, x] без
+# копирования: через него вырезаются комнаты и считаются маски, списки клеток
+# и пиксели миникарты, а поклеточные проверки читают bytearray напрямую.
+class TileMap:
+    FLOOR = 0
+    WALL = 1
+
+    def __init__(self, width=None, height=None, fill=WALL):
+        self.width = width or MAP_WIDTH
+        self.height = height or MAP_HEIGHT
+        self.tiles = bytearray([fill]) * (self.width * self.height)
+        self.grid = np.frombuffer(self.tiles, np.uint8).reshape(self.height, self.width)
+
+    def __getitem__(self, tile):
+        x, y = tile
+        return self.tiles[y * self.width + x]
+
+    def is_floor(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height and self.tiles[y * self.width + x] == self.FLOOR
+
+    def fill_rect(self, x1, y1, x2, y2, value=FLOOR):
+        # Заливка клеток [x1, x2) x [y1, y2); часть за картой отбрасывается
+        self.grid[max(y1, 0):max(y2, 0), max(x1, 0):max(x2, 0)] = value
+
+    def floor_mask(self):
+        # Пол массивом bool [y, x]; все, что не пол, - стена
+        return self.grid == self.FLOOR
+
+    def floor_tiles(self):
+        # Клетки пола (x, y), по столбцам
+        xs, ys = np.nonzero(self.floor_mask().T)
+        return list(zip(xs.tolist(), ys.tolist()))
+
+    def pixels(self, scale=1, floor_color=WHITE, wall_color=BLACK):
+        # Карта как массив пикселей [x, y, rgb] (раскладка pygame.surfarray),
+        # каждая клетка - квадрат scale x scale
+        colors = np.array([floor_color, wall_color], np.uint8)
+        return colors[self.grid.T].repeat(scale, axis=0).repeat(scale, axis=1)
+
+
+# Сетка стен для проверки столкновений.
+# Вместо перебора спрайтов всех стен смотрим только клетки карты,
+# которые накрывает прямоугольник, поэтому стоимость проверки не зависит
+# от размера карты.
+class WallGrid:
+    def __init__(self, tile_map):
+        self.tile_map = tile_map
+        self.tiles = tile_map.tiles
+        self.width = tile_map.width
+        self.height = tile_map.height
+        # Стены массивом [y, x] для пакетных проверок
+        self.solid = ~tile_map.floor_mask()
+        # Таблица сумм: число стен в любом прямоугольнике клеток за четыре обращения
+        self.wall_count = np.zeros((self.height + 1, self.width + 1), np.int32)
+        self.wall_count[1:, 1:] = self.solid.cumsum(0).cumsum(1)
+
+    def collide_rect(self, rect):
+        # Диапазон клеток под прямоугольником (правая и нижняя границы не входят)
+        x1 = max(rect.left // TILE_SIZE, 0)
+        x2 = min((rect.right - 1) // TILE_SIZE, self.width - 1)
+        y1 = max((rect.top - 40) // TILE_SIZE, 0)
+        y2 = min((rect.bottom - 1 - 40) // TILE_SIZE, self.height - 1)
+        tiles = self.tiles
+        for y in range(y1, y2 + 1):
+            row = y * self.width
+            if TileMap.WALL in tiles[row + x1:row + x2 + 1]:
+                return True
+        return False
+
+    def collide_rects(self, x, y, width, height):
+        # Пакетная проверка прямоугольников одного размера (не больше клетки)
+        # по массивам левых верхних углов; возвращает массив bool
+        x1 = np.maximum(x // TILE_SIZE, 0)
+        x2 = np.minimum((x + width - 1) // TILE_SIZE, self.width - 1)
+        y1 = np.maximum((y - 40) // TILE_SIZE, 0)
+        y2 = np.minimum((y + height - 1 - 40) // TILE_SIZE, self.height - 1)
+        # Прямоугольник целиком за картой стен не задевает
+        inside = (x1 <= x2) & (y1 <= y2)
+        x1 = np.minimum(x1, self.width - 1)
+        x2 = np.maximum(x2, 0)
+        y1 = np.minimum(y1, self.height - 1)
+        y2 = np.maximum(y2, 0)
+        solid = self.solid
+        return inside & (solid[y1, x1] | solid[y1, x2] | solid[y2, x1] | solid[y2, x2])
+
+    def sweep(self, rect, dx, dy):
+        # Первое касание стены прямоугольником rect на пути (dx, dy):
+        # доля пути 0..1 или None. Проверяются стены под всей областью пути.
+        box = rect.union(rect.move(dx, dy))
+        x1 = max(box.left // TILE_SIZE, 0)
+        x2 = min((box.right - 1) // TILE_SIZE, self.width - 1)
+        y1 = max((box.top - 40) // TILE_SIZE, 0)
+        y2 = min((box.bottom - 1 - 40) // TILE_SIZE, self.height - 1)
+        if x1 > x2 or y1 > y2:
+            return None
+        ys, xs = np.nonzero(self.solid[y1:y2 + 1, x1:x2 + 1])
+        if not len(xs):
+            return None
+        left = (xs + x1) * TILE_SIZE
+        top = (ys + y1) * TILE_SIZE + 40
+        t = sweep_times(rect, dx, dy, left, top, left + TILE_SIZE, top + TILE_SIZE).min()
+        return None if t == np.inf else float(t)
+
+    def sweep_rects(self, x0, y0, x1, y1, width, height):
+        # Пакетный sweep для прямоугольников одного размера, сдвинутых из (x0, y0)
+        # в (x1, y1): массив долей пути (inf - стены на пути нет). Точный расчет
+        # только там, где область пути задевает хоть одну стену (по таблице сумм).
+        left = np.minimum(x0, x1)
+        top = np.minimum(y0, y1)
+        cx1 = np.clip(left // TILE_SIZE, 0, self.width)
+        cx2 = np.clip((np.maximum(x0, x1) + width - 1) // TILE_SIZE + 1, 0, self.width)
+        cy1 = np.clip((top - 40) // TILE_SIZE, 0, self.height)
+        cy2 = np.clip((np.maximum(y0, y1) + height - 1 - 40) // TILE_SIZE + 1, 0, self.height)
+        count = self.wall_count
+        walls = count[cy2, cx2] - count[cy1, cx2] - count[cy2, cx1] + count[cy1, cx1]
+        times = np.full(len(x0), np.inf)
+        rect = pygame.Rect(0, 0, width, height)
+        for i in np.flatnonzero(walls > 0).tolist():
+            rect.topleft = (int(x0[i]), int(y0[i]))
+            t = self.sweep(rect, int(x1[i] - x0[i]), int(y1[i] - y0[i]))
+            if t is not None:
+                times[i] = t
+        return times
+
+
+# Swept AABB: доли пути (0..1), на которых прямоугольник rect, сдвигающийся на
+# (dx, dy), впервые пересекает неподвижные прямоугольники из массивов границ
+# [left, right) x [top, bottom); inf - не пересекает. Пересечение в начале пути - 0.
+def sweep_times(rect, dx, dy, left, top, right, bottom):
+    enter = np.zeros(len(left))
+    leave = np.ones(len(left))
+    for start, end, d, low, high in ((rect.left, rect.right, dx, left, right),
+                                     (rect.top, rect.bottom, dy, top, bottom)):
+        if d == 0:
+            # Без движения по оси - пересекаемся по ней все время или никогда
+            leave = np.where((end > low) & (start < high), leave, -1.0)
+            continue
+        a = (low - end) / d
+        b = (high - start) / d
+        if d < 0:
+            a, b = b, a
+        enter = np.maximum(enter, a)
+        leave = np.minimum(leave, b)
+    return np.where(enter < leave, enter, np.inf)
+
+
+# Клетка карты, в которой находится точка (None за пределами карты)
+def tile_at(pos):
+    x = pos[0] // TILE_SIZE
+    y = (pos[1] - 40) // TILE_SIZE
+    if 0 <= x < MAP_WIDTH and 0 <= y < MAP_HEIGHT:
+        return x, y
+    return None
+
+
+# Центр клетки в экранных координатах
+def tile_center(tile):
+    return tile[0] * TILE_SIZE + TILE_SIZE // 2, tile[1] * TILE_SIZE + TILE_SIZE // 2 + 40
+
+
+# Поле направлений (flow field) к игроку.
+# BFS по клеткам пола от клетки игрока: для каждой клетки запоминаем соседа,
+# который на шаг ближе к игроку. Поле пересчитывается только когда игрок
+# переходит в другую клетку, а враг узнает следующий шаг одним обращением.
+# С max_distance обход останавливается на этом расстоянии (в шагах): за ним
+# next_tile возвращает None, и враг идет к игроку напрямую.
+# Обход идет по слоям массивами NumPy: соседи фронта перебираются в порядке
+# очереди (клетка фронта, затем NEIGHBOURS), и каждая новая клетка получает
+# первого найденного родителя - ровно как в обходе очередью по одной клетке.
+# Клетки хранятся плоскими индексами сетки с рамкой из стен вокруг карты,
+# поэтому соседей не нужно проверять на выход за карту.
+class FlowField:
+    # Сначала прямые соседи, потом диагональные (прямые пути предпочтительнее)
+    NEIGHBOURS = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+    def __init__(self, tile_map, max_distance=None):
+        self.tile_map = tile_map
+        self.width = tile_map.width
+        self.height = tile_map.height
+        self.max_distance = max_distance
+        self.target = None
+        self.stride = self.height + 2  # клетка (x, y) -> (x + 1) * stride + y + 1
+        self.blocked = np.pad(~tile_map.floor_mask().T, 1, constant_values=True).ravel()
+        self.closed = self.blocked.copy()  # стены и уже пройденные клетки
+        self.parent = np.full(len(self.blocked), -1, np.intp)  # следующая клетка пути (-1 - нет)
+        # Сдвиги до соседа и до двух клеток, которые диагональный шаг не должен
+        # срезать (у прямого шага обе совпадают с самим соседом)
+        self.steps = np.array([dx * self.stride + dy for dx, dy in self.NEIGHBOURS])
+        self.corners_x = np.array([dx * self.stride if dx and dy else dx * self.stride + dy
+                                   for dx, dy in self.NEIGHBOURS])
+        self.corners_y = np.array([dy if dx and dy else dx * self.stride + dy for dx, dy in self.NEIGHBOURS])
+        self.visited = np.zeros(0, np.intp)  # клетки последнего обхода
+        self.arrays = None  # следующие клетки массивами [x, y], строятся по запросу
+
+    def update(self, tile):
+        if tile == self.target or tile is None:
+            return
+        self.target = tile
+        self.arrays = None
+        blocked = self.blocked
+        closed = self.closed
+        parent = self.parent
+        # Сбрасываем только клетки прошлого обхода
+        closed[self.visited] = blocked[self.visited]
+        parent[self.visited] = -1
+
+        limit = self.max_distance if self.max_distance is not None else self.width * self.height
+        frontier = np.array([(tile[0] + 1) * self.stride + tile[1] + 1], np.intp)
+        closed[frontier] = True
+        layers = [frontier]
+        dist = 0
+        while len(frontier) and dist < limit:
+            dist += 1
+            # Соседи фронта построчно: (клетка фронта, направление) - порядок очереди
+            base = frontier[:, None]
+            neighbours = (base + self.steps).ravel()
+            open_ = ~(closed[neighbours] | blocked[(base + self.corners_x).ravel()]
+                      | blocked[(base + self.corners_y).ravel()])
+            found = np.flatnonzero(open_)
+            if not len(found):
+                break
+            neighbours = neighbours[found]
+            # Клетка, найденная несколькими соседями, достается первому из них
+            order = np.argsort(neighbours, kind="stable")
+            ordered = neighbours[order]
+            first = order[np.concatenate(([True], ordered[1:] != ordered[:-1]))]
+            first.sort()
+            frontier = neighbours[first]
+            closed[frontier] = True
+            parent[frontier] = layers[-1][found[first] // len(self.steps)]
+            layers.append(frontier)
+        self.visited = np.concatenate(layers)
+
+    def next_tile(self, tile):
+        # Следующая клетка на пути к игроку (None в клетке игрока или вне поля)
+        if tile is None:
+            return None
+        cell = int(self.parent[(tile[0] + 1) * self.stride + tile[1] + 1])
+        if cell < 0:
+            return None
+        x, y = divmod(cell, self.stride)
+        return x - 1, y - 1
+
+    def parent_arrays(self):
+        # Следующие клетки массивами [x, y] (-1 - следующей клетки нет) для
+        # пакетного ИИ; строятся один раз на каждое положение игрока
+        if self.arrays is None:
+            cells = self.parent.reshape(self.width + 2, self.stride)[1:-1, 1:-1]
+            x, y = np.divmod(cells, self.stride)
+            missing = cells < 0
+            self.arrays = (np.where(missing, -1, x - 1).astype(np.int32),
+                           np.where(missing, -1, y - 1).astype(np.int32))
+        return self.arrays
+
+
+# Стены и поле направлений текущего уровня (создаются в main)
+wall_grid = None
+flow_field = None
+
+# Режим стаи (--horde): враги уровня обновляются пакетно через EnemyHorde
+horde_mode = False
+enemy_horde = None
+
+# Туман войны (--fog): открываются только клетки, которые видел игрок
+fog_mode = False
+fog = None
+
+# Второй игрок кооператива (coop.py): спрайт Player, ввод которого дает
+# ally_controller. Враги идут к первому игроку, монеты - в общий кошелек у него.
+ally = None
+ally_controller = None
+
+
+# Живые игроки в порядке обработки столкновений
+def players():
+    if ally is not None and ally.alive():
+        return [player, ally]
+    return [player]
+
+
+# Равномерная пространственная сетка (spatial hash) для широкой фазы коллизий.
+# Спрайты раскладываются по ячейкам один раз за кадр, после чего запрос
+# проверяет только спрайты из ячеек, которые накрывает прямоугольник.
+# Сетку неподвижных спрайтов (монет) не нужно пересобирать: они добавляются
+# при появлении (add), попадают в ячейки на следующем commit - в начале
+# кадра, как при пересборке, - и убираются при исчезновении (remove).
+class SpatialHash:
+    def __init__(self, cell_size=TILE_SIZE * 2):
+        self.cell_size = cell_size
+        self.cells = {}
+        # Границы занятых ячеек (для ограничения поиска ближайшего)
+        self.bounds = None
+        self.pending = []  # добавленные, но еще не разложенные спрайты
+        self.placed = {}  # спрайт -> прямоугольник, по которому он разложен (add/commit)
+
+    def _cells(self, rect):
+        size = self.cell_size
+        for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                yield cx, cy
+
+    def clear(self):
+        self.cells.clear()
+        self.bounds = None
+        self.pending.clear()
+        self.placed.clear()
+
+    def rebuild(self, sprites):
+        # Как insert для каждого спрайта, но границы считаются один раз в конце
+        self.clear()
+        size = self.cell_size
+        cells = self.cells
+        for sprite in sprites:
+            rect = sprite.rect
+            for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+                for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                    bucket = cells.get((cx, cy))
+                    if bucket is None:
+                        cells[cx, cy] = [sprite]
+                    else:
+                        bucket.append(sprite)
+        if cells:
+            xs = [cx for cx, _ in cells]
+            ys = [cy for _, cy in cells]
+            self.bounds = [min(xs), min(ys), max(xs), max(ys)]
+
+    def add(self, sprite):
+        self.pending.append(sprite)
+
+    def commit(self):
+        for sprite in self.pending:
+            self.insert(sprite)
+            self.placed[sprite] = sprite.rect.copy()
+        self.pending.clear()
+
+    def remove(self, sprite):
+        rect = self.placed.pop(sprite, None)
+        if rect is None:
+            if sprite in self.pending:
+                self.pending.remove(sprite)
+            return
+        for cell in self._cells(rect):
+            bucket = self.cells[cell]
+            bucket.remove(sprite)
+            if not bucket:
+                del self.cells[cell]
+
+    def insert(self, sprite):
+        for cell in self._cells(sprite.rect):
+            self.cells.setdefault(cell, []).append(sprite)
+            cx, cy = cell
+            if self.bounds is None:
+                self.bounds = [cx, cy, cx, cy]
+            else:
+                b = self.bounds
+                b[0] = min(b[0], cx); b[1] = min(b[1], cy)
+                b[2] = max(b[2], cx); b[3] = max(b[3], cy)
+
+    def query(self, rect):
+        # Возвращает живые спрайты, пересекающие rect, без повторов
+        found = []
+        seen = set()
+        for cell in self._cells(rect):
+            for sprite in self.cells.get(cell, ()):
+                if id(sprite) in seen:
+                    continue
+                seen.add(id(sprite))
+                if sprite.alive() and rect.colliderect(sprite.rect):
+                    found.append(sprite)
+        return found
+
+    def nearest(self, pos, max_distance=None):
+        # Ближайший живой спрайт (по центрам) - поиск расширяющимися кольцами ячеек.
+        # С max_distance дальше этого расстояния не ищем (тогда None).
+        if self.bounds is None:
+            return None
+        px, py = pos
+        size = self.cell_size
+        pcx, pcy = px // size, py // size
+        min_cx, min_cy, max_cx, max_cy = self.bounds
+        max_ring = max(pcx - min_cx, max_cx - pcx, pcy - min_cy, max_cy - pcy)
+        best = None
+        best_dist = None
+        for ring in range(max(max_ring, 0) + 1):
+            # Все спрайты дальше кольца ring находятся не ближе (ring - 1) * size
+            if best is not None and ((ring - 1) * size) ** 2 > best_dist:
+                break
+            if max_distance is not None and (ring - 1) * size > max_distance:
+                break
+            for cx in range(pcx - ring, pcx + ring + 1):
+                step = 1 if abs(cx - pcx) == ring else 2 * ring
+                for cy in range(pcy - ring, pcy + ring + 1, max(step, 1)):
+                    for sprite in self.cells.get((cx, cy), ()):
+                        if not sprite.alive():
+                            continue
+                        dist = (px - sprite.rect.centerx) ** 2 + (py - sprite.rect.centery) ** 2
+                        if best is None or dist < best_dist:
+                            best, best_dist = sprite, dist
+        if max_distance is not None and best is not None and best_dist > max_distance ** 2:
+            return None
+        return best
+
+    def sweep(self, rect, dx, dy):
+        # Первый живой спрайт на пути rect при сдвиге на (dx, dy):
+        # (доля пути 0..1, спрайт) или None; при равенстве - первый из query
+        candidates = self.query(rect.union(rect.move(dx, dy)))
+        if not candidates:
+            return None
+        bounds = np.array([sprite.rect for sprite in candidates]).T  # x, y, w, h
+        times = sweep_times(rect, dx, dy, bounds[0], bounds[1], bounds[0] + bounds[2], bounds[1] + bounds[3])
+        best = int(np.argmin(times))
+        if times[best] == np.inf:
+            return None
+        return float(times[best]), candidates[best]
+
+
+# Общие сетки для попаданий пуль, касаний врагов и сбора монет
+enemy_hash = SpatialHash()
+coin_hash = SpatialHash()
+
+
 # Класс игрока
 class Player(pygame.sprite.Sprite):
     def __init__(self, pos, upgrades):
         super().__init__(all_sprites)
-        if player_img:
-            self.image = player_img
-        else:
-            self.image = pygame.Surface((TILE_SIZE // 2, TILE_SIZE // 2))
-            self.image.fill(BLUE)
+        self.image = assets.sprite("player")
         self.rect = self.image.get_rect(center=pos)
         self.speed = 4
 
@@ -100,19 +965,14 @@ class Player(pygame.sprite.Sprite):
         # Время последнего выстрела
         self.last_shot = 0
         self.shot_delay = 300  # задержка между выстрелами в мс
+        # Ввод текущего тика (битовая маска, задается в step_frame)
+        self.input = 0
 
     def update(self):
-        keys = pygame.key.get_pressed()
-        dx = dy = 0
-        # Движение на WASD
-        if keys[pygame.K_a]:
-            dx = -self.speed
-        if keys[pygame.K_d]:
-            dx = self.speed
-        if keys[pygame.K_w]:
-            dy = -self.speed
-        if keys[pygame.K_s]:
-            dy = self.speed
+        # Направление движения из ввода текущего тика
+        move_x, move_y = decode_move(self.input)
+        dx = move_x * self.speed
+        dy = move_y * self.speed
         # Нормализуем диагональное движение
         if dx != 0 and dy != 0:
             dx *= 0.7071;
@@ -120,26 +980,21 @@ class Player(pygame.sprite.Sprite):
         # Попытка перемещения с проверкой столкновений
         self.move(dx, dy)
 
-        # Сбор монет
-        coins_collected = pygame.sprite.spritecollide(self, coins, True)
-        for coin in coins_collected:
-            self.coins += 1
-
-        # Удерживаем игрока в границах окна
+        # Удерживаем игрока в границах мира
         if self.rect.left < 0:   self.rect.left = 0
-        if self.rect.right > SCREEN_WIDTH: self.rect.right = SCREEN_WIDTH
+        if self.rect.right > WORLD_WIDTH: self.rect.right = WORLD_WIDTH
         # Верхняя граница на 40px опущена (т.к. HUD занимает верх)
         if self.rect.top < 40:   self.rect.top = 40
-        if self.rect.bottom > SCREEN_HEIGHT: self.rect.bottom = SCREEN_HEIGHT
+        if self.rect.bottom > WORLD_HEIGHT: self.rect.bottom = WORLD_HEIGHT
 
     def move(self, dx, dy):
         if dx != 0:
             self.rect.x += int(dx)
-            if pygame.sprite.spritecollideany(self, walls):
+            if wall_grid.collide_rect(self.rect):
                 self.rect.x -= int(dx)
         if dy != 0:
             self.rect.y += int(dy)
-            if pygame.sprite.spritecollideany(self, walls):
+            if wall_grid.collide_rect(self.rect):
                 self.rect.y -= int(dy)
 
     def shoot(self, direction):
@@ -148,13 +1003,13 @@ class Player(pygame.sprite.Sprite):
             return
 
         # Проверяем задержку между выстрелами
-        now = pygame.time.get_ticks()
+        now = game_clock.get_ticks()
         if now - self.last_shot < self.shot_delay:
             return
         self.last_shot = now
 
         # Основной снаряд
-        Bullet(self.rect.center, direction, self.has_homing)
+        bullet_pool.spawn(self.rect.center, direction, self.has_homing)
 
         # Мультивыстрел
         if self.multishot_level > 0:
@@ -168,11 +1023,11 @@ class Player(pygame.sprite.Sprite):
                 # Пули справа
                 angle = i * angle_step
                 dir_right = direction.rotate(angle)
-                Bullet(self.rect.center, dir_right, self.has_homing)
+                bullet_pool.spawn(self.rect.center, dir_right, self.has_homing)
 
                 # Пули слева
                 dir_left = direction.rotate(-angle)
-                Bullet(self.rect.center, dir_left, self.has_homing)
+                bullet_pool.spawn(self.rect.center, dir_left, self.has_homing)
 
     def add_health(self):
         """Добавляет половинку сердца к максимальному здоровью"""
@@ -181,158 +1036,1261 @@ class Player(pygame.sprite.Sprite):
         self.health = min(self.health + 1, self.max_health)
 
 
-# Класс снаряда
-class Bullet(pygame.sprite.Sprite):
-    def __init__(self, pos, direction, homing=False):
-        super().__init__(all_sprites, bullets)
-        if bullet_img:
-            self.image = bullet_img
-        else:
-            self.image = pygame.Surface((8, 8))
-            self.image.fill(RED)
-        self.rect = self.image.get_rect(center=pos)
-        self.velocity = pygame.math.Vector2(direction) * 10
-        self.homing = homing
-        self.target = None
+# Пул снарядов. Пуль больше всего, поэтому вместо спрайта на каждую они
+# хранятся в массивах (структура массивов) с заранее выделенными слотами и
+# списком свободных слотов: выстрел занимает слот, попадание его освобождает.
+# Движение, выход за экран и стены считаются для всех пуль сразу, а рисуются
+# пули одним вызовом blits. Стены и враги проверяются по всему пути за тик
+# (swept AABB), а не только в конечной точке, поэтому быстрая пуля не
+# проскакивает сквозь врага или стену в одну клетку.
+class BulletPool:
+    SPEED = 10
+    # Запись пули в снимке мира; target - номер цели в группе enemies (-1 - нет)
+    SNAPSHOT = np.dtype([("x", "<i4"), ("y", "<i4"), ("vx", "<f8"), ("vy", "<f8"),
+                         ("homing", "u1"), ("seq", "<i8"), ("target", "<i4")])
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.x = np.zeros(capacity, np.int32)  # левый верхний угол прямоугольника
+        self.y = np.zeros(capacity, np.int32)
+        self.start_x = np.zeros(capacity, np.int32)  # где пуля была в начале тика
+        self.start_y = np.zeros(capacity, np.int32)
+        self.vx = np.zeros(capacity)
+        self.vy = np.zeros(capacity)
+        self.wall_hit = np.full(capacity, np.inf)  # доля пути тика до стены (inf - не задела)
+        self.homing = np.zeros(capacity, bool)
+        self.active = np.zeros(capacity, bool)
+        # Номер выстрела: попадания разбираются в порядке вылета пуль
+        self.seq = np.zeros(capacity, np.int64)
+        self.next_seq = 0
+        self.targets = [None] * capacity  # цели самонаводящихся пуль (враги)
+        self.free = list(range(capacity - 1, -1, -1))
+        self.image = None
+
+    def get_image(self):
+        # Одна картинка (или заглушка) на все пули
+        if self.image is None:
+            self.image = assets.sprite("bullet")
+        return self.image
+
+    def size(self):
+        return self.get_image().get_size()
+
+    def __len__(self):
+        return self.capacity - len(self.free)
+
+    def grow(self):
+        # Слоты кончились - удваиваем массивы
+        old = self.capacity
+        self.capacity *= 2
+        for name in ("x", "y", "start_x", "start_y", "vx", "vy", "wall_hit", "homing", "active", "seq"):
+            array = getattr(self, name)
+            grown = np.full(self.capacity, np.inf) if name == "wall_hit" else np.zeros(self.capacity, array.dtype)
+            grown[:old] = array
+            setattr(self, name, grown)
+        self.targets.extend([None] * old)
+        self.free.extend(range(self.capacity - 1, old - 1, -1))
+
+    def spawn(self, pos, direction, homing=False):
+        if not self.free:
+            self.grow()
+        i = self.free.pop()
+        width, height = self.size()
+        self.x[i] = pos[0] - width // 2
+        self.y[i] = pos[1] - height // 2
+        self.vx[i] = direction[0] * self.SPEED
+        self.vy[i] = direction[1] * self.SPEED
+        self.wall_hit[i] = np.inf
+        self.homing[i] = homing
+        self.active[i] = True
+        self.seq[i] = self.next_seq
+        self.next_seq += 1
+        self.targets[i] = None
+
+    def kill(self, indices):
+        self.active[indices] = False
+        for i in indices:
+            self.targets[i] = None
+        self.free.extend(indices)
+
+    def clear(self):
+        self.kill(np.flatnonzero(self.active).tolist())
+        self.image = None  # картинка могла смениться после init_display
+
+    def indices(self):
+        # Живые слоты в порядке выстрелов
+        live = np.flatnonzero(self.active)
+        return live[np.argsort(self.seq[live], kind="stable")]
+
+    def center(self, i):
+        width, height = self.size()
+        return int(self.x[i]) + width // 2, int(self.y[i]) + height // 2
+
+    def rects(self):
+        size = self.size()
+        live = np.flatnonzero(self.active)
+        return [pygame.Rect(pos, size) for pos in zip(self.x[live].tolist(), self.y[live].tolist())]
 
     def update(self):
-        if self.homing:
-            # Находим ближайшего живого врага
-            if not self.target or not self.target.alive():
-                if enemies:
-                    self.target = min(enemies, key=lambda e:
-                    (self.rect.centerx - e.rect.centerx) ** 2 + (self.rect.centery - e.rect.centery) ** 2
-                                      )
-            # Наводимся на цель
-            if self.target and self.target.alive():
-                to_enemy = pygame.math.Vector2(self.target.rect.center) - pygame.math.Vector2(self.rect.center)
-                if to_enemy.length() != 0:
-                    self.velocity = to_enemy.normalize() * 10
-        # Движение снаряда
-        self.rect.x += int(self.velocity.x)
-        self.rect.y += int(self.velocity.y)
-        # Если вышел за пределы, уничтожаем снаряд
-        if (self.rect.right < 0 or self.rect.left > SCREEN_WIDTH or
-                self.rect.bottom < 40 or self.rect.top > SCREEN_HEIGHT):
-            self.kill()
+        live = np.flatnonzero(self.active)
+        if not len(live):
             return
-        # Столкновение со стеной
-        if pygame.sprite.spritecollideany(self, walls):
-            self.kill()
+        width, height = self.size()
+
+        # Цели назначает retarget_homing; наводимся, пока цель жива
+        steer = [i for i in live[self.homing[live]].tolist()
+                 if self.targets[i] is not None and self.targets[i].alive()]
+        if steer:
+            target_centers = np.array([self.targets[i].rect.center for i in steer])
+            steer = np.array(steer)
+            dx = target_centers[:, 0] - (self.x[steer] + width // 2)
+            dy = target_centers[:, 1] - (self.y[steer] + height // 2)
+            length = np.sqrt(dx * dx + dy * dy)
+            moving = length != 0
+            steer, dx, dy, length = steer[moving], dx[moving], dy[moving], length[moving]
+            self.vx[steer] = dx / length * self.SPEED
+            self.vy[steer] = dy / length * self.SPEED
+
+        # Движение (с отбрасыванием дробной части, как у int)
+        start_x = self.start_x[live] = self.x[live]
+        start_y = self.start_y[live] = self.y[live]
+        self.x[live] += np.trunc(self.vx[live]).astype(np.int32)
+        self.y[live] += np.trunc(self.vy[live]).astype(np.int32)
+        x = self.x[live]
+        y = self.y[live]
+        # Первая стена на пути; такая пуля живет до resolve_collisions, чтобы
+        # успеть попасть во врага, стоящего на пути перед стеной
+        self.wall_hit[live] = wall_grid.sweep_rects(start_x, start_y, x, y, width, height)
+        # Вышедшие за пределы мира уничтожаются
+        dead = (x + width < 0) | (x > WORLD_WIDTH) | (y + height < 40) | (y > WORLD_HEIGHT)
+        if dead.any():
+            self.kill(live[dead].tolist())
+
+    def kill_wall_hits(self):
+        hits = np.flatnonzero(self.active & (self.wall_hit != np.inf))
+        if not len(hits):
             return
-        # Попадание по врагу
-        hit = pygame.sprite.spritecollideany(self, enemies)
-        if hit:
-            hit.health -= 1
-            if hit.health <= 0:
-                # Создаем монетку на месте врага
-                Coin(hit.rect.center)
-                hit.kill()
-                player.coins += 1
-            self.kill()
+        # Пыль в точке удара о стену
+        width, height = self.size()
+        t = self.wall_hit[hits]
+        x = self.start_x[hits] + (self.x[hits] - self.start_x[hits]) * t + width // 2
+        y = self.start_y[hits] + (self.y[hits] - self.start_y[hits]) * t + height // 2
+        particles.emit("dust", list(zip(x.tolist(), y.tolist())))
+        self.kill(hits.tolist())
+
+    def snapshot(self, enemy_numbers):
+        # Живые пули массивом записей SNAPSHOT в порядке выстрелов.
+        # Снимок делается между тиками, когда start_x/start_y и wall_hit не нужны.
+        order = self.indices()
+        records = np.zeros(len(order), self.SNAPSHOT)
+        for name in ("x", "y", "vx", "vy", "homing", "seq"):
+            records[name] = getattr(self, name)[order]
+        records["target"] = [enemy_numbers.get(self.targets[i], -1) for i in order.tolist()]
+        return records
+
+    def restore(self, records, next_seq, enemy_list):
+        # Пули из снимка занимают первые слоты; погибшая цель равна отсутствию цели
+        count = len(records)
+        while self.capacity < count:
+            self.grow()
+        self.active[:] = False
+        for name in ("x", "y", "vx", "vy", "homing", "seq"):
+            getattr(self, name)[:count] = records[name]
+        self.active[:count] = True
+        self.wall_hit[:count] = np.inf
+        self.targets = [enemy_list[t] if t >= 0 else None for t in records["target"].tolist()]
+        self.targets.extend([None] * (self.capacity - count))
+        self.free = list(range(self.capacity - 1, count - 1, -1))
+        self.next_seq = next_seq
+
+    def draw(self, surface, view):
+        # Только пули в поле зрения камеры view (прямоугольник в мире)
+        image = self.get_image()
+        width, height = image.get_size()
+        live = np.flatnonzero(self.active)
+        x = self.x[live]
+        y = self.y[live]
+        seen = (x + width > view.left) & (x < view.right) & (y + height > view.top) & (y < view.bottom)
+        surface.blits([(image, pos) for pos in zip((x[seen] - view.x).tolist(), (y[seen] - view.y).tolist())],
+                      doreturn=False)
+
+
+bullet_pool = BulletPool()
+
+
+# Частицы эффектов: искры попаданий пуль, вспышки гибели врагов, кровь игрока.
+# Все частицы лежат в массивах фиксированной емкости CAPACITY: новые занимают
+# слоты по кольцу и вытесняют самые старые, а за тик создается не больше
+# TICK_BUDGET частиц - память и цена кадра ограничены при любом залпе.
+# Движение и гибель по времени жизни считаются одним пакетным шагом за тик,
+# отрисовка - одним blits на текстуру (вид эффекта x ступень прозрачности).
+# Частицы не влияют на симуляцию и не берут чисел из rng, поэтому записи и
+# контрольные суммы от них не зависят; без окна они не создаются.
+class ParticlePool:
+    CAPACITY = 2048
+    TICK_BUDGET = 384
+    FADE_STEPS = 4
+    CELL = 64  # размер клетки, по которой собираются грязные области
+    # Вид: частиц на событие, скорость (px/тик), время жизни (тики),
+    # торможение за тик, тяжесть (px/тик^2), размер, цвет
+    KINDS = {
+        "spark": (6, (2.0, 5.0), (8, 16), 0.85, 0.0, 3, (255, 230, 120)),
+        "dust": (3, (0.5, 2.0), (6, 12), 0.8, 0.0, 2, (170, 170, 170)),
+        "burst": (14, (1.0, 4.0), (18, 32), 0.9, 0.15, 4, (255, 120, 40)),
+        "blood": (10, (1.0, 3.5), (14, 24), 0.88, 0.25, 3, (210, 20, 20)),
+    }
+
+    def __init__(self):
+        self.enabled = False  # включается в init_display, когда есть окно
+        self.names = list(self.KINDS)
+        self.drag = np.array([self.KINDS[name][3] for name in self.names], np.float32)
+        self.gravity = np.array([self.KINDS[name][4] for name in self.names], np.float32)
+        self.sizes = np.array([self.KINDS[name][5] for name in self.names], np.int32)
+        self.x = np.zeros(self.CAPACITY, np.float32)  # центр частицы в мире
+        self.y = np.zeros(self.CAPACITY, np.float32)
+        self.vx = np.zeros(self.CAPACITY, np.float32)
+        self.vy = np.zeros(self.CAPACITY, np.float32)
+        self.age = np.zeros(self.CAPACITY, np.int16)
+        self.life = np.zeros(self.CAPACITY, np.int16)  # живая, пока age < life
+        self.kind = np.zeros(self.CAPACITY, np.uint8)
+        self.next = 0  # следующий слот кольца
+        self.emitted = 0  # создано за текущий тик
+        self.random = np.random.default_rng(0)
+        self.textures = None
+
+    def get_textures(self):
+        # Квадраты каждого вида с убывающей непрозрачностью, по FADE_STEPS на вид
+        if self.textures is None:
+            self.textures = []
+            for name in self.names:
+                size, color = self.KINDS[name][5:]
+                for step in range(self.FADE_STEPS):
+                    image = pygame.Surface((size, size), pygame.SRCALPHA)
+                    image.fill((*color, 255 * (self.FADE_STEPS - step) // self.FADE_STEPS))
+                    self.textures.append(image.convert_alpha() if pygame.display.get_surface() else image)
+        return self.textures
+
+    def __len__(self):
+        return int(np.count_nonzero(self.age < self.life))
+
+    def emit(self, kind, positions):
+        # По частице вида kind на каждую из точек positions, разлет во все стороны.
+        # Если бюджет тика кончается, на событие приходится меньше частиц, а
+        # события сверх бюджета остаются без эффекта.
+        budget = self.TICK_BUDGET - self.emitted
+        if not self.enabled or not positions or budget <= 0:
+            return
+        count, speed, life = self.KINDS[kind][:3]
+        if len(positions) * count > budget:
+            count = max(1, budget // len(positions))
+            positions = positions[:budget // count]
+        n = len(positions) * count
+        slots = (self.next + np.arange(n)) % self.CAPACITY
+        self.next = (self.next + n) % self.CAPACITY
+        self.emitted += n
+
+        origin = np.repeat(np.array(positions, np.float32), count, axis=0)
+        angle = self.random.uniform(0, 2 * np.pi, n)
+        velocity = self.random.uniform(speed[0], speed[1], n)
+        self.x[slots] = origin[:, 0]
+        self.y[slots] = origin[:, 1]
+        self.vx[slots] = np.cos(angle) * velocity
+        self.vy[slots] = np.sin(angle) * velocity
+        self.age[slots] = 0
+        self.life[slots] = self.random.integers(life[0], life[1], n, endpoint=True)
+        self.kind[slots] = self.names.index(kind)
+
+    def update(self):
+        self.emitted = 0
+        live = np.flatnonzero(self.age < self.life)
+        if not len(live):
+            return
+        kind = self.kind[live]
+        self.x[live] += self.vx[live]
+        self.y[live] += self.vy[live]
+        self.vx[live] *= self.drag[kind]
+        self.vy[live] = self.vy[live] * self.drag[kind] + self.gravity[kind]
+        self.age[live] += 1
+
+    def clear(self):
+        self.age[:] = 0
+        self.life[:] = 0
+        self.emitted = 0
+        self.textures = None  # картинки переводятся под окно после init_display
+
+    def visible(self, view):
+        # Живые частицы в поле зрения: индексы и левые верхние углы на экране
+        live = np.flatnonzero(self.age < self.life)
+        size = self.sizes[self.kind[live]]
+        x = self.x[live].astype(np.int32) - size // 2 - view.x
+        y = self.y[live].astype(np.int32) - size // 2 - view.y
+        seen = (x + size > 0) & (x < view.width) & (y + size > 0) & (y < view.height)
+        return live[seen], x[seen], y[seen]
+
+    def draw(self, surface, view):
+        live, x, y = self.visible(view)
+        if not len(live):
+            return
+        textures = self.get_textures()
+        # Номер текстуры: вид и ступень прозрачности по прожитой доле жизни
+        texture = (self.kind[live].astype(np.int32) * self.FADE_STEPS
+                   + self.age[live] * self.FADE_STEPS // self.life[live])
+        order = np.argsort(texture, kind="stable")
+        bounds = np.searchsorted(texture[order], np.arange(len(textures) + 1)).tolist()
+        x = x[order].tolist()
+        y = y[order].tolist()
+        for image, start, end in zip(textures, bounds, bounds[1:]):
+            if start < end:
+                surface.blits([(image, pos) for pos in zip(x[start:end], y[start:end])], doreturn=False)
+
+    def screen_rects(self, view):
+        # Области экрана с частицами - клетки CELL x CELL (с запасом на размер
+        # частицы), а не прямоугольник на каждую: их число ограничено размером окна
+        live, x, y = self.visible(view)
+        if not len(live):
+            return []
+        cells = np.unique(np.clip(x, 0, None) // self.CELL * 4096 + np.clip(y, 0, None) // self.CELL)
+        reach = self.CELL + int(self.sizes.max())
+        return [pygame.Rect(cx * self.CELL, cy * self.CELL, reach, reach)
+                for cx, cy in zip((cells // 4096).tolist(), (cells % 4096).tolist())]
+
+
+particles = ParticlePool()
 
 
 # Класс монетки
+# grouped=False - в группы спрайт добавит вызывающий (восстановление снимка пачкой)
 class Coin(pygame.sprite.Sprite):
-    def __init__(self, pos):
-        super().__init__(all_sprites, coins)
-        if coin_img:
-            self.image = coin_img
-        else:
-            self.image = pygame.Surface((TILE_SIZE // 2, TILE_SIZE // 2))
-            self.image.fill(YELLOW)
+    def __init__(self, pos, grouped=True):
+        super().__init__(*((all_sprites, coins) if grouped else ()))
+        self.image = assets.sprite("coin")
         self.rect = self.image.get_rect(center=pos)
+        coin_hash.add(self)
+
+    def kill(self):
+        coin_hash.remove(self)
+        super().kill()
 
 
 # Класс врага
 class Enemy(pygame.sprite.Sprite):
-    def __init__(self, pos, is_boss=False):
-        super().__init__(all_sprites, enemies)
+    def __init__(self, pos, is_boss=False, grouped=True):
+        super().__init__(*((all_sprites, enemies) if grouped else ()))
         self.is_boss = is_boss
+        self.image = assets.sprite("boss" if is_boss else "enemy")
+        self.rect = self.image.get_rect(center=pos)
+        self.health = 10 if is_boss else 1
+        self.speed = 2
+
+        # Для ИИ
+        self.activation_time = game_clock.get_ticks() + 500  # активируются через 0,5 секунды
+
+    def is_active(self):
+        return game_clock.get_ticks() >= self.activation_time
 
-        if is_boss and boss_img:
-            self.image = boss_img
-            self.rect = self.image.get_rect(center=pos)
-            self.health = 10
-            self.speed = 2
-        elif enemy_img:
-            self.image = enemy_img
-            self.rect = self.image.get_rect(center=pos)
-            self.health = 1
-            self.speed = 2
+    def update(self, steps=1):
+        # steps - число тиков, пройденных с прошлого обновления: враг, которого
+        # планировщик ИИ обновляет реже, догоняет их одним более длинным шагом
+        # Проверяем, активирован ли враг
+        if not self.is_active() or not player.alive():
+            return
+        speed = self.speed * steps
+
+        # Следующая клетка пути к игроку из поля направлений
+        tile = tile_at(self.rect.center)
+        next_tile = flow_field.next_tile(tile)
+        if next_tile is None:
+            # В клетке игрока (или путь не найден) - идем прямо к игроку
+            target = player.rect.center
         else:
-            size = (TILE_SIZE, TILE_SIZE) if is_boss else (TILE_SIZE // 2, TILE_SIZE // 2)
-            color = PURPLE if is_boss else GREEN
-            self.image = pygame.Surface(size)
-            self.image.fill(color)
-            self.rect = self.image.get_rect(center=pos)
-            self.health = 10 if is_boss else 1
-            self.speed = 2
+            target = tile_center(next_tile)
 
-        # Для ИИ
-        self.stuck_timer = 0
-        self.stuck_direction = None
-        self.last_position = pygame.math.Vector2(pos)
-        self.activation_time = pygame.time.get_ticks() + 500  # активируются через 0,5 секунды
+        # Рассчитываем направление к цели
+        dx = target[0] - self.rect.centerx
+        dy = target[1] - self.rect.centery
+        distance = max(1, (dx ** 2 + dy ** 2) ** 0.5)  # избегаем деления на ноль
+
+        # Двигаем врага по осям отдельно, чтобы скользить вдоль стен
+        if not self.move(round(dx / distance * speed), round(dy / distance * speed)) and tile:
+            # Уперлись в угол - выравниваемся по центру своей клетки
+            cx, cy = tile_center(tile)
+            self.move(max(-speed, min(speed, cx - self.rect.centerx)),
+                      max(-speed, min(speed, cy - self.rect.centery)))
+
+    def move(self, dx, dy):
+        # Возвращает True, если удалось сдвинуться хотя бы по одной оси
+        moved = False
+        if dx != 0:
+            self.rect.x += dx
+            if wall_grid.collide_rect(self.rect):
+                self.rect.x -= dx
+            else:
+                moved = True
+        if dy != 0:
+            self.rect.y += dy
+            if wall_grid.collide_rect(self.rect):
+                self.rect.y -= dy
+            else:
+                moved = True
+        return moved
+
+
+# Стая врагов для режима --horde. Положения, размеры, скорости, здоровье и
+# время активации всех врагов уровня хранятся в массивах, а движение по полю
+# направлений, стены и касания игрока считаются за один пакетный шаг по тем же
+# правилам, что Enemy.update. Спрайты остаются для отрисовки, сеток
+# столкновений и целей пуль; их прямоугольники обновляются после шага.
+class EnemyHorde:
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.x = np.zeros(capacity, np.int32)  # левый верхний угол прямоугольника
+        self.y = np.zeros(capacity, np.int32)
+        self.width = np.zeros(capacity, np.int32)
+        self.height = np.zeros(capacity, np.int32)
+        self.speed = np.zeros(capacity, np.int32)
+        self.health = np.zeros(capacity, np.int32)
+        self.activation = np.zeros(capacity, np.int64)
+        self.boss = np.zeros(capacity, bool)
+        self.alive = np.zeros(capacity, bool)
+        # Номер появления: касания разбираются в порядке появления врагов
+        self.seq = np.zeros(capacity, np.int64)
+        self.next_seq = 0
+        self.sprites = [None] * capacity
+        self.free = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return self.capacity - len(self.free)
+
+    def grow(self):
+        old = self.capacity
+        self.capacity *= 2
+        for name in ("x", "y", "width", "height", "speed", "health", "activation", "boss", "alive", "seq"):
+            array = getattr(self, name)
+            grown = np.zeros(self.capacity, array.dtype)
+            grown[:old] = array
+            setattr(self, name, grown)
+        self.sprites.extend([None] * old)
+        self.free.extend(range(self.capacity - 1, old - 1, -1))
+
+    def reserve(self):
+        if not self.free:
+            self.grow()
+        i = self.free.pop()
+        self.seq[i] = self.next_seq
+        self.next_seq += 1
+        return i
+
+    def attach(self, enemy):
+        i = enemy.slot
+        self.x[i], self.y[i] = enemy.rect.topleft
+        self.width[i], self.height[i] = enemy.rect.size
+        self.speed[i] = enemy.speed
+        self.activation[i] = enemy.activation_time
+        self.boss[i] = enemy.is_boss
+        self.alive[i] = True
+        self.sprites[i] = enemy
+
+    def release(self, i):
+        self.alive[i] = False
+        self.sprites[i] = None
+        self.free.append(i)
+
+    def move(self, idx, dx, dy):
+        # Enemy.move для массива врагов: по осям отдельно, откат при стене.
+        # Возвращает маску врагов, сдвинувшихся хотя бы по одной оси.
+        width, height = self.width[idx], self.height[idx]
+        x = self.x[idx] + dx
+        moved_x = (dx != 0) & ~wall_grid.collide_rects(x, self.y[idx], width, height)
+        self.x[idx] = np.where(moved_x, x, self.x[idx])
+        y = self.y[idx] + dy
+        moved_y = (dy != 0) & ~wall_grid.collide_rects(self.x[idx], y, width, height)
+        self.y[idx] = np.where(moved_y, y, self.y[idx])
+        return moved_x | moved_y
 
     def update(self):
-        # Проверяем, активирован ли враг
-        if pygame.time.get_ticks() < self.activation_time:
+        # Спящие (до activation_time) и мертвые враги не считаются
+        if not player.alive():
             return
+        idx = np.flatnonzero(self.alive & (self.activation <= game_clock.get_ticks()))
+        if not len(idx):
+            return
+        old_x = self.x[idx]
+        old_y = self.y[idx]
+        center_x = old_x + self.width[idx] // 2
+        center_y = old_y + self.height[idx] // 2
+        speed = self.speed[idx]
+
+        # Клетка врага и следующая клетка пути из поля направлений
+        tile_x = center_x // TILE_SIZE
+        tile_y = (center_y - 40) // TILE_SIZE
+        on_map = (tile_x >= 0) & (tile_x < MAP_WIDTH) & (tile_y >= 0) & (tile_y < MAP_HEIGHT)
+        tile_x = np.where(on_map, tile_x, 0)
+        tile_y = np.where(on_map, tile_y, 0)
+        next_x, next_y = flow_field.parent_arrays()
+        step_x = np.where(on_map, next_x[tile_x, tile_y], -1)
+        step_y = np.where(on_map, next_y[tile_x, tile_y], -1)
+        # В клетке игрока (или путь не найден) - идем прямо к игроку
+        has_step = step_x >= 0
+        target_x = np.where(has_step, step_x * TILE_SIZE + TILE_SIZE // 2, player.rect.centerx)
+        target_y = np.where(has_step, step_y * TILE_SIZE + TILE_SIZE // 2 + 40, player.rect.centery)
+
+        dx = target_x - center_x
+        dy = target_y - center_y
+        distance = np.maximum(1, np.sqrt(dx * dx + dy * dy))
+        moved = self.move(idx, np.round(dx / distance * speed).astype(np.int32),
+                          np.round(dy / distance * speed).astype(np.int32))
+
+        # Уперлись в угол - выравниваемся по центру своей клетки
+        stuck = ~moved & on_map
+        if stuck.any():
+            stuck_idx = idx[stuck]
+            stuck_speed = speed[stuck]
+            cx = tile_x[stuck] * TILE_SIZE + TILE_SIZE // 2 - center_x[stuck]
+            cy = tile_y[stuck] * TILE_SIZE + TILE_SIZE // 2 + 40 - center_y[stuck]
+            self.move(stuck_idx, np.clip(cx, -stuck_speed, stuck_speed), np.clip(cy, -stuck_speed, stuck_speed))
+
+        # Прямоугольники спрайтов - только у сдвинувшихся
+        changed = (self.x[idx] != old_x) | (self.y[idx] != old_y)
+        changed_idx = idx[changed]
+        sprites = self.sprites
+        for i, x, y in zip(changed_idx.tolist(), self.x[changed_idx].tolist(), self.y[changed_idx].tolist()):
+            sprites[i].rect.topleft = (x, y)
+
+    def touch_player(self, target):
+        # Касания игрока target всеми активными врагами одной проверкой пересечения
+        rect = target.rect
+        touching = (self.alive & (self.activation <= game_clock.get_ticks())
+                    & (self.x < rect.right) & (self.x + self.width > rect.left)
+                    & (self.y < rect.bottom) & (self.y + self.height > rect.top))
+        idx = np.flatnonzero(touching)
+        for i in idx[np.argsort(self.seq[idx], kind="stable")].tolist():
+            enemy = self.sprites[i]
+            if not enemy.alive():
+                continue  # уже погиб от касания другого игрока
+            target.health -= 2 if self.boss[i] else 1
+            particles.emit("blood", [target.rect.center])
+            if not self.boss[i]:
+                # Создаем монетку на месте врага
+                Coin(enemy.rect.center)
+                particles.emit("burst", [enemy.rect.center])
+                enemy.kill()
 
-        # Проверяем, не застрял ли враг
-        current_pos = pygame.math.Vector2(self.rect.center)
-        if (current_pos - self.last_position).length() < 1:
-            self.stuck_timer += 1
-            if self.stuck_timer > 5:  # Застрял на 30 кадров
-                # Пытаемся сменить направление
-                self.stuck_direction = pygame.math.Vector2(random.uniform(-1, 1), random.uniform(-1, 1)).normalize()
-        else:
-            self.stuck_timer = 0
-            self.stuck_direction = None
-
-        self.last_position = current_pos
-
-        # Если застряли, двигаемся в случайном направлении
-        if self.stuck_direction:
-            self.rect.x += int(self.stuck_direction.x * self.speed)
-            self.rect.y += int(self.stuck_direction.y * self.speed)
-
-            # Проверяем столкновение со стенами
-            if pygame.sprite.spritecollideany(self, walls):
-                self.rect.x -= int(self.stuck_direction.x * self.speed)
-                self.rect.y -= int(self.stuck_direction.y * self.speed)
-                # Создаем новое направление
-                self.stuck_direction = pygame.math.Vector2(random.uniform(-1, 1), random.uniform(-1, 1)).normalize()
-        # Иначе преследуем игрока
-        elif player.alive():
-            # Рассчитываем направление к игроку
-            dx = player.rect.centerx - self.rect.centerx
-            dy = player.rect.centery - self.rect.centery
-            distance = max(1, (dx ** 2 + dy ** 2) ** 0.5)  # избегаем деления на ноль
-
-            # Нормализуем вектор направления
-            dx /= distance
-            dy /= distance
-
-            # Двигаем врага к игроку
-            self.rect.x += int(dx * self.speed)
-            self.rect.y += int(dy * self.speed)
-
-            # Проверяем столкновение со стенами
-            if pygame.sprite.spritecollideany(self, walls):
-                self.rect.x -= int(dx * self.speed)
-                self.rect.y -= int(dy * self.speed)
-                # Помечаем, что застряли
-                self.stuck_timer = 30
-
-        # Столкновение с игроком
-        if pygame.sprite.collide_rect(self, player):
-            player.health -= 2 if self.is_boss else 1
-            if not self.is_boss:
+
+# Враг стаи: состояние хранится в EnemyHorde, спрайт только отображает его
+class HordeEnemy(Enemy):
+    def __init__(self, horde, pos, is_boss=False, grouped=True):
+        self.horde = horde
+        self.slot = horde.reserve()
+        super().__init__(pos, is_boss, grouped)
+        horde.attach(self)
+
+    @property
+    def health(self):
+        return int(self.horde.health[self.slot])
+
+    @health.setter
+    def health(self, value):
+        self.horde.health[self.slot] = value
+
+    def update(self, steps=1):
+        # Движение всей стаи считает EnemyHorde.update
+        pass
+
+    def kill(self):
+        if self.alive():
+            self.horde.release(self.slot)
+        super().kill()
+
+
+# Новый враг: в режиме стаи - под управлением enemy_horde, иначе - планировщика ИИ
+def new_enemy(pos, is_boss=False):
+    if enemy_horde is not None:
+        return HordeEnemy(enemy_horde, pos, is_boss)
+    enemy = Enemy(pos, is_boss)
+    ai_scheduler.add(enemy)
+    return enemy
+
+
+# Планировщик ИИ врагов с уровнями детализации.
+# Спящие враги (до activation_time) лежат в куче по времени пробуждения и ничего
+# не стоят. Враги на экране (с запасом NEAR_MARGIN) обновляются каждый тик.
+# Дальние - раз в FAR_INTERVAL тиков со сдвигом фазы по номеру врага, чтобы
+# не обновляться всем в один кадр, и не больше FAR_BUDGET за тик: кто не влез
+# в бюджет, обновляется в следующих тиках первым. Пропущенные тики враг
+# догоняет одним шагом длиной до MAX_STEPS тиков.
+# Бюджет считается в обновлениях, а не в миллисекундах, чтобы симуляция
+# оставалась детерминированной и записи воспроизводились.
+class AIScheduler:
+    FAR_INTERVAL = 4
+    FAR_BUDGET = 64
+    MAX_STEPS = 8  # 16 px при скорости 2 - меньше клетки, сквозь стену не проскочить
+    NEAR_MARGIN = 2 * TILE_SIZE
+    # Состояния врага в снимке мира
+    UNKNOWN, DORMANT, AWAKE = 0, 1, 2
+
+    def __init__(self):
+        self.dormant = []  # куча (время активации, номер, враг)
+        self.awake = []  # проснувшиеся враги в порядке пробуждения
+        self.last_tick = {}  # враг -> тик последнего обновления
+        self.phase = {}  # враг -> сдвиг тика обновления вдали
+        self.next_seq = 0
+        self.counters = {"dormant": 0, "near": 0, "far": 0, "deferred": 0, "budget_used": 0.0}
+
+    def add(self, enemy):
+        heapq.heappush(self.dormant, (enemy.activation_time, self.next_seq, enemy))
+        self.phase[enemy] = self.next_seq % self.FAR_INTERVAL
+        self.next_seq += 1
+
+    def clear(self):
+        self.dormant.clear()
+        self.awake.clear()
+        self.last_tick.clear()
+        self.phase.clear()
+
+    def forget(self, enemy):
+        self.last_tick.pop(enemy, None)
+        self.phase.pop(enemy, None)
+
+    def snapshot(self):
+        # Враг -> (состояние, ключ, сдвиг фазы, тик последнего обновления).
+        # Ключ спящего - его номер в куче, проснувшегося - место в списке awake.
+        state = {}
+        for _, seq, enemy in self.dormant:
+            state[enemy] = (self.DORMANT, seq, self.phase.get(enemy, 0), 0)
+        for i, enemy in enumerate(self.awake):
+            state[enemy] = (self.AWAKE, i, self.phase.get(enemy, 0), self.last_tick.get(enemy, 0))
+        return state
+
+    def restore(self, entries, next_seq):
+        # entries - (враг, состояние, ключ, сдвиг, тик) из снимка мира
+        self.clear()
+        awake = []
+        for enemy, status, key, phase, tick in entries:
+            if status == self.DORMANT:
+                self.dormant.append((enemy.activation_time, key, enemy))
+            elif status == self.AWAKE:
+                awake.append((key, enemy))
+                self.last_tick[enemy] = tick
+            else:
+                continue
+            self.phase[enemy] = phase
+        heapq.heapify(self.dormant)
+        awake.sort(key=lambda item: item[0])
+        self.awake = [enemy for _, enemy in awake]
+        self.next_seq = next_seq
+
+    def update(self):
+        tick = game_clock.frame
+        now = game_clock.get_ticks()
+        while self.dormant and self.dormant[0][0] <= now:
+            enemy = heapq.heappop(self.dormant)[2]
+            if enemy.alive():
+                self.awake.append(enemy)
+                self.last_tick[enemy] = tick - 1
+            else:
+                self.forget(enemy)
+
+        near = 0
+        due = []
+        if player.alive():
+            near_view = Camera.view_at(player.rect.center).inflate(2 * self.NEAR_MARGIN, 2 * self.NEAR_MARGIN)
+            awake = []
+            for enemy in self.awake:
+                if not enemy.alive():
+                    self.forget(enemy)
+                    continue
+                awake.append(enemy)
+                last = self.last_tick[enemy]
+                if near_view.colliderect(enemy.rect):
+                    enemy.update(min(tick - last, self.MAX_STEPS))
+                    self.last_tick[enemy] = tick
+                    near += 1
+                elif (tick + self.phase[enemy]) % self.FAR_INTERVAL == 0 or tick - last > self.FAR_INTERVAL:
+                    due.append(enemy)
+            self.awake = awake
+
+        # Дольше всех ждавшие - первыми (сортировка устойчива, порядок детерминирован)
+        due.sort(key=self.last_tick.__getitem__)
+        for enemy in due[:self.FAR_BUDGET]:
+            enemy.update(min(tick - self.last_tick[enemy], self.MAX_STEPS))
+            self.last_tick[enemy] = tick
+
+        far = min(len(due), self.FAR_BUDGET)
+        self.counters["dormant"] = len(self.dormant)
+        self.counters["near"] = near
+        self.counters["far"] = far
+        self.counters["deferred"] = len(due) - far
+        self.counters["budget_used"] = round(far / self.FAR_BUDGET, 2)
+        for name, value in self.counters.items():
+            profiler.count("ai:" + name, value)
+
+
+ai_scheduler = AIScheduler()
+
+
+# Пакетное перенаведение самонаводящихся пуль.
+# Пули без цели (новые или чья цель погибла) получают ближайшего врага из
+# сетки enemy_hash; пули одного залпа вылетают из одной точки, поэтому
+# запрос для одной позиции выполняется один раз.
+def retarget_homing():
+    nearest_by_pos = {}
+    targets = bullet_pool.targets
+    for i in np.flatnonzero(bullet_pool.active & bullet_pool.homing).tolist():
+        if targets[i] and targets[i].alive():
+            continue
+        pos = bullet_pool.center(i)
+        if pos not in nearest_by_pos:
+            nearest_by_pos[pos] = enemy_hash.nearest(pos)
+        targets[i] = nearest_by_pos[pos]
+
+
+# Проверка столкновений после обновления спрайтов.
+# Сетки перестраиваются один раз за кадр и используются всеми запросами.
+def resolve_collisions():
+    enemy_hash.rebuild(enemies)
+    coin_hash.commit()
+
+    # Попадания пуль по врагам в порядке выстрелов: первый враг на пути пули
+    # за тик, если он ближе стены (запрос возвращает только живых врагов, так
+    # что погибший от предыдущей пули уже не мишень)
+    if enemy_hash.bounds is not None:
+        rect = pygame.Rect((0, 0), bullet_pool.size())
+        spent = []
+        sparks = []
+        bursts = []
+        order = bullet_pool.indices()
+        for i, x, y, start_x, start_y, wall_hit in zip(
+                order.tolist(), bullet_pool.x[order].tolist(), bullet_pool.y[order].tolist(),
+                bullet_pool.start_x[order].tolist(), bullet_pool.start_y[order].tolist(),
+                bullet_pool.wall_hit[order].tolist()):
+            rect.topleft = (start_x, start_y)
+            found = enemy_hash.sweep(rect, x - start_x, y - start_y)
+            if found is None or found[0] >= wall_hit:
+                continue
+            hit = found[1]
+            hit.health -= 1
+            sparks.append((rect.centerx + (x - start_x) * found[0], rect.centery + (y - start_y) * found[0]))
+            if hit.health <= 0:
+                # Создаем монетку на месте врага
+                Coin(hit.rect.center)
+                bursts.append(hit.rect.center)
+                hit.kill()
+                player.coins += 1
+            spent.append(i)
+        bullet_pool.kill(spent)
+        particles.emit("spark", sparks)
+        particles.emit("burst", bursts)
+    bullet_pool.kill_wall_hits()
+
+    # Столкновение врагов с игроками
+    for target in players():
+        if enemy_horde is not None:
+            enemy_horde.touch_player(target)
+            continue
+        for enemy in enemy_hash.query(target.rect):
+            if not enemy.is_active():
+                continue
+            target.health -= 2 if enemy.is_boss else 1
+            particles.emit("blood", [target.rect.center])
+            if not enemy.is_boss:
                 # Создаем монетку на месте врага
-                Coin(self.rect.center)
-                self.kill()
+                Coin(enemy.rect.center)
+                particles.emit("burst", [enemy.rect.center])
+                enemy.kill()
+
+    # Сбор монет (в кооперативе - в общий кошелек)
+    for target in players():
+        for coin in coin_hash.query(target.rect):
+            coin.kill()
+            player.coins += 1
+
+    # Погибший второй игрок выбывает до следующего уровня
+    if ally is not None and ally.alive() and ally.health <= 0:
+        ally.kill()
+
+
+# Ввод игрока за один тик - битовая маска (один байт): движение и выстрел
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_UP = 4
+INPUT_DOWN = 8
+SHOOT_UP = 16
+SHOOT_DOWN = 32
+SHOOT_LEFT = 64
+SHOOT_RIGHT = 128
+SHOT_DIRECTIONS = [(SHOOT_UP, (0, -1)), (SHOOT_DOWN, (0, 1)), (SHOOT_LEFT, (-1, 0)), (SHOOT_RIGHT, (1, 0))]
+
+
+def encode_input(move_x, move_y, shot=None):
+    bits = 0
+    if move_x < 0:
+        bits |= INPUT_LEFT
+    elif move_x > 0:
+        bits |= INPUT_RIGHT
+    if move_y < 0:
+        bits |= INPUT_UP
+    elif move_y > 0:
+        bits |= INPUT_DOWN
+    for flag, direction in SHOT_DIRECTIONS:
+        if shot == direction:
+            bits |= flag
+    return bits
+
+
+def decode_move(bits):
+    # Как и раньше с клавишами: при A+D побеждает D, при W+S побеждает S
+    dx = 1 if bits & INPUT_RIGHT else (-1 if bits & INPUT_LEFT else 0)
+    dy = 1 if bits & INPUT_DOWN else (-1 if bits & INPUT_UP else 0)
+    return dx, dy
+
+
+def decode_shot(bits):
+    for flag, direction in SHOT_DIRECTIONS:
+        if bits & flag:
+            return direction
+    return None
+
+
+# Управление с клавиатуры: движение на WASD, выстрел по нажатию стрелки
+class KeyboardController:
+    SHOOT_KEYS = {pygame.K_UP: (0, -1), pygame.K_DOWN: (0, 1), pygame.K_LEFT: (-1, 0), pygame.K_RIGHT: (1, 0)}
+
+    def __init__(self):
+        self.pending_shot = None
+
+    def start_level(self, tile_map, door_tile):
+        self.pending_shot = None
+
+    def handle_event(self, event):
+        # За тик засчитывается первое нажатие (остальные отсекла бы задержка выстрела)
+        if event.type == pygame.KEYDOWN and event.key in self.SHOOT_KEYS and self.pending_shot is None:
+            self.pending_shot = self.SHOOT_KEYS[event.key]
+
+    def get_input(self):
+        keys = pygame.key.get_pressed()
+        dx = dy = 0
+        if keys[pygame.K_a]:
+            dx = -1
+        if keys[pygame.K_d]:
+            dx = 1
+        if keys[pygame.K_w]:
+            dy = -1
+        if keys[pygame.K_s]:
+            dy = 1
+        shot, self.pending_shot = self.pending_shot, None
+        return encode_input(dx, dy, shot)
+
+
+# Бот для безголового режима: идет к двери по полю направлений, стреляет
+# по ближайшему врагу в одном из четырех направлений (как игрок стрелками)
+# и жадно покупает улучшения в магазине.
+class BotController:
+    def __init__(self, shoot_range=TILE_SIZE * 6):
+        self.shoot_range = shoot_range
+        self.door_field = None
+
+    def start_level(self, tile_map, door_tile):
+        self.door_field = FlowField(tile_map)
+        self.door_field.update(door_tile)
+
+    def get_input(self):
+        next_tile = self.door_field.next_tile(tile_at(player.rect.center))
+        target = tile_center(next_tile or self.door_field.target)
+        dx = target[0] - player.rect.centerx
+        dy = target[1] - player.rect.centery
+        # Мертвая зона в полшага, чтобы не дрожать вокруг центра клетки
+        dead_zone = player.speed // 2
+        move_x = (dx > dead_zone) - (dx < -dead_zone)
+        move_y = (dy > dead_zone) - (dy < -dead_zone)
+        return encode_input(move_x, move_y, self.aim())
+
+    def aim(self):
+        target = enemy_hash.nearest(player.rect.center, self.shoot_range)
+        if target is None:
+            return None
+        dx = target.rect.centerx - player.rect.centerx
+        dy = target.rect.centery - player.rect.centery
+        if dx * dx + dy * dy > self.shoot_range ** 2:
+            return None
+        if abs(dx) > abs(dy):
+            return (1, 0) if dx > 0 else (-1, 0)
+        return (0, 1) if dy > 0 else (0, -1)
+
+    def shop(self):
+        purchases = []
+        for choice in ("homing", "multishot", "health"):
+            while buy_upgrade(choice):
+                purchases.append(choice)
+        return purchases
+
+
+# Запись забега: зерно, ввод по тикам (байт на тик) и покупки в магазине.
+# Сжатая запись весит несколько килобайт и воспроизводится бит в бит.
+class InputRecording:
+    MAGIC = b"RGRP"
+    VERSION = 3  # 2: у каждого уровня свое зерно из rng; 3: пули проверяются по всему пути
+    HEADER = struct.Struct("<4sBQIII")  # метка, версия, зерно, тиков, байт покупок, контрольная сумма
+    SHOP_CODES = {"multishot": 1, "homing": 2, "health": 3}
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.inputs = bytearray()
+        self.shops = []  # покупки за каждый визит в магазин
+        self.checksum = 0
+
+    def save(self, path):
+        shop_bytes = bytearray()
+        for visit in self.shops:
+            shop_bytes.extend(self.SHOP_CODES[choice] for choice in visit)
+            shop_bytes.append(0)  # конец визита
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, self.seed, len(self.inputs),
+                                  len(shop_bytes), self.checksum)
+        with open(path, "wb") as f:
+            f.write(header + zlib.compress(bytes(shop_bytes) + bytes(self.inputs), 9))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, seed, ticks, shop_size, checksum = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError(f"{path}: not a recording or recorded by an older version")
+        body = zlib.decompress(data[cls.HEADER.size:])
+        recording = cls(seed)
+        recording.checksum = checksum
+        recording.inputs = bytearray(body[shop_size:shop_size + ticks])
+        names = {code: name for name, code in cls.SHOP_CODES.items()}
+        visit = []
+        for code in body[:shop_size]:
+            if code == 0:
+                recording.shops.append(visit)
+                visit = []
+            else:
+                visit.append(names[code])
+        return recording
+
+
+# Обертка контроллера, которая пишет его ввод и покупки в InputRecording
+class RecordingController:
+    def __init__(self, controller, recording):
+        self.controller = controller
+        self.recording = recording
+
+    def start_level(self, tile_map, door_tile):
+        self.controller.start_level(tile_map, door_tile)
+
+    def handle_event(self, event):
+        self.controller.handle_event(event)
+
+    def get_input(self):
+        bits = self.controller.get_input()
+        self.recording.inputs.append(bits)
+        return bits
+
+    def shop(self):
+        purchases = self.controller.shop()
+        self.recording.shops.append(purchases)
+        return purchases
+
+
+# Воспроизведение записи: ввод берется из записи, а не с клавиатуры
+class ReplayController:
+    def __init__(self, recording):
+        self.recording = recording
+        self.tick = 0
+        self.visit = 0
+
+    def start_level(self, tile_map, door_tile):
+        pass
+
+    def get_input(self):
+        if self.tick >= len(self.recording.inputs):
+            return 0
+        bits = self.recording.inputs[self.tick]
+        self.tick += 1
+        return bits
+
+    def shop(self):
+        purchases = []
+        if self.visit < len(self.recording.shops):
+            for choice in self.recording.shops[self.visit]:
+                if buy_upgrade(choice):
+                    purchases.append(choice)
+            self.visit += 1
+        return purchases
+
+
+# Контрольная сумма состояния мира для проверки воспроизведения
+def state_checksum():
+    state = [level, game_clock.frame, player.rect.x, player.rect.y, player.health, player.coins]
+    for sprite in enemies:
+        state.extend((sprite.rect.x, sprite.rect.y))
+    order = bullet_pool.indices()
+    for x, y in zip(bullet_pool.x[order].tolist(), bullet_pool.y[order].tolist()):
+        state.extend((x, y))
+    for sprite in coins:
+        state.extend((sprite.rect.x, sprite.rect.y))
+    state.extend(enemy.health for enemy in enemies)
+    if ally is not None:
+        state.extend((ally.rect.x, ally.rect.y, ally.health))
+    return zlib.crc32(struct.pack(f"<{len(state)}i", *state))
+
+
+# Снимок мира: все, от чего зависит дальнейшая симуляция, в компактном
+# двоичном виде - заголовок struct, затем массивы записей NumPy: порядок
+# спрайтов в all_sprites, враги (с состоянием планировщика ИИ), монеты, пули,
+# состояние rng и, для сохранений на диск, карта и открытые туманом клетки.
+# Спрайты не сериализуются (pickle), а пересоздаются из записей, поэтому
+# снимок и восстановление уровня с десятками врагов занимают доли миллисекунды.
+# После восстановления симуляция с тем же вводом идет бит в бит как без него.
+class WorldSnapshot:
+    MAGIC = b"RGSV"
+    VERSION = 1
+    # метка, версия, флаги, уровень, тик, зерно следующего уровня, ширина и высота
+    # карты, число спрайтов, врагов, монет и пуль, следующие номера пуль и ИИ,
+    # запасное гауссово число rng (nan - нет)
+    HEADER = struct.Struct("<4sBBIIQHHIIIIqqd")
+    # игрок: x, y, здоровье, бонус здоровья, мультивыстрел, самонаведение, монеты,
+    # последний выстрел, ввод; улучшения: мультивыстрел, самонаведение, здоровье; дверь: x, y
+    PLAYER = struct.Struct("<iiiiiBiqBiBiii")
+    ENEMY = np.dtype([("x", "<i4"), ("y", "<i4"), ("health", "<i4"), ("activation", "<i8"), ("boss", "u1"),
+                      ("ai", "u1"), ("ai_key", "<i8"), ("ai_phase", "u1"), ("ai_tick", "<i8")])
+    COIN = np.dtype([("x", "<i4"), ("y", "<i4")])
+    RNG_WORDS = 625  # слова состояния Mersenne Twister вместе с позицией
+    # Флаги
+    MAP = 1  # карта и туман (сохранение на диск, а не кадр перемотки)
+    FOG = 2
+    HORDE = 4
+    # Виды спрайтов в порядке all_sprites
+    KIND_PLAYER, KIND_DOOR, KIND_ENEMY, KIND_COIN = range(4)
+
+    @classmethod
+    def capture(cls, door, next_seed=0, with_map=False):
+        # Снимок текущего мира (bytes). next_seed - зерно уже заказанного
+        # следующего уровня, with_map - добавить карту для загрузки на другом уровне
+        kinds = bytearray()
+        enemy_list = []
+        coin_list = []
+        for sprite in all_sprites:
+            if sprite is player:
+                kinds.append(cls.KIND_PLAYER)
+            elif sprite is door:
+                kinds.append(cls.KIND_DOOR)
+            elif isinstance(sprite, Enemy):
+                kinds.append(cls.KIND_ENEMY)
+                enemy_list.append(sprite)
+            elif isinstance(sprite, Coin):
+                kinds.append(cls.KIND_COIN)
+                coin_list.append(sprite)
+            # второй игрок кооператива живет только в сетевой сессии и в снимок не входит
+
+        ai_state = ai_scheduler.snapshot() if enemy_horde is None else {}
+        unknown = (AIScheduler.UNKNOWN, 0, 0, 0)
+        enemy_records = np.array([(e.rect.x, e.rect.y, e.health, e.activation_time, e.is_boss) + ai_state.get(e, unknown)
+                                  for e in enemy_list], cls.ENEMY)
+        coin_records = np.array([c.rect.topleft for c in coin_list], cls.COIN)
+        bullets = bullet_pool.snapshot({enemy: i for i, enemy in enumerate(enemy_list)})
+        _, words, gauss = rng.getstate()
+
+        flags = 0
+        body = [kinds, enemy_records.tobytes(), coin_records.tobytes(), bullets.tobytes(),
+                np.array(words, np.uint32).tobytes()]
+        if with_map:
+            flags |= cls.MAP
+            body.append(wall_grid.tile_map.tiles)
+            if fog is not None:
+                flags |= cls.FOG
+                body.append(fog.seen)
+        if enemy_horde is not None:
+            flags |= cls.HORDE
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, flags, level, game_clock.frame, next_seed,
+                                 MAP_WIDTH, MAP_HEIGHT, len(kinds), len(enemy_list), len(coin_list), len(bullets),
+                                 bullet_pool.next_seq, ai_scheduler.next_seq, math.nan if gauss is None else gauss)
+        state = cls.PLAYER.pack(player.rect.x, player.rect.y, player.health, player.health_bonus,
+                                player.multishot_level, player.has_homing, player.coins, player.last_shot,
+                                player.input, player_upgrades.multishot_level, player_upgrades.has_homing,
+                                player_upgrades.health_level, door.rect.x, door.rect.y)
+        return b"".join([header, state] + body)
+
+    @classmethod
+    def restore(cls, data, controller=None, preloader=None):
+        # Восстановление мира из снимка. Снимок с картой перестраивает уровень:
+        # новая заготовка, дверь для контроллера, следующий уровень заказывается
+        # у preloader заново. Возвращает дверь и заготовку (None - уровень тот же).
+        global level, player, player_upgrades, horde_mode, enemy_horde, wall_grid, flow_field, fog
+        (magic, version, flags, number, frame, next_seed, width, height, sprite_count, enemy_count,
+         coin_count, bullet_count, bullet_seq, ai_seq, gauss) = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("not a world snapshot or saved by an older version")
+        if (width, height) != (MAP_WIDTH, MAP_HEIGHT):
+            raise ValueError(f"snapshot map is {width}x{height}, current map is {MAP_WIDTH}x{MAP_HEIGHT}")
+        (x, y, health, health_bonus, multishot, homing, coin_total, last_shot, bits,
+         up_multishot, up_homing, up_health, door_x, door_y) = cls.PLAYER.unpack_from(data, cls.HEADER.size)
+        offset = cls.HEADER.size + cls.PLAYER.size
+        kinds = data[offset:offset + sprite_count]
+        offset += sprite_count
+        enemy_records = np.frombuffer(data, cls.ENEMY, enemy_count, offset)
+        offset += enemy_records.nbytes
+        coin_records = np.frombuffer(data, cls.COIN, coin_count, offset)
+        offset += coin_records.nbytes
+        bullets = np.frombuffer(data, BulletPool.SNAPSHOT, bullet_count, offset)
+        offset += bullets.nbytes
+        words = np.frombuffer(data, np.uint32, cls.RNG_WORDS, offset)
+        offset += words.nbytes
+
+        clear_sprites()
+        level = number
+        game_clock.frame = frame
+        rng.setstate((3, tuple(words.tolist()), None if math.isnan(gauss) else gauss))
+        player_upgrades = PlayerUpgrades()
+        player_upgrades.multishot_level = up_multishot
+        player_upgrades.has_homing = bool(up_homing)
+        player_upgrades.health_level = up_health
+
+        plan = None
+        if flags & cls.MAP:
+            tile_map = TileMap()
+            tile_map.tiles[:] = data[offset:offset + width * height]
+            offset += width * height
+            plan = LevelPlan.from_tile_map(number, tile_map, (x, y), not headless)
+            wall_grid = plan.wall_grid
+            flow_field = plan.flow_field
+            fog = FogOfWar(tile_map, plan.minimap) if fog_mode and plan.minimap is not None else None
+            if flags & cls.FOG:
+                if fog is not None:
+                    fog.reveal(data[offset:offset + width * height])
+                offset += width * height
+        horde_mode = bool(flags & cls.HORDE)
+        enemy_horde = EnemyHorde() if horde_mode else None
+
+        # Спрайты в прежнем порядке all_sprites (от него зависят порядок групп и
+        # столкновений). Враги и монеты создаются без групп, а группы собираются
+        # в конце одним add на группу - так заметно быстрее, чем по спрайту.
+        enemy_iter = iter(enemy_records.tolist())
+        coin_iter = iter(coin_records.tolist())
+        enemy_list = []
+        coin_list = []
+        ordered = []
+        door = None
+        for kind in kinds:
+            if kind == cls.KIND_PLAYER:
+                player = Player((0, 0), player_upgrades)
+                ordered.append(player)
+                player.rect.topleft = (x, y)
+                player.health = health
+                player.health_bonus = health_bonus
+                player.max_health = player.base_health + health_bonus
+                player.multishot_level = multishot
+                player.has_homing = bool(homing)
+                player.coins = coin_total
+                player.last_shot = last_shot
+                player.input = bits
+            elif kind == cls.KIND_DOOR:
+                door = new_door((door_x, door_y))
+                ordered.append(door)
+            elif kind == cls.KIND_ENEMY:
+                enemy_x, enemy_y, enemy_health, activation, boss = next(enemy_iter)[:5]
+                if horde_mode:
+                    enemy = HordeEnemy(enemy_horde, (0, 0), bool(boss), grouped=False)
+                else:
+                    enemy = Enemy((0, 0), bool(boss), grouped=False)
+                enemy.rect.topleft = (enemy_x, enemy_y)
+                enemy.activation_time = activation
+                if horde_mode:
+                    enemy_horde.attach(enemy)
+                enemy.health = enemy_health
+                enemy_list.append(enemy)
+                ordered.append(enemy)
+            else:
+                coin = Coin((0, 0), grouped=False)
+                coin.rect.topleft = next(coin_iter)
+                coin_list.append(coin)
+                ordered.append(coin)
+        # Игрок и дверь уже в all_sprites - собираем группу заново в нужном порядке
+        all_sprites.empty()
+        all_sprites.add(ordered)
+        enemies.add(enemy_list)
+        coins.add(coin_list)
+
+        if enemy_horde is None:
+            ai_scheduler.restore(zip(enemy_list, enemy_records["ai"].tolist(), enemy_records["ai_key"].tolist(),
+                                     enemy_records["ai_phase"].tolist(), enemy_records["ai_tick"].tolist()), ai_seq)
+        bullet_pool.restore(bullets, bullet_seq, enemy_list)
+        # Бот целится по сетке врагов еще до первого resolve_collisions
+        # (монеты попадут в свою сетку на его commit)
+        enemy_hash.rebuild(enemies)
+
+        if plan is not None:
+            if controller is not None:
+                controller.start_level(plan.tile_map, tile_at(door.rect.topleft))
+            if preloader is not None:
+                preloader.request(level + 1, next_seed)
+        return door, plan
+
+    @classmethod
+    def save(cls, path, data):
+        with open(path, "wb") as f:
+            f.write(zlib.compress(data, 6))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = zlib.decompress(f.read())
+        if data[:4] != cls.MAGIC:
+            raise ValueError(f"{path}: not a saved game")
+        return data
+
+
+# Запись сохранений на диск в фоне: быстрое сохранение не задерживает кадр
+save_writer = ThreadPoolExecutor(max_workers=1)
+
+
+# Кольцевой буфер снимков для перемотки назад: последние SECONDS секунд
+# по снимку раз в INTERVAL тиков. Снимки лежат подряд в одном заранее выделенном
+# bytearray, поэтому память буфера постоянна: новый снимок затирает самые старые.
+class RewindBuffer:
+    SECONDS = 10
+    INTERVAL = 6
+
+    def __init__(self, capacity=4 * 1024 * 1024):
+        self.data = bytearray(capacity)
+        self.entries = deque()  # (смещение, длина) от старых к новым
+        self.limit = self.SECONDS * FPS // self.INTERVAL
+        self.head = 0  # куда писать следующий снимок
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+        self.head = 0
+
+    def push(self, snapshot):
+        size = len(snapshot)
+        if size > len(self.data):
+            return
+        if self.head + size > len(self.data):
+            # Новый круг: снимки прошлого круга за head самые старые, и после
+            # перехода в начало их уже нельзя отличить по смещению - выбрасываем
+            self.entries = deque(entry for entry in self.entries if entry[0] < self.head)
+            self.head = 0
+        end = self.head + size
+        while len(self.entries) >= self.limit:
+            self.entries.popleft()
+        # Все снимки, на место которых пишем
+        self.entries = deque((offset, length) for offset, length in self.entries
+                             if offset >= end or offset + length <= self.head)
+        self.data[self.head:end] = snapshot
+        self.entries.append((self.head, size))
+        self.head = end
+
+    def pop(self):
+        # Самый свежий снимок (bytes) или None; его место освобождается
+        if not self.entries:
+            return None
+        offset, size = self.entries.pop()
+        self.head = offset
+        return bytes(self.data[offset:offset + size])
 
 
 # Класс прямоугольной комнаты
@@ -352,135 +2310,267 @@ class Room:
 
 
 # Функции для создания коридоров
-def create_h_corridor(x1, x2, y, dungeon_map):
-    for x in range(min(x1, x2), max(x1, x2) + 1):
-        for dy in range(3):  # ширина коридора 3 клетки
-            if 0 <= y + dy < MAP_HEIGHT:
-                dungeon_map[x][y + dy] = 0
+def create_h_corridor(x1, x2, y, tile_map):
+    tile_map.fill_rect(min(x1, x2), y, max(x1, x2) + 1, y + 3)  # ширина коридора 3 клетки
 
 
-def create_v_corridor(y1, y2, x, dungeon_map):
-    for y in range(min(y1, y2), max(y1, y2) + 1):
-        for dx in range(3):
-            if 0 <= x + dx < MAP_WIDTH:
-                dungeon_map[x + dx][y] = 0
+def create_v_corridor(y1, y2, x, tile_map):
+    tile_map.fill_rect(x, min(y1, y2), x + 3, max(y1, y2) + 1)
 
 
 # Генерация случайного уровня (список комнат + соединения)
-def generate_dungeon():
-    # Изначально вся карта заполнена стенами (1)
-    dungeon_map = [[1] * MAP_HEIGHT for _ in range(MAP_WIDTH)]
+def generate_dungeon(rand=rng):
+    # Изначально вся карта заполнена стенами
+    tile_map = TileMap()
     rooms = []
-    for _ in range(5):
-        w, h = random.randint(4, 8), random.randint(4, 8)
-        x = random.randint(1, MAP_WIDTH - w - 1)
-        y = random.randint(1, MAP_HEIGHT - h - 1)
+    # Попыток поставить комнату - 5 на карту 25x18, на больших картах больше
+    for _ in range(max(5, MAP_WIDTH * MAP_HEIGHT // 90)):
+        w, h = rand.randint(4, 8), rand.randint(4, 8)
+        x = rand.randint(1, MAP_WIDTH - w - 1)
+        y = rand.randint(1, MAP_HEIGHT - h - 1)
         new_room = Room(x, y, w, h)
         # Пропускаем пересекающиеся комнаты
         if any(new_room.intersect(o) for o in rooms):
             continue
-        # Вырезаем комнату (пол = 0)
-        for i in range(new_room.x1, new_room.x2):
-            for j in range(new_room.y1, new_room.y2):
-                dungeon_map[i][j] = 0
+        # Вырезаем комнату (пол)
+        tile_map.fill_rect(new_room.x1, new_room.y1, new_room.x2, new_room.y2)
         # Если есть предыдущая комната, соединяем ее с новой
         if rooms:
             prev_center = rooms[-1].center
             new_center = new_room.center
             # Случайный порядок: сначала горизонталь, потом вертикаль, или наоборот
-            if random.choice([True, False]):
-                create_h_corridor(prev_center[0], new_center[0], prev_center[1], dungeon_map)
-                create_v_corridor(prev_center[1], new_center[1], new_center[0], dungeon_map)
+            if rand.choice([True, False]):
+                create_h_corridor(prev_center[0], new_center[0], prev_center[1], tile_map)
+                create_v_corridor(prev_center[1], new_center[1], new_center[0], tile_map)
             else:
-                create_v_corridor(prev_center[1], new_center[1], prev_center[0], dungeon_map)
-                create_h_corridor(prev_center[0], new_center[0], new_center[1], dungeon_map)
+                create_v_corridor(prev_center[1], new_center[1], prev_center[0], tile_map)
+                create_h_corridor(prev_center[0], new_center[0], new_center[1], tile_map)
         rooms.append(new_room)
-    return dungeon_map, rooms
-
-
-# Отрисовка пола и стен, возвращает список координат всех «полых» клетокdef draw_floor_and_walls(dungeon_map):
-    walls.empty()
-    floor_positions = []
-    for x in range(MAP_WIDTH):
-        for y in range(MAP_HEIGHT):
-            tile = dungeon_map[x][y]
-            screen_pos = (x * TILE_SIZE, y * TILE_SIZE + 40)  # +40px для HUD сверху
-            if tile == 0:
-                floor_positions.append((x, y))
-                if floor_img:
-                    screen.blit(floor_img, screen_pos)
-                else:
-                    pygame.draw.rect(screen, GRAY, (*screen_pos, TILE_SIZE, TILE_SIZE))
-            else:
-                pygame.draw.rect(screen, BLACK, (*screen_pos, TILE_SIZE, TILE_SIZE))
-                wall_sprite = pygame.sprite.Sprite()
-                wall_sprite.image = pygame.Surface((TILE_SIZE, TILE_SIZE))
-                wall_sprite.image.fill(BLACK)
-                wall_sprite.rect = wall_sprite.image.get_rect(topleft=screen_pos)
-                walls.add(wall_sprite)
-    return floor_positions
-
-
-# Создание мини-карты (каждая клетка рисуется белым, если пол)
-def create_minimap(dungeon_map):
-    scale = 3
-    mini = pygame.Surface((MAP_WIDTH * scale, MAP_HEIGHT * scale))
-    mini.fill(BLACK)
-    for x in range(MAP_WIDTH):
-        for y in range(MAP_HEIGHT):
-            if dungeon_map[x][y] == 0:
-                pygame.draw.rect(mini, WHITE, (x * scale, y * scale, scale, scale))
-    return mini
-
-
-# Спавн врагов: случайно по количеству в случайных комнатах
-def spawn_enemies(num, rooms):
+    return tile_map, rooms
+
+
+# Мини-карта (пол белым) - сразу из массива пикселей карты.
+# Клетка - 3x3 пикселя, на больших картах меньше. Скрытая мини-карта (туман
+# войны) вся серая, клетки на ней открывает FogOfWar.
+def create_minimap(tile_map, hidden=False):
+    scale = minimap_scale(tile_map)
+    if hidden:
+        return pygame.surfarray.make_surface(tile_map.pixels(scale, DARK_GRAY, DARK_GRAY))
+    return pygame.surfarray.make_surface(tile_map.pixels(scale))
+
+
+def minimap_scale(tile_map):
+    return max(1, min(3, 240 // tile_map.width))
+
+
+# Спавн врагов: случайно по количеству в случайных комнатах.
+# Возвращает список (позиция, босс ли); спрайты создает build_level.
+def spawn_enemies(num, rooms, rand=rng):
+    spawns = []
     for _ in range(num):
-        room = random.choice(rooms)
-        x = random.randint(room.x1 + 1, room.x2 - 2)
-        y = random.randint(room.y1 + 1, room.y2 - 2)
+        room = rand.choice(rooms)
+        x = rand.randint(room.x1 + 1, room.x2 - 2)
+        y = rand.randint(room.y1 + 1, room.y2 - 2)
         pos = (x * TILE_SIZE + TILE_SIZE // 2, y * TILE_SIZE + TILE_SIZE // 2 + 40)
         # Последняя комната - босс
-        if room == rooms[-1] and _ == num - 1:
-            Enemy(pos, is_boss=True)
-        else:
-            Enemy(pos)
+        spawns.append((pos, room == rooms[-1] and _ == num - 1))
+    return spawns
+
+
+# Спавн монет в комнатах (не в первой и не в последней), возвращает позиции
+def spawn_coins(rooms, rand=rng):
+    positions = []
+    for room in rooms:
+        if room != rooms[0] and room != rooms[-1]:
+            for _ in range(rand.randint(1, 3)):
+                x = rand.randint(room.x1 + 1, room.x2 - 2)
+                y = rand.randint(room.y1 + 1, room.y2 - 2)
+                positions.append((x * TILE_SIZE + TILE_SIZE // 2, y * TILE_SIZE + TILE_SIZE // 2 + 40))
+    return positions
+
+
+# Покупка улучшения в магазине. Возвращает True, если хватило монет.
+def buy_upgrade(choice):
+    # Мультивыстрел (стоимость 5 + 5 * текущий уровень)
+    multishot_cost = 5 + 5 * player_upgrades.multishot_level
+    if choice == "multishot" and player.coins >= multishot_cost:
+        player_upgrades.multishot_level += 1
+        player.multishot_level += 1
+        player.coins -= multishot_cost
+        return True
+
+    # Самонаводящиеся пули (стоимость 30 монет)
+    if choice == "homing" and player.coins >= 30 and not player_upgrades.has_homing:
+        player_upgrades.has_homing = True
+        player.has_homing = True
+        player.coins -= 30
+        return True
+
+    # Улучшение здоровья (стоимость 10 монет)
+    if choice == "health" and player.coins >= 10:
+        player_upgrades.health_level += 1
+        player.add_health()
+        player.coins -= 10
+        return True
+    return False
+
+
+# Клавиши магазина
+SHOP_KEYS = {pygame.K_1: "multishot", pygame.K_2: "homing", pygame.K_3: "health"}
+
+
+# Полоса HUD над картой. Когда камера прокручивает мир, его верхние строки
+# попадают под полосу, поэтому после мира она заливается заново.
+def clear_hud_band():
+    screen.fill(BLACK, (0, 0, SCREEN_WIDTH, 40))
+
+
+# Отрисовка индикатора здоровья (сердечки).
+# Возвращает прямоугольник, который занял HUD.
+def draw_health():
+    drawn = []
+    hearts = player.health // 2
+    half = player.health % 2
+    for i in range(hearts):
+        drawn.append(screen.blit(assets.sprite("heart"), (5 + i * (TILE_SIZE + 2), 5)))
+    if half:
+        drawn.append(screen.blit(assets.sprite("half_heart"), (5 + hearts * (TILE_SIZE + 2), 5)))
+
+    # Отображение монет
+    coins_text = text_cache.render(f"монеты: {player.coins}", 24)
+    drawn.append(screen.blit(coins_text, (SCREEN_WIDTH - 150, 5)))
+    coin_image = assets.get("coin")
+    if coin_image:
+        drawn.append(screen.blit(coin_image, (SCREEN_WIDTH - 180, 5)))
+
+    # Отображение уровня мультивыстрела
+    if player.multishot_level > 0:
+        multishot_text = text_cache.render(f"мульти выстрел: Lvl {player.multishot_level}", 24)
+        drawn.append(screen.blit(multishot_text, (SCREEN_WIDTH // 2 - 70, 5)))
+
+    # Отображение самонаводящихся пуль
+    if player.has_homing:
+        homing_text = text_cache.render("самонаводящийся пули: ON", 24)
+        drawn.append(screen.blit(homing_text, (SCREEN_WIDTH // 2 - 70, 30)))
+    return drawn[0].unionall(drawn[1:])
 
 
-# Режим магазина: выбор улучшений
-def run_shop():
-    shop_open = True
-    font = pygame.font.SysFont(None, 24)
-    while shop_open:
-        for event in pygame.event.get():
+# Сцены игры: игровой процесс, магазин, пауза и конец игры. Главный цикл
+# SceneStack.run раздает события верхней сцене стека и обновляет ее; сцена
+# кладет поверх себя другую (push), убирает себя (pop) или заменяется (replace).
+# Статичные сцены ничего не считают по таймеру: цикл спит в pygame.event.wait
+# и перерисовывает их только после ввода, поэтому меню не грузят процессор.
+class Scene:
+    static = False
+
+    def __init__(self, stack):
+        self.stack = stack
+
+    def handle_event(self, event):
+        # Для статичной сцены: True, если после события ее нужно перерисовать
+        return False
+
+    def update(self):
+        pass
+
+    def draw(self):
+        pass
+
+    def resume(self):
+        # Сцена снова наверху стека (сцену над ней убрали)
+        pass
+
+    def exit(self):
+        # Сцена убрана из стека
+        pass
+
+
+class SceneStack:
+    # События, после которых окно нужно перерисовать (его перекрывали или сворачивали)
+    REPAINT_EVENTS = (pygame.WINDOWEXPOSED, pygame.WINDOWRESTORED, pygame.VIDEOEXPOSE)
+
+    def __init__(self):
+        self.scenes = []
+        self.repaint = True
+
+    @property
+    def top(self):
+        return self.scenes[-1] if self.scenes else None
+
+    def push(self, scene):
+        self.scenes.append(scene)
+        self.repaint = True
+
+    def pop(self):
+        self.scenes.pop().exit()
+        self.repaint = True
+        if self.scenes:
+            self.scenes[-1].resume()
+
+    def replace(self, scene):
+        self.scenes.pop().exit()
+        self.push(scene)
+
+    def clear(self):
+        while self.scenes:
+            self.scenes.pop().exit()
+
+    def run(self):
+        while self.scenes:
+            scene = self.top
+            if scene.static:
+                if self.repaint:
+                    scene.draw()
+                    screen.present()
+                    self.repaint = False
+                # Спим до первого события, остальные забираем из очереди
+                events = [pygame.event.wait()] + pygame.event.get()
+                self.dispatch(events)
+            else:
+                profiler.begin_frame()
+                profiler.start("events")
+                self.dispatch(pygame.event.get())
+                profiler.stop("events")
+                if self.top is scene:
+                    scene.update()
+                if self.top is scene:
+                    scene.draw()
+                profiler.end_frame()
+
+    def dispatch(self, events):
+        # События достаются той сцене, что наверху в момент события
+        for event in events:
             if event.type == pygame.QUIT:
-                pygame.quit();
-                sys.exit()
-            if event.type == pygame.KEYDOWN:
-                # Мультивыстрел (стоимость 5 + 5 * текущий уровень)
-                multishot_cost = 5 + 5 * player_upgrades.multishot_level
-                if event.key == pygame.K_1 and player.coins >= multishot_cost:
-                    player_upgrades.multishot_level += 1
-                    player.multishot_level += 1
-                    player.coins -= multishot_cost
-
-                # Самонаводящиеся пули (стоимость 30 монет)
-                if event.key == pygame.K_2 and player.coins >= 30 and not player_upgrades.has_homing:
-                    player_upgrades.has_homing = True
-                    player.has_homing = True
-                    player.coins -= 30
-
-                # Улучшение здоровья (стоимость 10 монет)
-                if event.key == pygame.K_3 and player.coins >= 10:
-                    player_upgrades.health_level += 1
-                    player.add_health()
-                    player.coins -= 10
-
-                # Выход из магазина
-                if event.key == pygame.K_RETURN:
-                    shop_open = False
-
-        # Отображение магазина
+                self.clear()
+                return
+            if not self.scenes:
+                return
+            if self.top.handle_event(event) or event.type in self.REPAINT_EVENTS:
+                self.repaint = True
+
+
+# Магазин: выбор улучшений. По Enter закрывается и передает список покупок в on_close.
+class ShopScene(Scene):
+    static = True
+
+    def __init__(self, stack, on_close):
+        super().__init__(stack)
+        self.on_close = on_close
+        self.purchases = []
+
+    def handle_event(self, event):
+        if event.type != pygame.KEYDOWN:
+            return False
+        if event.key in SHOP_KEYS and buy_upgrade(SHOP_KEYS[event.key]):
+            self.purchases.append(SHOP_KEYS[event.key])
+            return True
+        # Выход из магазина
+        if event.key == pygame.K_RETURN:
+            self.stack.pop()
+            self.on_close(self.purchases)
+        return False
+
+    def draw(self):
         screen.fill(BLACK)
         texts = [
             f"Shop - Coins: {player.coins}",
@@ -499,231 +2589,1074 @@ def run_shop():
             elif i == 3 and player.coins < 10:
                 color = GRAY
 
-            img = font.render(t, True, color)
+            img = text_cache.render(t, 24, color)
             screen.blit(img, (50, 50 + i * 30))
 
-        pygame.display.flip()
-        clock.tick(FPS)
 
+# Пауза (Esc или P): симуляция стоит, поверх кадра игры (его рисует
+# draw_game, без вывода на экран) - затемнение и надпись
+class PauseScene(Scene):
+    static = True
+    KEYS = (pygame.K_ESCAPE, pygame.K_p)
 
-# Отрисовка индикатора здоровья (сердечки)
-def draw_health():
-    hearts = player.health // 2
-    half = player.health % 2
-    for i in range(hearts):
-        pos = (5 + i * (TILE_SIZE + 2), 5)
-        if heart_img:
-            screen.blit(heart_img, pos)
-        else:
-            pygame.draw.rect(screen, RED, (*pos, TILE_SIZE, TILE_SIZE))
-    if half:
-        pos = (5 + hearts * (TILE_SIZE + 2), 5)
-        if half_heart_img:
-            screen.blit(half_heart_img, pos)
-        else:
-            pygame.draw.rect(screen, DARKRED, (*pos, TILE_SIZE, TILE_SIZE))
+    def __init__(self, stack, draw_game):
+        super().__init__(stack)
+        self.draw_game = draw_game
+        self.shade = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
+        self.shade.fill((0, 0, 0, 150))
 
-    # Отображение монет
-    font = pygame.font.SysFont(None, 24)
-    coins_text = font.render(f"монеты: {player.coins}", True, WHITE)
-    screen.blit(coins_text, (SCREEN_WIDTH - 150, 5))
-    if coin_img:
-        screen.blit(coin_img, (SCREEN_WIDTH - 180, 5))
+    def handle_event(self, event):
+        if event.type == pygame.KEYDOWN and event.key in self.KEYS:
+            self.stack.pop()
+        return False
 
-    # Отображение уровня мультивыстрела
-    if player.multishot_level > 0:
-        multishot_text = font.render(f"мульти выстрел: Lvl {player.multishot_level}", True, WHITE)
-        screen.blit(multishot_text, (SCREEN_WIDTH // 2 - 70, 5))
+    def draw(self):
+        self.draw_game()
+        screen.blit(self.shade, (0, 0))
+        title = text_cache.render("PAUSED", 72)
+        screen.blit(title, (SCREEN_WIDTH // 2 - title.get_width() // 2, SCREEN_HEIGHT // 3))
+        hint = text_cache.render("Esc / P: продолжить", 24, GRAY)
+        screen.blit(hint, (SCREEN_WIDTH // 2 - hint.get_width() // 2, SCREEN_HEIGHT // 3 + 80))
 
-    # Отображение самонаводящихся пуль
-    if player.has_homing:
-        homing_text = font.render("самонаводящийся пули: ON", True, WHITE)
-        screen.blit(homing_text, (SCREEN_WIDTH // 2 - 70, 30))
 
+# Экран "Game Over": кнопка рестарта заменяет его новым забегом из new_run()
+class GameOverScene(Scene):
+    static = True
 
-# Экран "Game Over"
-def show_game_over():
-    game_over = True
-    font_large = pygame.font.SysFont(None, 72)
-    font_medium = pygame.font.SysFont(None, 36)
-
-    # Кнопки
-    restart_button = pygame.Rect(SCREEN_WIDTH // 2 - 150, SCREEN_HEIGHT // 2, 300, 50)
-    quit_button = pygame.Rect(SCREEN_WIDTH // 2 - 150, SCREEN_HEIGHT // 2 + 70, 300, 50)
-
-    while game_over:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if restart_button.collidepoint(event.pos):
-                    # Очищаем все группы спрайтов перед рестартом
-                    all_sprites.empty()
-                    enemies.empty()
-                    bullets.empty()
-                    walls.empty()
-                    coins.empty()
-                    return "restart"
-                elif quit_button.collidepoint(event.pos):
-                    pygame.quit()
-                    sys.exit()
-
-        # Отрисовка
+    def __init__(self, stack, new_run):
+        super().__init__(stack)
+        self.new_run = new_run
+        # Кнопки
+        self.restart_button = pygame.Rect(SCREEN_WIDTH // 2 - 150, SCREEN_HEIGHT // 2, 300, 50)
+        self.quit_button = pygame.Rect(SCREEN_WIDTH // 2 - 150, SCREEN_HEIGHT // 2 + 70, 300, 50)
+
+    def handle_event(self, event):
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if self.restart_button.collidepoint(event.pos):
+                # Очищаем все группы спрайтов перед рестартом
+                clear_sprites()
+                self.stack.replace(self.new_run())
+            elif self.quit_button.collidepoint(event.pos):
+                self.stack.clear()
+        return False
+
+    def draw(self):
         screen.fill(BLACK)
 
         # Заголовок
-        game_over_text = font_large.render("GAME OVER", True, RED)
+        game_over_text = text_cache.render("GAME OVER", 72, RED)
         screen.blit(game_over_text, (SCREEN_WIDTH // 2 - game_over_text.get_width() // 2, SCREEN_HEIGHT // 4))
 
         # Статистика
-        stats_text = font_medium.render(f"Level Reached: {level}", True, WHITE)
+        stats_text = text_cache.render(f"Level Reached: {level}", 36)
         screen.blit(stats_text, (SCREEN_WIDTH // 2 - stats_text.get_width() // 2, SCREEN_HEIGHT // 3))
 
         # Кнопки
-        pygame.draw.rect(screen, LIGHT_BLUE, restart_button)
-        pygame.draw.rect(screen, DARKRED, quit_button)
+        restart_button, quit_button = self.restart_button, self.quit_button
+        screen.fill(LIGHT_BLUE, restart_button)
+        screen.fill(DARKRED, quit_button)
 
-        restart_text = font_medium.render("Restart Game", True, WHITE)
-        quit_text = font_medium.render("Quit", True, WHITE)
+        restart_text = text_cache.render("Restart Game", 36)
+        quit_text = text_cache.render("Quit", 36)
 
         screen.blit(restart_text, (restart_button.centerx - restart_text.get_width() // 2,
                                    restart_button.centery - restart_text.get_height() // 2))
         screen.blit(quit_text, (quit_button.centerx - quit_text.get_width() // 2,
                                 quit_button.centery - quit_text.get_height() // 2))
 
-        pygame.display.flip()
-        clock.tick(FPS)
 
-# Главный цикл игры
-def main():
-    global player, player_upgrades, level
-
-    running = True
-
-    while running:
-        level = 1
-        player_upgrades = PlayerUpgrades()  # Сброс улучшений
-
-        # Основной игровой цикл (уровни)
-        while running:
-            dungeon_map, rooms = generate_dungeon()
-
-            # Создаем фон для отрисовки
-            background = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
-            background.fill(BLACK)
-
-            # Отрисовка фона и стен один раз
-            floor_positions = []
-            for x in range(MAP_WIDTH):
-                for y in range(MAP_HEIGHT):
-                    tile = dungeon_map[x][y]
-                    screen_pos = (x * TILE_SIZE, y * TILE_SIZE + 40)
-                    if tile == 0:
-                        floor_positions.append((x, y))
-                        if floor_img:
-                            background.blit(floor_img, screen_pos)
-                        else:
-                            pygame.draw.rect(background, GRAY, (*screen_pos, TILE_SIZE, TILE_SIZE))
-                    else:
-                        pygame.draw.rect(background, BLACK, (*screen_pos, TILE_SIZE, TILE_SIZE))
-
-            # Создаем стены для коллизий
-            walls.empty()
-            for x in range(MAP_WIDTH):
-                for y in range(MAP_HEIGHT):
-                    if dungeon_map[x][y] == 1:
-                        wall_sprite = pygame.sprite.Sprite()
-                        wall_sprite.image = pygame.Surface((TILE_SIZE, TILE_SIZE))
-                        wall_sprite.image.fill(BLACK)
-                        wall_sprite.rect = wall_sprite.image.get_rect(topleft=(x * TILE_SIZE, y * TILE_SIZE + 40))
-                        walls.add(wall_sprite)
-
-            # Создаем игрока в центре первой комнаты
-            start = rooms[0].center
-            player = Player((start[0] * TILE_SIZE + TILE_SIZE // 2,
-                             start[1] * TILE_SIZE + TILE_SIZE // 2 + 40), player_upgrades)
-
-            # Создаем выход (дверь) в центре последней комнаты
-            last = rooms[-1].center
-            door = pygame.sprite.Sprite()
-            door.image = door_img if door_img else pygame.Surface((TILE_SIZE, TILE_SIZE))
-            if not door_img: door.image.fill(DARKRED)
-            door.rect = door.image.get_rect()
-            door.rect.topleft = (last[0] * TILE_SIZE, last[1] * TILE_SIZE + 40)
-            all_sprites.add(door)
-
-            # Генерируем миникарту
-            minimap = create_minimap(dungeon_map)
-
-            # Спавн врагов в количестве level+2
-            spawn_enemies(level + 2, rooms)
-
-            # Спавн монет в комнатах
-            for room in rooms:
-                if room != rooms[0] and room != rooms[-1]:  # не в первой и не в последней
-                    for _ in range(random.randint(1, 3)):
-                        x = random.randint(room.x1 + 1, room.x2 - 2)
-                        y = random.randint(room.y1 + 1, room.y2 - 2)
-                        pos = (x * TILE_SIZE + TILE_SIZE // 2, y * TILE_SIZE + TILE_SIZE // 2 + 40)
-                        Coin(pos)
-
-            level_complete = False
-            while not level_complete and player.health > 0:
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        running = False;
-                        level_complete = True
-                    if event.type == pygame.KEYDOWN:
-                        # Стрельба по стрелкам
-                        if event.key == pygame.K_UP:
-                            player.shoot(pygame.math.Vector2(0, -1))
-                        if event.key == pygame.K_DOWN:
-                            player.shoot(pygame.math.Vector2(0, 1))
-                        if event.key == pygame.K_LEFT:
-                            player.shoot(pygame.math.Vector2(-1, 0))
-                        if event.key == pygame.K_RIGHT:
-                            player.shoot(pygame.math.Vector2(1, 0))
-
-                # Обновление всех спрайтов
-                all_sprites.update()
-
-                # Отрисовка
-                screen.blit(background, (0, 0))  # Рисуем заранее подготовленный фон
-                all_sprites.draw(screen)  # Рисуем все спрайты поверх фона
-                screen.blit(minimap, (SCREEN_WIDTH - minimap.get_width() - 5, 5))
-                draw_health()
-                pygame.display.flip()
-                clock.tick(FPS)
-
-                # Проверка выхода (столкновения игрока с дверью)
-                if pygame.sprite.collide_rect(player, door):
-                    level_complete = True
-
-            # Если игрок погиб, показываем экран "Game Over"
-            if player.health <= 0:
-                choice = show_game_over()
-                if choice == "restart":
-                    break  # Выходим из цикла уровней, начнем новую игру
-                else:
-                    running = False
+# Очистка групп спрайтов перед следующим уровнем
+def clear_sprites():
+    all_sprites.empty()
+    enemies.empty()
+    ai_scheduler.clear()
+    bullet_pool.clear()
+    particles.clear()
+    coins.empty()
+    coin_hash.clear()
+
+
+# Камера: видимый прямоугольник мира размером с окно. Следует за игроком и
+# не выходит за края мира, поэтому карта размером с окно не сдвигается.
+class Camera:
+    def __init__(self):
+        self.view = pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+
+    @staticmethod
+    def view_at(center):
+        view = pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+        view.center = center
+        view.clamp_ip(pygame.Rect(0, 0, WORLD_WIDTH, WORLD_HEIGHT))
+        return view
+
+    def follow(self, rect):
+        self.view = self.view_at(rect.center)
+
+
+camera = Camera()
+
+
+# Фон уровня по чанкам: карта режется на квадраты CHUNK_TILES x CHUNK_TILES
+# клеток, чанк рисуется при первом попадании в кадр и хранится в LRU-кэше.
+# Кадр собирается только из видимых чанков, так что его цена зависит от
+# размера окна, а не карты. Стены совпадают с черной заливкой, поэтому в
+# чанке рисуются только клетки пола - одним вызовом blits.
+class ChunkedBackground:
+    CHUNK_TILES = 8
+
+    def __init__(self, tile_map, capacity=64):
+        self.tile_map = tile_map
+        self.capacity = capacity
+        self.size = self.CHUNK_TILES * TILE_SIZE
+        self.chunks = OrderedDict()
+        self.floor = assets.sprite("floor")
+        self.floor_mask = tile_map.floor_mask()
+
+    def render_chunk(self, cx, cy):
+        size = self.size
+        left, top = cx * size, cy * size
+        chunk = pygame.Surface((size, size))
+        chunk.fill(BLACK)
+        # Клетки, задевающие чанк (строки карты сдвинуты на 40 пикселей HUD)
+        x1 = left // TILE_SIZE
+        y1 = max((top - 40) // TILE_SIZE, 0)
+        x2 = (left + size - 1) // TILE_SIZE
+        y2 = (top + size - 1 - 40) // TILE_SIZE
+        ys, xs = np.nonzero(self.floor_mask[y1:y2 + 1, x1:x2 + 1])
+        # Картинка пола может быть больше клетки - берем ее угол размером с клетку
+        area = pygame.Rect(0, 0, TILE_SIZE, TILE_SIZE)
+        chunk.blits([(self.floor, ((x + x1) * TILE_SIZE - left, (y + y1) * TILE_SIZE + 40 - top), area)
+                     for x, y in zip(xs.tolist(), ys.tolist())], doreturn=False)
+        return chunk
+
+    def get_chunk(self, cx, cy):
+        key = (cx, cy)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.chunks[key] = self.render_chunk(cx, cy)
+            if len(self.chunks) > self.capacity:
+                self.chunks.popitem(last=False)
+        else:
+            self.chunks.move_to_end(key)
+        return chunk
+
+    def visible(self, world_rect):
+        # Чанки, которые задевает прямоугольник мира: (cx, cy, прямоугольник чанка)
+        size = self.size
+        for cx in range(max(world_rect.left // size, 0), (min(world_rect.right, WORLD_WIDTH) - 1) // size + 1):
+            for cy in range(max(world_rect.top // size, 0), (min(world_rect.bottom, WORLD_HEIGHT) - 1) // size + 1):
+                yield cx, cy, pygame.Rect(cx * size, cy * size, size, size)
+
+    def warm(self, world_rect):
+        # Заранее рисуем чанки области (например, вида камеры у старта уровня)
+        for cx, cy, _ in self.visible(world_rect):
+            self.get_chunk(cx, cy)
+
+    def draw(self, surface, view, area=None):
+        # Фон под прямоугольником экрана area (по умолчанию весь вид камеры view)
+        world_rect = view if area is None else area.move(view.topleft)
+        blits = []
+        for cx, cy, chunk_rect in self.visible(world_rect):
+            part = chunk_rect.clip(world_rect)
+            blits.append((self.get_chunk(cx, cy), part.move(-view.x, -view.y),
+                          part.move(-chunk_rect.x, -chunk_rect.y)))
+        surface.blits(blits, doreturn=False)
+
+
+# Фон уровня; сразу рисуются чанки, видимые с камерой у точки focus
+def render_background(tile_map, focus=(0, 0)):
+    background = ChunkedBackground(tile_map)
+    background.warm(Camera.view_at(focus))
+    return background
+
+
+# Туман войны. Поле зрения игрока считается рекурсивным теневым лучом
+# (shadowcasting) по восьми октантам в радиусе RADIUS клеток и только когда
+# игрок переходит в другую клетку; результаты для клеток кэшируются (LRU),
+# так что возврат в знакомую клетку ничего не считает. Изменения пишутся
+# поклеточно в скрытую мини-карту и в затемнение - поверхность размером с
+# карту, пиксель на клетку: не виденные клетки черные, виденные раньше
+# притушены, видимые сейчас прозрачны. На экран затемнение выводится
+# растянутыми чанками CHUNK_TILES x CHUNK_TILES клеток; чанк растягивается
+# заново, только если в нем поменялась клетка; прозрачный не рисуется, а
+# целиком черный выводится общей непрозрачной поверхностью.
+class FogOfWar:
+    RADIUS = 8
+    CHUNK_TILES = 8
+    HIDDEN = 255  # прозрачность затемнения по состояниям клеток
+    REMEMBERED = 150
+    VISIBLE = 0
+    # Множители координат для восьми октантов (xx, xy, yx, yy)
+    OCTANTS = ((1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+               (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1))
+
+    def __init__(self, tile_map, minimap, capacity=256):
+        self.tile_map = tile_map
+        self.tiles = tile_map.tiles
+        self.width = tile_map.width
+        self.height = tile_map.height
+        self.minimap = minimap
+        self.minimap_scale = minimap_scale(tile_map)
+        self.capacity = capacity
+        self.fov_cache = OrderedDict()  # клетка -> frozenset номеров видимых клеток
+        self.seen = bytearray(self.width * self.height)
+        self.visible = frozenset()
+        self.tile = None
+        self.darkness = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+        self.darkness.fill((0, 0, 0, self.HIDDEN))
+        self.chunks = {}  # (cx, cy) -> растянутый чанк затемнения (None - прозрачный)
+        self.black = pygame.Surface((self.CHUNK_TILES * TILE_SIZE, self.CHUNK_TILES * TILE_SIZE))
+
+    def field_of_view(self, tile):
+        # Номера (y * width + x) клеток, видимых из tile, включая стены на границе
+        visible = self.fov_cache.get(tile)
+        if visible is None:
+            found = {tile[1] * self.width + tile[0]}
+            for octant in self.OCTANTS:
+                self._cast(tile[0], tile[1], 1, 1.0, 0.0, octant, found)
+            visible = self.fov_cache[tile] = frozenset(found)
+            if len(self.fov_cache) > self.capacity:
+                self.fov_cache.popitem(last=False)
+        else:
+            self.fov_cache.move_to_end(tile)
+        return visible
+
+    def _cast(self, cx, cy, row, start, end, octant, found):
+        # Один октант: строки от row до RADIUS, видимый сектор - наклоны от start до end
+        if start < end:
+            return
+        xx, xy, yx, yy = octant
+        width, height, tiles = self.width, self.height, self.tiles
+        radius = self.RADIUS
+        new_start = start
+        for j in range(row, radius + 1):
+            dx, dy = -j - 1, -j
+            blocked = False
+            while dx <= 0:
+                dx += 1
+                left_slope = (dx - 0.5) / (dy + 0.5)
+                right_slope = (dx + 0.5) / (dy - 0.5)
+                if start < right_slope:
+                    continue
+                if end > left_slope:
                     break
+                x = cx + dx * xx + dy * xy
+                y = cy + dx * yx + dy * yy
+                inside = 0 <= x < width and 0 <= y < height
+                if inside and dx * dx + dy * dy <= radius * radius:
+                    found.add(y * width + x)
+                opaque = not inside or tiles[y * width + x] == TileMap.WALL
+                if blocked:
+                    if opaque:
+                        new_start = right_slope
+                    else:
+                        blocked = False
+                        start = new_start
+                elif opaque and j < radius:
+                    # Стена: за ней тень, видимую часть сектора продолжаем со следующей строки
+                    blocked = True
+                    self._cast(cx, cy, j + 1, start, left_slope, octant, found)
+                    new_start = right_slope
+            if blocked:
+                break
+
+    def update(self, tile):
+        # Пересчет при смене клетки игрока; True, если затемнение изменилось
+        if tile is None or tile == self.tile:
+            return False
+        self.tile = tile
+        visible = self.field_of_view(tile)
+        shown = visible - self.visible
+        hidden = self.visible - visible
+        self.visible = visible
+        revealed = [i for i in shown if not self.seen[i]]
+        for i in revealed:
+            self.seen[i] = 1
+        self.write_darkness(shown, self.VISIBLE)
+        self.write_darkness(hidden, self.REMEMBERED)
+        self.write_minimap(revealed)
+        return True
+
+    def reveal(self, seen):
+        # Открыть клетки, виденные раньше (seen - байт на клетку, как self.seen)
+        cells = np.flatnonzero(np.frombuffer(seen, np.uint8)).tolist()
+        for i in cells:
+            self.seen[i] = 1
+        self.write_darkness(cells, self.REMEMBERED)
+        self.write_minimap(cells)
+
+    def write_darkness(self, cells, alpha):
+        if not cells:
+            return
+        ys, xs = np.divmod(np.fromiter(cells, np.int64, len(cells)), self.width)
+        pixels = pygame.surfarray.pixels_alpha(self.darkness)
+        pixels[xs, ys] = alpha
+        del pixels  # снимаем блокировку поверхности
+        size = self.CHUNK_TILES
+        for key in set(zip((xs // size).tolist(), (ys // size).tolist())):
+            self.chunks.pop(key, None)
+
+    def write_minimap(self, cells):
+        if not cells:
+            return
+        ys, xs = np.divmod(np.array(cells, np.int64), self.width)
+        colors = np.array([WHITE, BLACK], np.uint8)[self.tile_map.grid[ys, xs]]
+        scale = self.minimap_scale
+        pixels = pygame.surfarray.pixels3d(self.minimap)
+        for ox in range(scale):
+            for oy in range(scale):
+                pixels[xs * scale + ox, ys * scale + oy] = colors
+        del pixels
+        screen.invalidate(self.minimap)
+
+    def get_chunk(self, cx, cy):
+        key = (cx, cy)
+        if key not in self.chunks:
+            size = self.CHUNK_TILES
+            tiles = pygame.Rect(cx * size, cy * size, size, size).clip(self.darkness.get_rect())
+            part = self.darkness.subsurface(tiles)
+            alpha = pygame.surfarray.pixels_alpha(part)
+            if not alpha.any():
+                self.chunks[key] = None
+            elif (alpha == self.HIDDEN).all():
+                self.chunks[key] = self.black.subsurface((0, 0, tiles.w * TILE_SIZE, tiles.h * TILE_SIZE))
             else:
-                # После каждого второго уровня – магазин
-                if level % 2 == 0:
-                    run_shop()
-                level += 1
+                self.chunks[key] = pygame.transform.scale(part, (tiles.w * TILE_SIZE, tiles.h * TILE_SIZE))
+            del alpha
+        return self.chunks[key]
+
+    def draw(self, surface, view, area=None):
+        # Затемнение под прямоугольником экрана area (по умолчанию весь вид камеры view)
+        world_rect = view if area is None else area.move(view.topleft)
+        size = self.CHUNK_TILES * TILE_SIZE
+        x1 = max(world_rect.left // size, 0)
+        x2 = min((world_rect.right - 1) // size, (self.width - 1) // self.CHUNK_TILES)
+        y1 = max((world_rect.top - 40) // size, 0)
+        y2 = min((world_rect.bottom - 1 - 40) // size, (self.height - 1) // self.CHUNK_TILES)
+        blits = []
+        for cx in range(x1, x2 + 1):
+            for cy in range(y1, y2 + 1):
+                chunk = self.get_chunk(cx, cy)
+                if chunk is None:
+                    continue
+                chunk_rect = chunk.get_rect(topleft=(cx * size, cy * size + 40))
+                part = chunk_rect.clip(world_rect)
+                blits.append((chunk, part.move(-view.x, -view.y), part.move(-chunk_rect.x, -chunk_rect.y)))
+        surface.blits(blits, doreturn=False)
+
+
+# Заготовка уровня: карта, сетка стен, поле направлений, фон, миникарта и
+# места появления врагов и монет. Спрайтов не создает, а случайные числа берет
+# из своего генератора с зерном уровня, поэтому может строиться в фоновом потоке.
+class LevelPlan:
+    def __init__(self, number, seed, render=True):
+        rand = random.Random(seed)
+        self.number = number
+        self.tile_map, self.rooms = generate_dungeon(rand)
+        self.prepare(tile_center(self.rooms[0].center), render)
+        # Враги в количестве номер уровня + 2 и монеты
+        self.enemies = spawn_enemies(number + 2, self.rooms, rand)
+        self.coins = spawn_coins(self.rooms, rand)
+
+    @classmethod
+    def from_tile_map(cls, number, tile_map, focus, render=True):
+        # Заготовка уже идущего уровня (из сохранения): без комнат и спавнов
+        plan = cls.__new__(cls)
+        plan.number = number
+        plan.tile_map = tile_map
+        plan.rooms = None
+        plan.prepare(focus, render)
+        plan.enemies = []
+        plan.coins = []
+        return plan
+
+    def prepare(self, focus, render):
+        # Сетка стен для коллизий
+        self.wall_grid = WallGrid(self.tile_map)
+        # На карте больше окна путь к игроку ищется только в пределах экрана:
+        # дальние враги вне экрана идут к нему напрямую
+        radius = None
+        if WORLD_WIDTH > SCREEN_WIDTH or WORLD_HEIGHT > SCREEN_HEIGHT:
+            radius = max(SCREEN_WIDTH, SCREEN_HEIGHT) // TILE_SIZE
+        self.flow_field = FlowField(self.tile_map, radius)
+        # Фон и миникарта (в безголовом режиме не нужны)
+        self.background = self.minimap = None
+        if render:
+            self.background = render_background(self.tile_map, focus)
+            self.minimap = create_minimap(self.tile_map, hidden=fog_mode)
+
+
+# Подготовка следующего уровня в фоновом потоке, пока идет текущий:
+# переход через дверь только создает спрайты из готовой заготовки.
+class LevelPreloader:
+    def __init__(self, threaded=True):
+        self.executor = ThreadPoolExecutor(max_workers=1) if threaded else None
+        self.pending = None
+        self.seed = 0  # зерно заказанного уровня (для снимков мира)
+
+    def request(self, number, seed=None):
+        # Зерно уровня берется из rng в главном потоке, так что уровни зависят
+        # только от зерна забега, а не от того, когда поток закончил работу.
+        # Явное зерно - при загрузке сохранения, где оно уже было взято из rng.
+        if seed is None:
+            seed = rng.getrandbits(64)
+        self.seed = seed
+        if self.executor:
+            self.pending = self.executor.submit(LevelPlan, number, seed, not headless)
+        else:
+            self.pending = LevelPlan(number, seed, not headless)
+
+    def take(self):
+        # Готовая заготовка (если поток еще не успел - ждем его)
+        plan, self.pending = self.pending, None
+        return plan.result() if self.executor else plan
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Дверь (выход с уровня) с левым верхним углом в topleft
+def new_door(topleft):
+    door = pygame.sprite.Sprite(all_sprites)
+    door.image = assets.sprite("door")
+    door.rect = door.image.get_rect(topleft=topleft)
+    return door
+
+
+# Создание уровня по заготовке (без нее уровень строится сразу): игрок, дверь,
+# враги и монеты. Возвращает дверь, фон и миникарту (в безголовом режиме None).
+def build_level(controller, plan=None):
+    global player, ally, wall_grid, flow_field, enemy_horde, fog
+
+    if plan is None:
+        plan = LevelPlan(level, rng.getrandbits(64), not headless)
+    rooms = plan.rooms
+    wall_grid = plan.wall_grid
+    flow_field = plan.flow_field
+    enemy_horde = EnemyHorde() if horde_mode else None
+    # Туман войны только рисуется, в безголовом режиме он не нужен
+    fog = FogOfWar(plan.tile_map, plan.minimap) if fog_mode and plan.minimap is not None else None
+
+    # Создаем игрока в центре первой комнаты
+    start = rooms[0].center
+    player = Player((start[0] * TILE_SIZE + TILE_SIZE // 2,
+                     start[1] * TILE_SIZE + TILE_SIZE // 2 + 40), player_upgrades)
+    # Второй игрок - на клетку правее (комната не уже четырех клеток)
+    ally = None
+    if ally_controller is not None:
+        ally = Player(player.rect.move(TILE_SIZE, 0).center, player_upgrades)
+
+    # Создаем выход (дверь) в центре последней комнаты
+    last = rooms[-1].center
+    door = new_door((last[0] * TILE_SIZE, last[1] * TILE_SIZE + 40))
+
+    for pos, is_boss in plan.enemies:
+        new_enemy(pos, is_boss)
+    for pos in plan.coins:
+        Coin(pos)
+
+    controller.start_level(plan.tile_map, last)
+    if ally_controller is not None:
+        ally_controller.start_level(plan.tile_map, last)
+    return door, plan.background, plan.minimap
+
+
+# Ввод тика: маска от контроллера и выстрел
+def apply_input(controller):
+    player.input = controller.get_input()
+    shot = decode_shot(player.input)
+    if shot:
+        player.shoot(pygame.math.Vector2(shot))
+    if ally is not None and ally.alive():
+        ally.input = ally_controller.get_input()
+        shot = decode_shot(ally.input)
+        if shot:
+            ally.shoot(pygame.math.Vector2(shot))
+
+
+# ИИ и движение всех спрайтов
+def update_world():
+    profiler.start("ai")
+    flow_field.update(tile_at(player.rect.center))
+    retarget_homing()
+    profiler.stop("ai")
+    profiler.start("update:Player")
+    for target in players():
+        target.update()
+    profiler.stop("update:Player")
+    if enemy_horde is not None:
+        profiler.start("update:horde")
+        enemy_horde.update()
+        profiler.stop("update:horde")
+    else:
+        profiler.start("update:Enemy")
+        ai_scheduler.update()
+        profiler.stop("update:Enemy")
+    # Пули после остальных спрайтов - самонаведение видит новые позиции врагов
+    profiler.start("update:bullets")
+    bullet_pool.update()
+    profiler.stop("update:bullets")
+    profiler.start("update:particles")
+    particles.update()
+    profiler.stop("update:particles")
+
+
+# Один тик симуляции: ввод, выстрел, ИИ, движение и столкновения
+def step_frame(controller):
+    profiler.start("input")
+    apply_input(controller)
+    profiler.stop("input")
+    update_world()
+    profiler.start("collision")
+    resolve_collisions()
+    profiler.stop("collision")
+    game_clock.advance()
+
+
+# Спрайты в поле зрения камеры (в порядке группы) одним вызовом blits
+def draw_sprites(surface, view):
+    surface.blits([(sprite.image, sprite.rect.move(-view.x, -view.y))
+                   for sprite in all_sprites if view.colliderect(sprite.rect)], doreturn=False)
+
+
+# Отрисовка кадра: фон, спрайты, миникарта и HUD.
+# Возвращает прямоугольник HUD.
+def draw_frame(background, minimap):
+    profiler.start("draw")
+    camera.follow(player.rect)
+    background.draw(screen, camera.view)  # видимые чанки заранее подготовленного фона
+    draw_sprites(screen, camera.view)  # спрайты поверх фона
+    bullet_pool.draw(screen, camera.view)
+    particles.draw(screen, camera.view)
+    if fog is not None:
+        profiler.start("fog")
+        fog.update(tile_at(player.rect.center))
+        profiler.stop("fog")
+        fog.draw(screen, camera.view)
+    clear_hud_band()
+    screen.blit(minimap, (SCREEN_WIDTH - minimap.get_width() - 5, 5))
+    profiler.stop("draw")
+    profiler.start("hud")
+    hud_rect = draw_health()
+    profiler.stop("hud")
+    return hud_rect
+
+
+# Полный кадр с оверлеем профилировщика и выводом на экран
+def present_frame(background, minimap):
+    hud_rect = draw_frame(background, minimap)
+    profiler.start("profiler")
+    profiler.draw(screen)
+    profiler.stop("profiler")
+    profiler.start("flip")
+    screen.present()
+    profiler.stop("flip")
+    return hud_rect
+
+
+# Отрисовка «грязными» прямоугольниками (включается флагом --dirty).
+# Фон восстанавливается только под старыми и новыми позициями изменившихся
+# спрайтов, HUD и миникарта перерисовываются только при смене значений или
+# если их задел спрайт, а на экран через screen.present уходят лишь эти области.
+class DirtyRenderer:
+    def __init__(self):
+        # Полоса HUD; расширяется, если надписи HUD заходят на карту
+        self.hud_rect = pygame.Rect(0, 0, SCREEN_WIDTH, 40)
+        self.drawn = {}  # спрайт -> прямоугольник, где он нарисован
+        self.bullet_rects = []  # где нарисованы пули
+        self.particle_rects = []  # клетки экрана с частицами
+        self.hud_state = None
+        self.view = None  # вид камеры на прошлом кадре
+        self.full_redraw = True
+
+    def reset(self):
+        # Следующий кадр рисуется целиком (новый уровень или экран после магазина)
+        self.drawn = {}
+        self.bullet_rects = []
+        self.particle_rects = []
+        self.hud_state = None
+        self.full_redraw = True
+
+    @staticmethod
+    def bullet_screen_rects(view):
+        return [rect.move(-view.x, -view.y) for rect in bullet_pool.rects() if view.colliderect(rect)]
+
+    def draw(self, background, minimap):
+        hud_state = (player.health, player.coins, player.multishot_level, player.has_homing)
+        minimap_rect = minimap.get_rect(topright=(SCREEN_WIDTH - 5, 5))
+        camera.follow(player.rect)
+        view = camera.view
+
+        # Оверлей профилировщика рисуется поверх всего, а сдвиг камеры и туман
+        # войны меняют весь экран - в этих случаях кадр рисуется целиком
+        fog_changed = fog is not None and fog.update(tile_at(player.rect.center))
+        if self.full_redraw or profiler.overlay or view != self.view or fog_changed:
+            self.hud_rect.union_ip(present_frame(background, minimap))
+            self.drawn = {sprite: sprite.rect.move(-view.x, -view.y)
+                          for sprite in all_sprites if view.colliderect(sprite.rect)}
+            self.bullet_rects = self.bullet_screen_rects(view)
+            self.particle_rects = particles.screen_rects(view)
+            self.view = view
+            self.hud_state = hud_state
+            self.full_redraw = profiler.overlay  # после выключения оверлея - еще один полный кадр
+            return
+
+        profiler.start("draw")
+        # Старые и новые позиции изменившихся спрайтов (в координатах экрана)
+        dirty = []
+        changed = set()
+        drawn = {}
+        for sprite in all_sprites:
+            if not view.colliderect(sprite.rect):
+                continue
+            old = self.drawn.pop(sprite, None)
+            rect = sprite.rect.move(-view.x, -view.y)
+            drawn[sprite] = rect
+            if old == rect:
+                continue
+            changed.add(sprite)
+            if old is None:
+                dirty.append(rect)
+            elif old.colliderect(rect):
+                dirty.append(old.union(rect))
+            else:
+                dirty.extend((old, rect))
+        # Спрайты, исчезнувшие с прошлого кадра или ушедшие из вида
+        dirty.extend(self.drawn.values())
+        self.drawn = drawn
+        # Пули движутся каждый кадр: стираем старые и рисуем все новые
+        bullet_rects = self.bullet_screen_rects(view)
+        dirty.extend(self.bullet_rects)
+        dirty.extend(bullet_rects)
+        self.bullet_rects = bullet_rects
+        # Частицы - так же, но клетками экрана
+        particle_rects = particles.screen_rects(view)
+        dirty.extend(self.particle_rects)
+        dirty.extend(particle_rects)
+        self.particle_rects = particle_rects
+
+        # Неподвижные спрайты, которые задевают области, тоже перерисовываются
+        # целиком, поэтому их прямоугольники добавляются к областям (до замыкания);
+        # задетые HUD и миникарта рисуются заново. Затемнение тумана полупрозрачно
+        # и накладывается поверх каждой области, поэтому с ним области сливаются
+        # в неперекрывающиеся.
+        hud_dirty = hud_state != self.hud_state
+        hud_added = False
+        grown = True
+        while grown:
+            grown = False
+            if fog is not None:
+                dirty = disjoint_rects(dirty)
+            if not hud_added and (hud_dirty or self.hud_rect.collidelist(dirty) != -1
+                                  or minimap_rect.collidelist(dirty) != -1):
+                hud_dirty = hud_added = grown = True
+                dirty.extend((self.hud_rect, minimap_rect))
+            for sprite, rect in drawn.items():
+                if sprite not in changed and rect.collidelist(dirty) != -1:
+                    changed.add(sprite)
+                    dirty.append(rect)
+                    grown = True
+
+        # Стираем области фоном и рисуем заново задетые спрайты в прежнем порядке
+        for rect in dirty:
+            background.draw(screen, view, rect)
+        for sprite, rect in drawn.items():
+            if sprite in changed:
+                screen.blit(sprite.image, rect)
+        bullet_pool.draw(screen, view)
+        particles.draw(screen, view)
+        if fog is not None:
+            for rect in dirty:
+                fog.draw(screen, view, rect)
+        if hud_dirty:
+            clear_hud_band()
+            screen.blit(minimap, minimap_rect)
+        profiler.stop("draw")
+
+        if hud_dirty:
+            profiler.start("hud")
+            hud_rect = draw_health()
+            profiler.stop("hud")
+            self.hud_state = hud_state
+            if not self.hud_rect.contains(hud_rect):
+                # HUD вырос (новое улучшение) - на следующем кадре рисуем целиком
+                self.hud_rect.union_ip(hud_rect)
+                self.full_redraw = True
+
+        profiler.start("flip")
+        screen.present(dirty)
+        profiler.stop("flip")
+
+
+# Сливает пересекающиеся прямоугольники, пока все не станут попарно непересекающимися
+def disjoint_rects(rects):
+    merged = []
+    for rect in rects:
+        rect = rect.copy()
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect.union_ip(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+
+# Начало нового забега: сброс улучшений, часов и засев генератора
+def start_run(seed):
+    global player_upgrades, level
+    level = 1
+    player_upgrades = PlayerUpgrades()  # Сброс улучшений
+    game_clock.frame = 0
+    ai_scheduler.next_seq = 0  # сдвиги фаз врагов не зависят от прошлых забегов
+    rng.seed(seed)
+
+
+# Сохранение записи забега вместе с контрольной суммой конечного состояния
+def finish_recording(recording, path):
+    recording.checksum = state_checksum()
+    recording.save(path)
+    print(f"Recording saved to {path} ({len(recording.inputs)} ticks)")
+
+
+# Забег с клавиатуры: уровни с фиксированным шагом симуляции, магазин после
+# каждого второго уровня, пауза и экран конца игры - сценами поверх этой.
+# Backspace (удерживать) перематывает уровень назад, F5 - быстрое сохранение
+# в save_path, F9 - загрузка из него; resume - снимок, с которого начать забег.
+class GameplayScene(Scene):
+    REWIND_KEY = pygame.K_BACKSPACE
+    SAVE_KEY = pygame.K_F5
+    LOAD_KEY = pygame.K_F9
+
+    def __init__(self, stack, preloader, record_path=None, renderer=None, save_path=None, resume=None):
+        super().__init__(stack)
+        self.preloader = preloader
+        self.record_path = record_path
+        self.renderer = renderer
+        self.save_path = save_path
+        self.saving = None  # фоновая запись сохранения
+        self.rewind = RewindBuffer()
+        self.rewinding = False
+        seed = random.randrange(2 ** 32)
+        start_run(seed)
+        self.controller = KeyboardController()
+        self.recording = None
+        if record_path:
+            self.recording = InputRecording(seed)
+            self.controller = RecordingController(self.controller, self.recording)
+        if resume is None:
+            preloader.request(level)
+            self.start_level()
+        else:
+            self.load(resume)
+
+    def start_level(self):
+        # Уровень уже готов; следующий строится в фоне, пока идет этот
+        plan = self.preloader.take()
+        self.preloader.request(level + 1)
+        self.door, self.background, self.minimap = build_level(self.controller, plan)
+        self.rewind.clear()
+        self.resume()
+
+    def load(self, data):
+        # Мир из снимка с картой; записывать ввод дальше нельзя - запись
+        # воспроизводится только с начала забега
+        self.finish_recording()
+        self.door, plan = WorldSnapshot.restore(data, self.controller, self.preloader)
+        self.background, self.minimap = plan.background, plan.minimap
+        self.rewind.clear()
+        self.resume()
+
+    def quick_save(self):
+        if self.saving is not None:
+            self.saving.result()
+        data = WorldSnapshot.capture(self.door, self.preloader.seed, with_map=True)
+        self.saving = save_writer.submit(WorldSnapshot.save, self.save_path, data)
+
+    def quick_load(self):
+        if self.saving is not None:
+            self.saving.result()
+            self.saving = None
+        try:
+            data = WorldSnapshot.load(self.save_path)
+        except (OSError, ValueError, zlib.error) as error:
+            print(f"Quick load failed: {error}")
+            return
+        self.load(data)
 
-            # Очищаем группы для следующего уровня
-            all_sprites.empty()
-            enemies.empty()
-            bullets.empty()
-            walls.empty()
-            coins.empty()
+    def step_back(self):
+        # Шаг перемотки: мир из последнего снимка буфера, ввод после него
+        # вычеркивается из записи, чтобы она по-прежнему воспроизводилась
+        data = self.rewind.pop()
+        if data is None:
+            return
+        self.door, _ = WorldSnapshot.restore(data)
+        if self.recording:
+            del self.recording.inputs[game_clock.frame:]
+        if self.renderer:
+            self.renderer.reset()
+
+    def resume(self):
+        # Время постройки уровня, паузы или магазина не копится в шагах
+        clock.tick()
+        self.accumulator = 0.0
+        self.rewinding = False  # Backspace могли отпустить, пока сцена была не сверху
+        if self.renderer:
+            self.renderer.reset()
+
+    def handle_event(self, event):
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+            profiler.toggle_overlay()
+        elif event.type == pygame.KEYDOWN and event.key in PauseScene.KEYS:
+            self.stack.push(PauseScene(self.stack, lambda: draw_frame(self.background, self.minimap)))
+        elif event.type in (pygame.KEYDOWN, pygame.KEYUP) and event.key == self.REWIND_KEY:
+            self.rewinding = event.type == pygame.KEYDOWN
+        elif event.type == pygame.KEYDOWN and event.key == self.SAVE_KEY and self.save_path:
+            self.quick_save()
+        elif event.type == pygame.KEYDOWN and event.key == self.LOAD_KEY and self.save_path:
+            self.quick_load()
+        else:
+            self.controller.handle_event(event)
+        return False
+
+    def update(self):
+        # Фиксированный шаг: симуляция идет тиками по STEP_MS
+        # независимо от частоты отрисовки
+        self.accumulator += clock.tick(FPS)
+        if self.rewinding:
+            # Перемотка: по снимку за кадр (в INTERVAL раз быстрее игры)
+            self.accumulator = 0.0
+            profiler.start("rewind")
+            self.step_back()
+            profiler.stop("rewind")
+            return
+        level_complete = False
+        steps = 0
+        while self.accumulator >= STEP_MS and steps < MAX_STEPS_PER_FRAME:
+            step_frame(self.controller)
+            self.accumulator -= STEP_MS
+            steps += 1
+            if game_clock.frame % RewindBuffer.INTERVAL == 0:
+                profiler.start("snapshot")
+                self.rewind.push(WorldSnapshot.capture(self.door, self.preloader.seed))
+                profiler.stop("snapshot")
+
+            # Проверка выхода (столкновения игрока с дверью)
+            level_complete = pygame.sprite.collide_rect(player, self.door)
+            if level_complete or player.health <= 0:
+                break
+        if steps == MAX_STEPS_PER_FRAME:
+            self.accumulator = 0.0
+
+        if player.health <= 0:
+            # Забег окончен - сохраняем запись и показываем экран "Game Over"
+            self.finish_recording()
+            self.stack.replace(GameOverScene(self.stack, self.new_run))
+        elif level_complete:
+            # После каждого второго уровня – магазин
+            if level % 2 == 0:
+                self.stack.push(ShopScene(self.stack, self.shop_closed))
+            else:
+                self.next_level()
+
+    def draw(self):
+        if self.renderer:
+            self.renderer.draw(self.background, self.minimap)
+        else:
+            present_frame(self.background, self.minimap)
 
+    def shop_closed(self, purchases):
+        if self.recording:
+            self.recording.shops.append(purchases)
+        self.next_level()
+
+    def next_level(self):
+        global level
+        level += 1
+        # Очищаем группы для следующего уровня
+        clear_sprites()
+        self.start_level()
+
+    def new_run(self):
+        return GameplayScene(self.stack, self.preloader, self.record_path, self.renderer, self.save_path)
+
+    def finish_recording(self):
+        # Запись закрыта - дальше ввод идет прямо от обернутого контроллера
+        if self.recording:
+            finish_recording(self.recording, self.record_path)
+            self.recording = None
+            self.controller = self.controller.controller
+
+    def exit(self):
+        # Выход из игры посреди забега тоже сохраняет запись
+        self.finish_recording()
+        if self.saving is not None:
+            self.saving.result()
+
+
+# Главный цикл игры
+def main(record_path=None, profile=False, profile_log=None, dirty=False, backend="surface",
+         save_path=None, resume=False):
+    # Сохранение читается до создания окна: битый файл - ошибка сразу
+    resume_data = WorldSnapshot.load(save_path) if resume else None
+    init_display(backend=backend)
+    # Грязные прямоугольники имеют смысл, только если бэкенд сохраняет кадр между выводами
+    renderer = DirtyRenderer() if dirty and screen.partial_updates else None
+    if profile:
+        profiler.toggle_overlay()
+    if profile_log:
+        profiler.open_log(profile_log)
+    preloader = LevelPreloader()
+    stack = SceneStack()
+
+    try:
+        stack.push(GameplayScene(stack, preloader, record_path, renderer, save_path, resume_data))
+        stack.run()
+    except Exception:
+        # При падении сохраняем запись, чтобы воспроизвести ошибку
+        for scene in stack.scenes:
+            if isinstance(scene, GameplayScene) and scene.recording:
+                scene.recording.save(record_path)
+                print(f"Recording saved to {record_path} ({len(scene.recording.inputs)} ticks)")
+        raise
+    finally:
+        profiler.close()
+        preloader.close()
 
     pygame.quit()
 
 
+# Безголовая симуляция: без окна, отрисовки и ограничения FPS.
+# Игроком управляет контроллер (например, BotController), магазин
+# обслуживает controller.shop(). Перед вызовом нужен init_display(True).
+# Если передан список frame_times, в него пишется время каждого шага (в секундах).
+# Возвращает статистику забега.
+def simulate(controller, seed=None, max_frames=100000, frame_times=None):
+    global level
+
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    start_run(seed)
+    stats = {"seed": seed, "level": 1, "frames": 0, "coins_earned": 0,
+             "died": False, "purchases": [], "checksum": 0}
+    # Уровни заказываются в том же порядке, что в main, но строятся сразу
+    preloader = LevelPreloader(threaded=False)
+    preloader.request(level)
+
+    while True:
+        plan = preloader.take()
+        preloader.request(level + 1)
+        door, _, _ = build_level(controller, plan)
+        level_complete = False
+        while player.health > 0 and stats["frames"] < max_frames:
+            if frame_times is None:
+                step_frame(controller)
+            else:
+                started = time.perf_counter()
+                step_frame(controller)
+                frame_times.append(time.perf_counter() - started)
+            stats["frames"] += 1
+            if pygame.sprite.collide_rect(player, door):
+                level_complete = True
+                break
+
+        stats["coins_earned"] += player.coins
+        if player.health <= 0 or stats["frames"] >= max_frames:
+            stats["died"] = player.health <= 0
+            stats["checksum"] = state_checksum()
+            break
+        if level_complete:
+            if level % 2 == 0:
+                stats["purchases"].extend(controller.shop())
+            level += 1
+        clear_sprites()
+
+    clear_sprites()
+    stats["level"] = level
+    return stats
+
+
+# Воспроизведение записи без окна и ограничения FPS.
+# Возвращает статистику и признак совпадения контрольной суммы.
+def replay(path):
+    recording = InputRecording.load(path)
+    stats = simulate(ReplayController(recording), recording.seed, len(recording.inputs))
+    return stats, stats["checksum"] == recording.checksum
+
+
+# Размер карты из командной строки: "ШИРИНАxВЫСОТА" в клетках
+def map_size(text):
+    try:
+        width, height = (int(part) for part in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WxH, got {text!r}")
+    if width < 12 or height < 12:
+        raise argparse.ArgumentTypeError("map must be at least 12x12 tiles")
+    return width, height
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Roguelike Game")
+    parser.add_argument("--headless", action="store_true",
+                        help="симуляция без окна и ограничения FPS, игроком управляет бот")
+    parser.add_argument("--frames", type=int, default=100000, help="лимит кадров безголовой симуляции")
+    parser.add_argument("--seed", type=int, help="зерно генератора случайных чисел")
+    parser.add_argument("--record", help="записать ввод забега в файл")
+    parser.add_argument("--replay", help="воспроизвести запись без окна на максимальной скорости")
+    parser.add_argument("--profile", action="store_true", help="включить оверлей профилировщика (F3)")
+    parser.add_argument("--profile-log", help="писать время подсистем по кадрам в .csv или .jsonl")
+    parser.add_argument("--dirty", action="store_true",
+                        help="перерисовывать только изменившиеся области экрана")
+    parser.add_argument("--map", type=map_size, metavar="WxH",
+                        help="размер карты в клетках (больше окна - с прокруткой), например 200x150")
+    parser.add_argument("--horde", action="store_true",
+                        help="пакетное обновление врагов на NumPy (для уровней с тысячами врагов)")
+    parser.add_argument("--fog", action="store_true",
+                        help="туман войны: карта открывается по мере того, как ее видит игрок")
+    parser.add_argument("--render", choices=sorted(BACKENDS), default="surface",
+                        help="бэкенд вывода: surface (блиттер pygame), sdl2 (текстуры SDL2) или null (без окна)")
+    parser.add_argument("--save", default="quicksave.sav",
+                        help="файл быстрого сохранения (F5 - сохранить, F9 - загрузить)")
+    parser.add_argument("--resume", action="store_true", help="продолжить игру из файла --save")
+    parser.add_argument("--atlas", help="брать картинки из атласа (PNG + JSON рядом)")
+    parser.add_argument("--build-atlas", metavar="PATH", help="собрать атлас всех картинок и выйти")
+    args = parser.parse_args()
+    if args.resume and args.record:
+        parser.error("--record needs a run from the start, it cannot be combined with --resume")
+    if args.build_atlas:
+        index = build_atlas(args.build_atlas)
+        print(f"Atlas {args.build_atlas}: {len(index)} images")
+        sys.exit(0)
+    if args.atlas:
+        assets.use_atlas(args.atlas)
+    horde_mode = args.horde
+    fog_mode = args.fog
+    if args.map:
+        configure_map(*args.map)
+
+    if args.replay:
+        init_display(headless_mode=True)
+        started = time.perf_counter()
+        result, matches = replay(args.replay)
+        elapsed = time.perf_counter() - started
+        print(result)
+        print(f"{result['frames']} ticks replayed in {elapsed:.2f}s, checksum {'OK' if matches else 'MISMATCH'}")
+        sys.exit(0 if matches else 1)
+    elif args.headless:
+        init_display(headless_mode=True)
+        seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+        controller = BotController()
+        recording = None
+        if args.record:
+            recording = InputRecording(seed)
+            controller = RecordingController(controller, recording)
+        started = time.perf_counter()
+        result = simulate(controller, seed, args.frames)
+        elapsed = time.perf_counter() - started
+        if recording:
+            recording.checksum = result["checksum"]
+            recording.save(args.record)
+        print(result)
+        print(f"{result['frames']} frames in {elapsed:.2f}s ({result['frames'] / max(elapsed, 1e-9):.0f} FPS)")
+    else:
+        main(args.record, args.profile, args.profile_log, args.dirty, args.render, args.save, args.resume)
@@ -0,0 +1,16 @@
+import os
+import sys
+
+# Тесты без окна: pygame на пустом видеодрайвере, игра импортируется из корня репозитория
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import game
+
+
+@pytest.fixture(scope="session", autouse=True)
+def headless_display():
+    game.init_display(headless_mode=True)
@@ -0,0 +1,84 @@
+import random
+
+import numpy as np
+
+import coop
+
+
+class Receiver:
+    # Сторона клиента: сущности по записям UPDATE ведутся по скорости до следующей поправки
+    def __init__(self):
+        self.entities = {}
+
+    def apply(self, tick, payload, update_count, remove_count):
+        records = np.frombuffer(payload, coop.UPDATE, update_count)
+        removed = np.frombuffer(payload, "<u4", remove_count, records.nbytes)
+        for key in removed.tolist():
+            del self.entities[key]
+        for key, x, y, vx, vy in records.tolist():
+            self.entities[key] = (x * coop.QUANTUM, y * coop.QUANTUM, vx, vy, tick)
+        return len(records)
+
+    def position(self, key, tick):
+        x, y, vx, vy, sent = self.entities[key]
+        return x + vx * (tick - sent), y + vy * (tick - sent)
+
+
+def send(tracker, receiver, tick, keys, x, y, vx=None, vy=None):
+    records, removed = tracker.update(tick, keys, x, y, vx, vy)
+    payload = records.tobytes() + removed.astype("<u4").tobytes()
+    return receiver.apply(tick, payload, len(records), len(removed))
+
+
+def test_delta_round_trip_tracks_moving_entities():
+    rand = random.Random(7)
+    tracker = coop.DeltaTracker()
+    receiver = Receiver()
+    # Сущности: номер -> [x, y, vx, vy]; часть случайно меняет скорость, рождается и исчезает
+    alive = {}
+    next_id = 0
+    for tick in range(300):
+        for number in list(alive):
+            if rand.random() < 0.02:
+                del alive[number]
+        while len(alive) < 40 or rand.random() < 0.1:
+            alive[next_id] = [rand.randint(200, 4000), rand.randint(200, 4000), 0, 0]
+            next_id += 1
+        for entity in alive.values():
+            if rand.random() < 0.05:
+                entity[2], entity[3] = rand.randint(-6, 6), rand.randint(-6, 6)
+            entity[0] += entity[2]
+            entity[1] += entity[3]
+        numbers = list(alive)
+        keys = coop.make_keys([number % 3 for number in numbers], numbers)
+        xs = np.array([alive[n][0] for n in numbers], np.int64)
+        ys = np.array([alive[n][1] for n in numbers], np.int64)
+        send(tracker, receiver, tick, keys, xs, ys)
+
+        # Клиент знает ровно живые сущности и держит их не дальше шага квантования
+        assert sorted(receiver.entities) == sorted(keys.tolist())
+        for key, x, y in zip(keys.tolist(), xs.tolist(), ys.tolist()):
+            shown_x, shown_y = receiver.position(key, tick)
+            assert abs(shown_x - x) < coop.QUANTUM
+            assert abs(shown_y - y) < coop.QUANTUM
+
+
+def test_delta_sends_straight_bullet_once():
+    tracker = coop.DeltaTracker()
+    receiver = Receiver()
+    keys = coop.make_keys([3, 3], [10, 11])
+    sent = 0
+    for tick in range(100):
+        x = np.array([100 + 5 * tick, 900 - 3 * tick], np.int64)
+        y = np.array([300 - 2 * tick, 300], np.int64)
+        sent += send(tracker, receiver, tick, keys, x, y, [5, -3], [-2, 0])
+    assert sent == 2
+    sent = send(tracker, receiver, 100, keys[:1], np.array([600]), np.array([100]), [5], [-2])
+    assert sent == 0
+    assert list(receiver.entities) == keys[:1].tolist()
+
+
+def test_make_keys_keeps_kind_and_wraps_id():
+    keys = coop.make_keys([0, 3], [5, coop.ID_MASK + 2])
+    assert (keys >> coop.KIND_SHIFT).tolist() == [0, 3]
+    assert (keys & coop.ID_MASK).tolist() == [5, 1]
@@ -0,0 +1,33 @@
+import game
+
+
+def test_overlay_toggled_mid_frame_starts_with_next_frame():
+    profiler = game.FrameProfiler()
+    # Кадр, в котором нажали F3: замеров еще нет, stop и end_frame ничего не делают
+    profiler.begin_frame()
+    profiler.start("events")
+    profiler.toggle_overlay()
+    profiler.stop("events")
+    profiler.end_frame()
+    assert profiler.frame == 0
+    assert not profiler.frame_times
+
+    profiler.begin_frame()
+    profiler.start("events")
+    profiler.stop("events")
+    profiler.end_frame()
+    assert profiler.frame == 1
+    assert list(profiler.history) == ["events"]
+
+    # Выключение тоже со следующего кадра: текущий дозамеряется целиком
+    profiler.begin_frame()
+    profiler.start("events")
+    profiler.toggle_overlay()
+    profiler.stop("events")
+    profiler.end_frame()
+    assert profiler.frame == 2
+    profiler.begin_frame()
+    profiler.start("events")
+    profiler.stop("events")
+    profiler.end_frame()
+    assert profiler.frame == 2
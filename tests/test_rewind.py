@@ -0,0 +1,52 @@
+import random
+
+import game
+
+
+def check_entries(buffer, pushed):
+    # Живые снимки не пересекаются и совпадают с последними записанными
+    spans = sorted(buffer.entries)
+    for (offset, size), (next_offset, _) in zip(spans, spans[1:]):
+        assert offset + size <= next_offset
+    assert len(buffer) <= buffer.limit
+    for (offset, size), blob in zip(buffer.entries, pushed[-len(buffer):]):
+        assert bytes(buffer.data[offset:offset + size]) == blob
+
+
+def test_rewind_buffer_wraps_without_overlap():
+    rand = random.Random(1)
+    buffer = game.RewindBuffer(capacity=4096)
+    pushed = []
+    for n in range(5000):
+        blob = rand.randbytes(rand.randint(1, 900))
+        buffer.push(blob)
+        pushed.append(blob)
+        check_entries(buffer, pushed)
+        # Время от времени перематываем назад на несколько снимков
+        if n % 97 == 0:
+            for _ in range(rand.randint(1, 5)):
+                data = buffer.pop()
+                if data is None:
+                    break
+                assert data == pushed.pop()
+            check_entries(buffer, pushed)
+    assert len(buffer) > 1
+
+
+def test_rewind_buffer_limit_and_pop_order():
+    buffer = game.RewindBuffer(capacity=1024)
+    blobs = [bytes([n]) * 10 for n in range(buffer.limit + 20)]
+    for blob in blobs:
+        buffer.push(blob)
+    assert len(buffer) == buffer.limit
+    for blob in reversed(blobs[-buffer.limit:]):
+        assert buffer.pop() == blob
+    assert buffer.pop() is None
+
+
+def test_rewind_buffer_skips_oversized_snapshot():
+    buffer = game.RewindBuffer(capacity=16)
+    buffer.push(b"a" * 8)
+    buffer.push(b"b" * 17)
+    assert len(buffer) == 1
+    assert buffer.pop() == b"a" * 8
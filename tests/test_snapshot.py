@@ -0,0 +1,104 @@
+import pygame
+import pytest
+
+import game
+
+
+def keep_alive(controller, frames):
+    # Игрок бессмертен, чтобы забег не кончился посреди проверки
+    for _ in range(frames):
+        game.step_frame(controller)
+        game.player.health = 99
+    return game.state_checksum()
+
+
+def run(seed, limit, snapshot_at=None, snapshot=None):
+    # Забег как в simulate: до limit кадров, с уровнями и магазином. Снимок с
+    # картой снимается на кадре snapshot_at или забег продолжается с snapshot.
+    game.start_run(seed)
+    preloader = game.LevelPreloader(threaded=False)
+    controller = game.BotController()
+    taken = None
+    door = None
+    if snapshot is not None:
+        door, _ = game.WorldSnapshot.restore(snapshot, controller, preloader)
+    else:
+        preloader.request(game.level)
+    frames = game.game_clock.frame
+    while True:
+        if door is None:
+            plan = preloader.take()
+            preloader.request(game.level + 1)
+            door, _, _ = game.build_level(controller, plan)
+        while game.player.health > 0 and frames < limit:
+            if frames == snapshot_at:
+                taken = game.WorldSnapshot.capture(door, preloader.seed, with_map=True)
+            game.step_frame(controller)
+            frames += 1
+            if pygame.sprite.collide_rect(game.player, door):
+                break
+        if game.player.health <= 0 or frames >= limit:
+            break
+        if game.level % 2 == 0:
+            controller.shop()
+        game.level += 1
+        game.clear_sprites()
+        door = None
+    checksum = game.state_checksum()
+    game.clear_sprites()
+    return checksum, taken
+
+
+@pytest.mark.parametrize("horde", [False, True])
+@pytest.mark.parametrize("extra", [0, 200])
+def test_restore_continues_like_uninterrupted_level(monkeypatch, horde, extra):
+    monkeypatch.setattr(game, "horde_mode", horde)
+    game.start_run(1)
+    game.clear_sprites()
+    controller = game.BotController()
+    door, _, _ = game.build_level(controller)
+    tiles = game.wall_grid.tile_map.floor_tiles()
+    for i in range(extra):
+        game.new_enemy(game.tile_center(tiles[i * 7919 % len(tiles)]))
+    keep_alive(controller, 30)
+
+    snapshot = game.WorldSnapshot.capture(door)
+    expected = keep_alive(controller, 60)
+    door, plan = game.WorldSnapshot.restore(snapshot, controller)
+    assert plan is None
+    assert keep_alive(controller, 60) == expected
+    # Снимок восстановленного мира тот же, что и исходный
+    door, _ = game.WorldSnapshot.restore(snapshot, controller)
+    assert game.WorldSnapshot.capture(door) == snapshot
+    game.clear_sprites()
+
+
+@pytest.mark.parametrize("horde", [False, True])
+@pytest.mark.parametrize("seed, snapshot_at", [(0, 40), (1, 200), (2, 300)])
+def test_saved_snapshot_continues_run(monkeypatch, horde, seed, snapshot_at):
+    monkeypatch.setattr(game, "horde_mode", horde)
+    expected, snapshot = run(seed, 1500, snapshot_at)
+    assert snapshot is not None
+    checksum, _ = run(seed, 1500, snapshot=snapshot)
+    assert checksum == expected
+
+
+def test_restore_rejects_foreign_data():
+    with pytest.raises(ValueError):
+        game.WorldSnapshot.restore(bytes(game.WorldSnapshot.HEADER.size + game.WorldSnapshot.PLAYER.size))
+
+
+def test_load_during_recording_stops_recording(tmp_path):
+    game.start_run(4)
+    game.clear_sprites()
+    door, _, _ = game.build_level(game.BotController())
+    data = game.WorldSnapshot.capture(door, with_map=True)
+    game.clear_sprites()
+
+    path = tmp_path / "run.rec"
+    scene = game.GameplayScene(game.SceneStack(), game.LevelPreloader(threaded=False), str(path), resume=data)
+    # Запись сохранена, а ввод больше в нее не копится
+    assert path.exists()
+    assert scene.recording is None
+    assert isinstance(scene.controller, game.KeyboardController)
+    game.clear_sprites()
@@ -0,0 +1,94 @@
+import random
+
+import numpy as np
+import pygame
+import pytest
+
+import game
+
+T = game.TILE_SIZE
+TOP = 40  # карта начинается под полосой HUD
+
+
+def grid_with_walls(*tiles):
+    tile_map = game.TileMap(12, 12, game.TileMap.FLOOR)
+    for x, y in tiles:
+        tile_map.tiles[y * tile_map.width + x] = game.TileMap.WALL
+    return game.WallGrid(tile_map)
+
+
+def test_tile_map_edges():
+    tile_map = game.TileMap(12, 12)
+    tile_map.fill_rect(-3, -3, 2, 2)
+    assert tile_map.floor_tiles() == [(0, 0), (0, 1), (1, 0), (1, 1)]
+    assert tile_map.is_floor(1, 1)
+    assert not tile_map.is_floor(-1, 0)
+    assert not tile_map.is_floor(0, 12)
+    assert tile_map[2, 2] == game.TileMap.WALL
+    assert tile_map.floor_mask().sum() == 4 and tile_map.floor_mask()[1, 0]
+
+
+def test_collide_rect_at_wall_faces_and_map_edges():
+    walls = grid_with_walls((5, 5), (0, 0))
+    left, top = 5 * T, 5 * T + TOP
+    # Касание грани - не столкновение, заход на пиксель - столкновение
+    assert not walls.collide_rect(pygame.Rect(left - 8, top, 8, 8))
+    assert walls.collide_rect(pygame.Rect(left - 7, top, 8, 8))
+    assert not walls.collide_rect(pygame.Rect(left, top + T, 8, 8))
+    assert walls.collide_rect(pygame.Rect(left + T - 1, top + T - 1, 8, 8))
+    # Часть прямоугольника за картой
+    assert walls.collide_rect(pygame.Rect(-4, TOP - 4, 8, 8))
+    assert not walls.collide_rect(pygame.Rect(12 * T - 4, TOP, 8, 8))
+    assert not walls.collide_rect(pygame.Rect(-50, -50, 8, 8))
+
+
+def test_collide_rects_matches_collide_rect():
+    rand = random.Random(3)
+    walls = grid_with_walls(*{(rand.randrange(12), rand.randrange(12)) for _ in range(30)})
+    x = np.array([rand.randint(-40, 12 * T + 40) for _ in range(2000)])
+    y = np.array([rand.randint(0, 12 * T + 80) for _ in range(2000)])
+    hits = walls.collide_rects(x, y, 10, 10)
+    for i in range(len(x)):
+        assert hits[i] == walls.collide_rect(pygame.Rect(int(x[i]), int(y[i]), 10, 10))
+
+
+@pytest.mark.parametrize("start, move, expected", [
+    ((100, 204), (100, 0), (160 - 108) / 100),  # прямо в грань
+    ((100, 204), (400, 0), (160 - 108) / 400),  # за кадр проходит стену насквозь
+    ((152, 204), (5, 0), 0.0),  # уже касается и движется внутрь
+    ((152, 204), (-20, 0), None),  # касается и уходит
+    ((152, 190), (0, 60), None),  # скользит вдоль грани
+    ((144, 184), (8, 8), None),  # задевает только угол
+    ((144, 184), (9, 9), 8 / 9),  # заходит через угол
+    ((156, 204), (0, 0), 0.0),  # стоит в стене
+    ((100, 100), (0, 0), None),
+    ((152, 204), (-40, -60), None),
+])
+def test_sweep_edges(start, move, expected):
+    walls = grid_with_walls((5, 5))
+    t = walls.sweep(pygame.Rect(start, (8, 8)), *move)
+    if expected is None:
+        assert t is None
+    else:
+        assert t == pytest.approx(expected)
+
+
+def test_sweep_from_outside_the_map():
+    walls = grid_with_walls((0, 0))
+    assert walls.sweep(pygame.Rect(-50, TOP + 4, 8, 8), 100, 0) == pytest.approx(42 / 100)
+    assert walls.sweep(pygame.Rect(-50, TOP + 4, 8, 8), 42, 0) is None
+    assert walls.sweep(pygame.Rect(-500, -500, 8, 8), 10, 10) is None
+
+
+def test_sweep_rects_matches_sweep():
+    rand = random.Random(5)
+    walls = grid_with_walls(*{(rand.randrange(12), rand.randrange(12)) for _ in range(25)})
+    count = 1500
+    x0 = np.array([rand.randint(-60, 12 * T + 60) for _ in range(count)])
+    y0 = np.array([rand.randint(-20, 12 * T + 100) for _ in range(count)])
+    x1 = x0 + np.array([rand.randint(-80, 80) for _ in range(count)])
+    y1 = y0 + np.array([rand.randint(-80, 80) for _ in range(count)])
+    times = walls.sweep_rects(x0, y0, x1, y1, 6, 6)
+    for i in range(count):
+        t = walls.sweep(pygame.Rect(int(x0[i]), int(y0[i]), 6, 6), int(x1[i] - x0[i]), int(y1[i] - y0[i]))
+        assert times[i] == (np.inf if t is None else t)